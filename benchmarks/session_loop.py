@@ -0,0 +1,99 @@
+"""
+Micro-benchmark for the per-token overhead of the ChatSession loop.
+
+Streams a synthetic response through ChatSession with no-op listeners and reports
+the time spent per token, so regressions in the hot loop are easy to spot:
+
+    python -m benchmarks.session_loop --tokens 100000
+"""
+
+import argparse
+import time
+from typing import Iterator, List, Optional
+
+from gptcli.completion import (
+    CancellationToken,
+    CompletionEvent,
+    MessageDeltaEvent,
+    is_cancelled,
+)
+from gptcli.pipeline import CompletionPipeline, PipelineStats
+from gptcli.session import ChatListener, ChatSession
+
+
+class SyntheticAssistant:
+    """
+    Streams `num_tokens` deltas. With `pipeline`, they're read on a separate thread
+    like the real assistant reads streamed responses.
+    """
+
+    def __init__(self, num_tokens: int, token: str, pipeline: bool):
+        self.num_tokens = num_tokens
+        self.token = token
+        self.pipeline = pipeline
+        self.last_pipeline_stats: Optional[PipelineStats] = None
+
+    def init_messages(self):
+        return []
+
+    def complete_chat(
+        self,
+        messages,
+        stream: bool = True,
+        cancel: Optional[CancellationToken] = None,
+        batch_deltas: bool = False,
+    ) -> Iterator[CompletionEvent]:
+        completion_iter = self._deltas(cancel)
+        if not self.pipeline:
+            return completion_iter
+        pipeline = CompletionPipeline(completion_iter, batch=batch_deltas)
+        self.last_pipeline_stats = pipeline.stats
+        return iter(pipeline)
+
+    def _deltas(self, cancel: Optional[CancellationToken]) -> Iterator[CompletionEvent]:
+        token = self.token
+        for _ in range(self.num_tokens):
+            if is_cancelled(cancel):
+                return
+            yield MessageDeltaEvent(token)
+
+
+def run(num_tokens: int, token: str, pipeline: bool, batch_deltas: bool) -> float:
+    session = ChatSession(
+        SyntheticAssistant(num_tokens, token, pipeline),  # type: ignore
+        ChatListener(),
+        pipeline=pipeline,
+        batch_deltas=batch_deltas,
+    )
+    start = time.perf_counter()
+    session.process_input("benchmark")
+    elapsed = time.perf_counter() - start
+    assert len(session.messages[-1]["content"]) == num_tokens * len(token)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tokens", type=int, default=100_000)
+    parser.add_argument("--token", type=str, default="tok ")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    modes: List[tuple] = [
+        ("direct", False, False),
+        ("pipeline", True, False),
+        ("pipeline+batch", True, True),
+    ]
+    for name, pipeline, batch_deltas in modes:
+        best = min(
+            run(args.tokens, args.token, pipeline, batch_deltas)
+            for _ in range(args.repeat)
+        )
+        print(
+            f"{name:>16}: {best * 1000:8.1f}ms total, "
+            f"{best / args.tokens * 1e9:8.1f}ns/token ({args.tokens} tokens)"
+        )
+
+
+if __name__ == "__main__":
+    main()
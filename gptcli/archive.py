@@ -0,0 +1,208 @@
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+from attr import dataclass
+from rich.console import Console
+from rich.text import Text
+
+from gptcli.completion import Message
+from gptcli.ledger import BUSY_TIMEOUT_SECONDS
+from gptcli.session import ChatListener
+
+DEFAULT_ARCHIVE_PATH = os.path.join(
+    os.path.expanduser("~"), ".config", "gpt-cli", "archive.db"
+)
+
+# `messages_fts` is an external-content FTS5 index of `messages`, kept up to date by
+# the trigger
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY,
+    started_at REAL NOT NULL,
+    assistant TEXT
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    conversation_id INTEGER NOT NULL REFERENCES conversations (id),
+    timestamp REAL NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_conversation ON messages (conversation_id, id);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5 (
+    content, content='messages', content_rowid='id', tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+END;
+"""
+
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_END = "\x03"
+SNIPPET_TOKENS = 16
+
+
+@dataclass
+class SearchHit:
+    conversation_id: int
+    message_id: int
+    timestamp: float
+    assistant: Optional[str]
+    role: str
+    # The matching part of the message, with the matched terms between
+    # HIGHLIGHT_START and HIGHLIGHT_END
+    snippet: str
+
+
+def fts_query(query: str) -> str:
+    """
+    Quote every word of the query, so that it's matched literally (all words in any
+    order) instead of being parsed as FTS5 query syntax.
+    """
+    return " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+
+
+class ConversationArchive:
+    """
+    Local SQLite archive of every message of every conversation, with a full-text
+    index. Like the usage ledger, it can be shared by concurrent `gpt` processes.
+    """
+
+    def __init__(self, path: str = DEFAULT_ARCHIVE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            path,
+            timeout=BUSY_TIMEOUT_SECONDS,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def start_conversation(
+        self, assistant: Optional[str] = None, timestamp: Optional[float] = None
+    ) -> int:
+        timestamp = timestamp if timestamp is not None else time.time()
+        with self.lock:
+            cursor = self.connection.execute(
+                "INSERT INTO conversations (started_at, assistant) VALUES (?, ?)",
+                (timestamp, assistant),
+            )
+        assert cursor.lastrowid is not None
+        return cursor.lastrowid
+
+    def add_message(
+        self,
+        conversation_id: int,
+        message: Message,
+        timestamp: Optional[float] = None,
+    ):
+        timestamp = timestamp if timestamp is not None else time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO messages (conversation_id, timestamp, role, content) "
+                "VALUES (?, ?, ?, ?)",
+                (conversation_id, timestamp, message["role"], message["content"]),
+            )
+
+    def search(self, query: str, limit: int = 20) -> List[SearchHit]:
+        """
+        The messages matching all words of the query, best first.
+        """
+        if not query.split():
+            return []
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT m.conversation_id, m.id, m.timestamp, c.assistant, m.role, "
+                "snippet(messages_fts, 0, ?, ?, '…', ?) "
+                "FROM messages_fts "
+                "JOIN messages m ON m.id = messages_fts.rowid "
+                "JOIN conversations c ON c.id = m.conversation_id "
+                "WHERE messages_fts MATCH ? ORDER BY rank LIMIT ?",
+                (
+                    HIGHLIGHT_START,
+                    HIGHLIGHT_END,
+                    SNIPPET_TOKENS,
+                    fts_query(query),
+                    limit,
+                ),
+            ).fetchall()
+        return [SearchHit(*row) for row in rows]
+
+    def conversation(self, conversation_id: int) -> List[Message]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT role, content FROM messages WHERE conversation_id = ? "
+                "ORDER BY id",
+                (conversation_id,),
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class ArchiveChatListener(ChatListener):
+    """
+    Adds every message of the session to the archive as it's sent or received. A
+    conversation is only created once it has a message, and clearing the session
+    starts a new one.
+    """
+
+    def __init__(self, archive: ConversationArchive, assistant_name: Optional[str]):
+        self.archive = archive
+        self.assistant_name = assistant_name
+        self.conversation_id: Optional[int] = None
+        self.logger = logging.getLogger("gptcli-archive")
+
+    def on_chat_clear(self):
+        self.conversation_id = None
+
+    def on_chat_message(self, message: Message):
+        try:
+            if self.conversation_id is None:
+                self.conversation_id = self.archive.start_conversation(
+                    self.assistant_name
+                )
+            self.archive.add_message(self.conversation_id, message)
+        except sqlite3.Error:
+            self.logger.exception("Failed to archive the message")
+
+
+def highlighted(snippet: str) -> Text:
+    text = Text()
+    for i, part in enumerate(snippet.split(HIGHLIGHT_START)):
+        highlight, _, rest = part.rpartition(HIGHLIGHT_END) if i else ("", "", part)
+        text.append(highlight, style="bold yellow")
+        text.append(rest)
+    return text
+
+
+def print_search_results(hits: List[SearchHit], console: Optional[Console] = None):
+    console = console or Console()
+    if not hits:
+        console.print("No matches.")
+        return
+
+    for hit in hits:
+        sent_at = datetime.datetime.fromtimestamp(hit.timestamp)
+        header = Text(
+            f"#{hit.conversation_id} {sent_at:%Y-%m-%d %H:%M} "
+            f"{hit.assistant or ''} {hit.role}",
+            style="dim",
+        )
+        console.print(header)
+        console.print(highlighted(" ".join(hit.snippet.split())))
+        console.print()
+    console.print(
+        "[dim]Use `gpt --resume <number>` to continue a conversation in a new session.[/dim]"
+    )
@@ -1,20 +1,65 @@
+import copy
+import logging
 import os
 import sys
 from attr import dataclass
 import platform
-from typing import Any, Dict, Iterator, Optional, TypedDict, List
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple, TypedDict, List
 
 from gptcli.completion import (
+    BadRequestError,
+    CancellationToken,
+    CompletionError,
     CompletionEvent,
     CompletionProvider,
     Message,
+    MessageDeltaEvent,
+    ResponseBuffer,
+    ToolCall,
+    ToolCallEvent,
+    UsageEvent,
+    is_cancelled,
 )
+from gptcli.failover import BreakerRegistry, CircuitBreakerConfig
+from gptcli.pipeline import CompletionPipeline, PipelineStats
+from gptcli.pricing import estimate_usage
 from gptcli.providers.google import GoogleCompletionProvider
 from gptcli.providers.llama import LLaMACompletionProvider
 from gptcli.providers.openai import OpenAICompletionProvider
 from gptcli.providers.anthropic import AnthropicCompletionProvider
 from gptcli.providers.cohere import CohereCompletionProvider
 from gptcli.providers.azure_openai import AzureOpenAICompletionProvider
+from gptcli.router import ModelRouter, RoutingConfig
+from gptcli.tools import ToolExecutor, ToolResult, describe_call
+from gptcli.tracing import get_tracer, set_http_span
+
+
+class TimeoutConfig(TypedDict, total=False):
+    """
+    Timeouts in seconds. `first_token` and `idle` only apply to streamed responses.
+    """
+
+    connect: float
+    # From sending the request until the first event of the response
+    first_token: float
+    # Between two events of the response
+    idle: float
+
+
+# Requests in a single turn that call tools, after which the turn ends
+MAX_TOOL_ROUNDS = 10
+
+# httpx closes connections that have been idle for 5 seconds, so a connection is
+# refreshed if it may have been idle for longer than this
+PREWARM_INTERVAL = 4.0
+
+# Streams are only watched when `first_token` or `idle` is set: reasoning models can
+# think for minutes before their first token
+TIMEOUT_DEFAULTS: TimeoutConfig = {
+    "connect": 10.0,
+}
 
 
 class AssistantConfig(TypedDict, total=False):
@@ -25,12 +70,27 @@ class AssistantConfig(TypedDict, total=False):
     temperature: float
     top_p: float
     thinking_budget: Optional[int]
+    # Candidate models to route each turn to, see `gptcli.router.ModelRouter`
+    models: List[str]
+    routing: RoutingConfig
+    # Models to fail over to, in order, when the model's backend fails
+    fallback_models: List[str]
+    circuit_breaker: CircuitBreakerConfig
+    timeouts: TimeoutConfig
+    # How many times an interrupted response is continued from where it stopped
+    resume_attempts: int
+    # Names of the tools (defined under `tools` in the config) the model can call
+    tools: List[str]
+    # JSON schema the responses must follow, using the provider's JSON mode. Empty
+    # for any JSON value
+    json_schema: Dict[str, Any]
 
 
 CONFIG_DEFAULTS = {
     "model": "gpt-3.5-turbo",
     "temperature": 0.7,
     "top_p": 1.0,
+    "resume_attempts": 0,
 }
 
 DEFAULT_ASSISTANTS: Dict[str, AssistantConfig] = {
@@ -69,11 +129,7 @@ User's `uname`: {platform.uname()}. User's `$SHELL`: {os.environ.get('SHELL')}."
 }
 
 
-def get_completion_provider(
-    model: str,
-    openai_base_url_override: Optional[str] = None,
-    openai_api_key_override: Optional[str] = None,
-) -> CompletionProvider:
+def get_provider_name(model: str) -> str:
     if (
         model.startswith("gpt")
         or model.startswith("ft:gpt")
@@ -83,26 +139,140 @@ def get_completion_provider(
         or model.startswith("o3")
         or model.startswith("o4")
     ):
+        return "openai"
+    elif model.startswith("oai-azure:"):
+        return "azure_openai"
+    elif model.startswith("claude"):
+        return "anthropic"
+    elif model.startswith("llama"):
+        return "llama"
+    elif model.startswith("command") or model.startswith("c4ai"):
+        return "cohere"
+    elif model.startswith("gemini") or model.startswith("gemma"):
+        return "google"
+    else:
+        raise ValueError(f"Unknown model: {model}")
+
+
+_providers: Dict[Tuple[str, Optional[str], Optional[str]], CompletionProvider] = {}
+_providers_lock = threading.Lock()
+
+
+def get_completion_provider(
+    model: str,
+    openai_base_url_override: Optional[str] = None,
+    openai_api_key_override: Optional[str] = None,
+) -> CompletionProvider:
+    """
+    Providers are created once per provider and endpoint and then shared, so that all
+    requests (and threads) reuse the same API clients and their connection pools.
+    """
+    key = (
+        get_provider_name(model),
+        openai_base_url_override,
+        openai_api_key_override,
+    )
+    with _providers_lock:
+        if key not in _providers:
+            _providers[key] = create_completion_provider(
+                model, openai_base_url_override, openai_api_key_override
+            )
+        return _providers[key]
+
+
+def create_completion_provider(
+    model: str,
+    openai_base_url_override: Optional[str] = None,
+    openai_api_key_override: Optional[str] = None,
+) -> CompletionProvider:
+    provider_name = get_provider_name(model)
+    if provider_name == "openai":
         return OpenAICompletionProvider(
             openai_base_url_override, openai_api_key_override
         )
-    elif model.startswith("oai-azure:"):
+    elif provider_name == "azure_openai":
         return AzureOpenAICompletionProvider()
-    elif model.startswith("claude"):
+    elif provider_name == "anthropic":
         return AnthropicCompletionProvider()
-    elif model.startswith("llama"):
+    elif provider_name == "llama":
         return LLaMACompletionProvider()
-    elif model.startswith("command") or model.startswith("c4ai"):
+    elif provider_name == "cohere":
         return CohereCompletionProvider()
-    elif model.startswith("gemini") or model.startswith("gemma"):
-        return GoogleCompletionProvider()
     else:
-        raise ValueError(f"Unknown model: {model}")
+        return GoogleCompletionProvider()
+
+
+@dataclass
+class RequestTiming:
+    """
+    Timestamps (`time.perf_counter()`) taken at the provider boundary, i.e. when the
+    provider iterator is first pulled, yields its first event and is exhausted.
+    """
+
+    started_at: float
+    first_event_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+
+class AssistantListener:
+    """
+    Receives every request made through an assistant, whichever mode (interactive,
+    `--prompt`, ...) made it.
+    """
+
+    def on_request(self, model: str):
+        """
+        Called before a request is sent. Raising an exception cancels the request.
+        """
+        pass
+
+    def on_usage(self, model: str, usage: UsageEvent):
+        pass
 
 
 class Assistant:
-    def __init__(self, config: AssistantConfig):
+    def __init__(self, config: AssistantConfig, name: Optional[str] = None):
         self.config = config
+        self.name = name
+        self.listeners: List[AssistantListener] = []
+        self.last_timing: Optional[RequestTiming] = None
+        self.last_model: Optional[str] = None
+        self.last_usage: Optional[UsageEvent] = None
+        # The messages of the last request, e.g. the continuation messages of a
+        # resumed response, and the text received in response so far
+        self.last_messages: List[Message] = []
+        self.last_response = ResponseBuffer()
+        self.last_pipeline_stats: Optional[PipelineStats] = None
+        self.router: Optional[ModelRouter] = None
+        self.breakers: Optional[BreakerRegistry] = None
+        self.tools: Optional[ToolExecutor] = None
+        # When each provider's connection was last used (`time.monotonic()`)
+        self.connections_used: Dict[CompletionProvider, float] = {}
+        self.connections_lock = threading.Lock()
+        self.logger = logging.getLogger("gptcli-assistant")
+        if config.get("models"):
+            self.router = ModelRouter(
+                self._param("model"), config["models"], config.get("routing", {})
+            )
+        if config.get("fallback_models"):
+            self.breakers = BreakerRegistry(
+                config.get("circuit_breaker", {}), probe=self._probe
+            )
+
+    def fork(self) -> "Assistant":
+        """
+        An assistant sharing this one's configuration, listeners, router, circuit
+        breakers and connections, with its own state of the last request, for
+        requests made while this one's are in flight.
+        """
+        forked = copy.copy(self)
+        forked.last_timing = None
+        forked.last_model = None
+        forked.last_usage = None
+        forked.last_messages = []
+        forked.last_response = ResponseBuffer()
+        forked.last_pipeline_stats = None
+        return forked
 
     @classmethod
     def from_config(cls, name: str, config: AssistantConfig):
@@ -115,7 +285,7 @@ class Assistant:
                 if config.get(key) is None:
                     config[key] = default_config[key]
 
-        return cls(config)
+        return cls(config, name)
 
     def init_messages(self) -> List[Message]:
         return self.config.get("messages", [])[:]
@@ -125,30 +295,532 @@ class Assistant:
         # Otherwise, use the default value
         return self.config.get(param, CONFIG_DEFAULTS.get(param, None))
 
-    def complete_chat(self, messages, stream: bool = True) -> Iterator[CompletionEvent]:
-        model = self._param("model")
-        completion_provider = get_completion_provider(
-            model,
-            self._param("openai_base_url_override"),
-            self._param("openai_api_key_override"),
-        )
+    def active_model(self) -> str:
+        """
+        The model of the last request, or the configured model if there was none.
+        """
+        return self.last_model or self._param("model")
 
+    def choose_model(self, messages: List[Message]) -> str:
+        if self.router is None:
+            return self._param("model")
+        return self.router.choose(messages)
+
+    def _timeouts(self) -> TimeoutConfig:
+        return {**TIMEOUT_DEFAULTS, **self.config.get("timeouts", {})}
+
+    def _args(self, model: str, stream: bool = True) -> Dict[str, Any]:
+        timeouts = self._timeouts()
         args = {
             "model": model,
             "temperature": float(self._param("temperature")),
             "top_p": float(self._param("top_p")),
+            "connect_timeout": timeouts["connect"],
         }
+        limits = [
+            timeouts[phase] for phase in ("first_token", "idle") if phase in timeouts
+        ]
+        if stream and limits:
+            # The watchdog enforces the exact limits, this unblocks the reader thread
+            # of a stream that hangs at the socket level
+            args["read_timeout"] = max(limits)
 
         # Add thinking budget if it's specified and we're using Claude 3.7
         thinking_budget = self.config.get("thinking_budget")
         if thinking_budget is not None and "claude-3-7" in model:
             args["thinking_budget"] = thinking_budget
 
-        return completion_provider.complete(
-            messages,
-            args,
-            stream,
+        if self.tools is not None:
+            args["tools"] = self.tools.definitions()
+
+        json_schema = self.config.get("json_schema")
+        if json_schema is not None:
+            args["json_schema"] = json_schema
+
+        return args
+
+    def _completion_provider(self, model: str) -> CompletionProvider:
+        return get_completion_provider(
+            model,
+            self._param("openai_base_url_override"),
+            self._param("openai_api_key_override"),
+        )
+
+    def _mark_used(self, provider: CompletionProvider):
+        with self.connections_lock:
+            self.connections_used[provider] = time.monotonic()
+
+    def prewarm(self) -> Optional[threading.Thread]:
+        """
+        Open or refresh, on a background thread, the connections to the endpoints the
+        next request may go to: the active model's, and those of the models it may be
+        routed to. Connections used in the last `PREWARM_INTERVAL` seconds are left
+        alone, so this can be called on every key press. Returns the thread, or None
+        if there was nothing to do.
+        """
+        models = [self.active_model()]
+        if self.router is not None:
+            models.extend(self.router.models)
+
+        now = time.monotonic()
+        providers = []
+        for model in models:
+            try:
+                provider = self._completion_provider(model)
+            except ValueError:
+                continue
+            with self.connections_lock:
+                last_used = self.connections_used.get(provider)
+                if last_used is not None and now - last_used < PREWARM_INTERVAL:
+                    continue
+                self.connections_used[provider] = now
+            providers.append(provider)
+        if not providers:
+            return None
+
+        thread = threading.Thread(
+            target=self._prewarm, args=(providers,), name="gptcli-prewarm", daemon=True
+        )
+        thread.start()
+        return thread
+
+    def _prewarm(self, providers: List[CompletionProvider]):
+        timeout = self._timeouts()["connect"]
+        for provider in providers:
+            try:
+                with get_tracer().span("assistant.prewarm"):
+                    provider.prewarm(timeout)
+            except Exception:
+                # The request will open its own connection
+                self.logger.debug("Failed to pre-warm a connection", exc_info=True)
+
+    def complete_chat(
+        self,
+        messages,
+        stream: bool = True,
+        cancel: Optional[CancellationToken] = None,
+        batch_deltas: bool = False,
+    ) -> Iterable[CompletionEvent]:
+        """
+        Streamed responses are read on a separate thread, see `CompletionPipeline`,
+        when the assistant sets a first-token or idle timeout or with `batch_deltas`,
+        which merges the deltas that queue up while the consumer is busy. Then
+        `last_pipeline_stats` has the stats of the last request.
+        """
+        # The iterator may be consumed on another thread, so capture the parent now
+        parent_span = get_tracer().current_span()
+        if self.tools is not None:
+            return self._with_tools(messages, stream, parent_span, cancel, batch_deltas)
+        return self._turn(messages, stream, parent_span, cancel, batch_deltas)
+
+    def _with_tools(
+        self,
+        messages,
+        stream: bool,
+        parent_span: Any,
+        cancel: Optional[CancellationToken] = None,
+        batch_deltas: bool = False,
+    ) -> Iterator[CompletionEvent]:
+        """
+        Streams the response, running the tools the model calls and sending their
+        outputs back until the model answers without calling any. The calls of a
+        request run concurrently, and a `ToolCallEvent` with the latency is yielded
+        as each one returns. The usage of all the requests is summed into a single
+        usage event.
+        """
+        assert self.tools is not None
+        messages = list(messages)
+        usage: Optional[UsageEvent] = None
+        has_text = False
+        for round in range(MAX_TOOL_ROUNDS + 1):
+            text = ResponseBuffer()
+            calls: List[ToolCall] = []
+            for event in self._turn(
+                messages, stream, parent_span, cancel, batch_deltas
+            ):
+                if event.type == "tool_request":
+                    calls.append(event.call)
+                    continue
+                if event.type == "usage":
+                    usage = _add_usage(usage, event)
+                    continue
+                if event.type == "message_delta":
+                    if not text and has_text and event.text:
+                        # Separate the text before the tool calls from the answer
+                        yield MessageDeltaEvent("\n\n")
+                    text.append(event.text)
+                yield event
+            has_text = has_text or bool(text)
+
+            if not calls or is_cancelled(cancel):
+                break
+            if round == MAX_TOOL_ROUNDS:
+                yield ToolCallEvent(f"Stopped after {MAX_TOOL_ROUNDS} rounds of tools")
+                break
+
+            for call in calls:
+                yield ToolCallEvent(f"Calling {describe_call(call)}...", call["name"])
+            results: Dict[str, ToolResult] = {}
+            for result in self.tools.run(calls, parent_span):
+                results[result.call["id"]] = result
+                yield ToolCallEvent(
+                    result.summary(), result.call["name"], result.latency
+                )
+
+            messages.append(
+                {"role": "assistant", "content": text.getvalue(), "tool_calls": calls}
+            )
+            messages.extend(results[call["id"]].message() for call in calls)
+
+        if usage is not None:
+            yield usage
+
+    def _turn(
+        self,
+        messages,
+        stream: bool,
+        parent_span: Any,
+        cancel: Optional[CancellationToken] = None,
+        batch_deltas: bool = False,
+    ) -> Iterable[CompletionEvent]:
+        model = self.choose_model(messages)
+        if self.breakers is None:
+            return self._complete(
+                messages, model, stream, parent_span, cancel, batch_deltas
+            )
+
+        chain = [model] + [
+            fallback
+            for fallback in self.config.get("fallback_models", [])
+            if fallback != model
+        ]
+        return self._failover(
+            messages, chain, stream, parent_span, cancel, batch_deltas
+        )
+
+    def _request(
+        self,
+        messages,
+        model: str,
+        stream: bool,
+        parent_span: Any,
+        cancel: Optional[CancellationToken] = None,
+        batch_deltas: bool = False,
+    ) -> Iterable[CompletionEvent]:
+        self.last_model = model
+        self.last_usage = None
+        self.last_messages = messages
+        response = self.last_response = ResponseBuffer()
+        for listener in self.listeners:
+            listener.on_request(model)
+
+        timeouts = self._timeouts()
+        watched = "first_token" in timeouts or "idle" in timeouts
+        use_pipeline = stream and (batch_deltas or watched)
+        if use_pipeline:
+            # The pipeline aborts the request when it times out or is closed early,
+            # without cancelling the rest of the turn
+            cancel = cancel.child() if cancel is not None else CancellationToken()
+
+        completion_provider = self._completion_provider(model)
+        self._mark_used(completion_provider)
+        completion_iter = self._timed(
+            completion_provider.complete(
+                messages, self._args(model, stream), stream, cancel
+            ),
+            model,
+            parent_span=parent_span,
+            provider=completion_provider,
+            response=response,
+        )
+        if not use_pipeline:
+            self.last_pipeline_stats = None
+            return completion_iter
+
+        # Read the stream on a separate thread, so that a stalled stream can be
+        # aborted when it times out and deltas can be batched while rendering lags
+        pipeline = CompletionPipeline(
+            completion_iter,
+            batch=batch_deltas,
+            cancel=cancel,
+            first_event_timeout=timeouts.get("first_token"),
+            idle_timeout=timeouts.get("idle"),
+        )
+        self.last_pipeline_stats = pipeline.stats
+        return pipeline
+
+    def _complete(
+        self,
+        messages,
+        model: str,
+        stream: bool,
+        parent_span: Any,
+        cancel: Optional[CancellationToken] = None,
+        batch_deltas: bool = False,
+    ) -> Iterable[CompletionEvent]:
+        if stream and self._param("resume_attempts"):
+            return self._resumable(
+                messages, model, stream, parent_span, cancel, batch_deltas
+            )
+        return self._request(messages, model, stream, parent_span, cancel, batch_deltas)
+
+    def _resumable(
+        self,
+        messages,
+        model: str,
+        stream: bool,
+        parent_span: Any,
+        cancel: Optional[CancellationToken] = None,
+        batch_deltas: bool = False,
+    ) -> Iterator[CompletionEvent]:
+        """
+        Streams the response. If the stream fails or stalls after part of the
+        response was received, the model is asked to continue the partial response,
+        and the continuation is stitched into the same stream. The usage of all the
+        attempts is summed into a single usage event; the usage of an interrupted
+        attempt is estimated, since providers only report it at the end.
+        """
+        partial = ResponseBuffer()
+        usage: Optional[UsageEvent] = None
+        first_timing: Optional[RequestTiming] = None
+        resumes = 0
+        strip_whitespace = False
+        attempt_messages = messages
+        completion_iter = iter(
+            self._request(messages, model, stream, parent_span, cancel, batch_deltas)
+        )
+        while True:
+            attempt_text = ResponseBuffer()
+            attempt_usage: Optional[UsageEvent] = None
+            try:
+                for event in completion_iter:
+                    if first_timing is None:
+                        first_timing = self.last_timing
+                    if event.type == "usage":
+                        attempt_usage = event
+                        continue
+                    if event.type == "message_delta":
+                        if strip_whitespace:
+                            # The partial response already ended with whitespace
+                            text = event.text.lstrip()
+                            if not text:
+                                continue
+                            strip_whitespace = False
+                            event = MessageDeltaEvent(text)
+                        partial.append(event.text)
+                        attempt_text.append(event.text)
+                    yield event
+                usage = _add_usage(usage, attempt_usage)
+                break
+            except BadRequestError:
+                raise
+            except Exception as e:
+                if (
+                    not partial
+                    or resumes >= self._param("resume_attempts")
+                    or is_cancelled(cancel)
+                ):
+                    raise
+                resumes += 1
+
+                if attempt_usage is None:
+                    attempt_usage = estimate_usage(
+                        model, attempt_messages, attempt_text.getvalue()
+                    )
+                    if attempt_usage is not None:
+                        for listener in self.listeners:
+                            listener.on_usage(model, attempt_usage)
+                usage = _add_usage(usage, attempt_usage)
+
+                self.logger.warning(
+                    "Response from %s interrupted after %d characters (%s), "
+                    "continuing it (attempt %d)",
+                    model,
+                    len(partial),
+                    e,
+                    resumes,
+                )
+                text = partial.getvalue()
+                strip_whitespace = text != text.rstrip()
+                attempt_messages = self._completion_provider(
+                    model
+                ).continuation_messages(messages, text, self._args(model, stream))
+                completion_iter = iter(
+                    self._request(
+                        attempt_messages,
+                        model,
+                        stream,
+                        parent_span,
+                        cancel,
+                        batch_deltas,
+                    )
+                )
+
+        if resumes and first_timing is not None and self.last_timing is not None:
+            # Report the timing of the whole response rather than the last attempt
+            self.last_timing = RequestTiming(
+                started_at=first_timing.started_at,
+                first_event_at=first_timing.first_event_at,
+                finished_at=self.last_timing.finished_at,
+            )
+        if usage is not None:
+            yield usage
+
+    def _failover(
+        self,
+        messages,
+        chain: List[str],
+        stream: bool,
+        parent_span: Any,
+        cancel: Optional[CancellationToken] = None,
+        batch_deltas: bool = False,
+    ) -> Iterator[CompletionEvent]:
+        """
+        Tries the models in `chain` in order, skipping those whose circuit breaker is
+        open. Only fails over until the first event is received: after that the
+        response has been partially shown, and errors are raised as usual.
+        """
+        assert self.breakers is not None
+        errors: List[str] = []
+        last_error: Optional[Exception] = None
+        for model in chain:
+            if is_cancelled(cancel):
+                return
+            breaker = self.breakers.get(model)
+            if not breaker.allow():
+                self.logger.info("Skipping %s, its circuit is open", model)
+                errors.append(f"{model}: circuit open")
+                continue
+
+            try:
+                completion_iter = iter(
+                    self._complete(
+                        messages, model, stream, parent_span, cancel, batch_deltas
+                    )
+                )
+                first_event = next(completion_iter)
+            except StopIteration:
+                breaker.record_success()
+                return
+            except BadRequestError:
+                raise
+            except Exception as e:
+                breaker.record_failure()
+                self.logger.warning("Request to %s failed: %s", model, e)
+                errors.append(f"{model}: {e}")
+                last_error = e
+                continue
+
+            timing = self.last_timing
+            breaker.record_success(
+                timing.first_event_at - timing.started_at
+                if timing is not None and timing.first_event_at is not None
+                else None
+            )
+            yield first_event
+            try:
+                yield from completion_iter
+            except BadRequestError:
+                raise
+            except Exception:
+                breaker.record_failure()
+                raise
+            return
+
+        raise CompletionError("All models failed: " + "; ".join(errors)) from last_error
+
+    def cancelled_usage(self) -> Optional[UsageEvent]:
+        """
+        Usage of the last request after it was cancelled. Providers only report the
+        usage at the end of a response, so unless it was reported already, it's
+        estimated from the request's messages and the text received since it was
+        sent, and passed on to the listeners. The attempts of a resumed response
+        before the last one were already accounted for.
+        """
+        if self.last_usage is not None:
+            return self.last_usage
+        usage = estimate_usage(
+            self.active_model(), self.last_messages, self.last_response.getvalue()
         )
+        if usage is not None:
+            self.last_usage = usage
+            for listener in self.listeners:
+                listener.on_usage(self.active_model(), usage)
+        return usage
+
+    def _probe(self, model: str):
+        """
+        Check that a backend is reachable again with the same models-list request that
+        pre-warms connections, which isn't billed, so probes bypass the budget and
+        the ledger safely. It doesn't check that completions work: the circuit
+        breaker opens again if the first request after a probe fails.
+        """
+        with get_tracer().span("assistant.probe", model=model):
+            self._completion_provider(model).prewarm(self._timeouts()["connect"])
+
+    def _timed(
+        self,
+        completion_iter: Iterator[CompletionEvent],
+        model: str,
+        parent_span: Any = None,
+        provider: Optional[CompletionProvider] = None,
+        response: Optional[ResponseBuffer] = None,
+    ) -> Iterator[CompletionEvent]:
+        timing = RequestTiming(started_at=time.perf_counter())
+        self.last_timing = timing
+
+        tracer = get_tracer()
+        span = tracer.start_span(
+            "assistant.complete_chat", parent=parent_span, model=model
+        )
+        setup_span = tracer.start_span("provider.setup", parent=span)
+        stream_span = None
+        set_http_span(span, setup_span)
+        error: Optional[BaseException] = None
+        try:
+            for event in completion_iter:
+                if timing.first_event_at is None:
+                    timing.first_event_at = time.perf_counter()
+                    set_http_span()
+                    setup_span.end()
+                    span.add_event("provider.first_event")
+                    stream_span = tracer.start_span("provider.stream", parent=span)
+                if event.type == "usage":
+                    self.last_usage = event
+                    for listener in self.listeners:
+                        listener.on_usage(model, event)
+                elif event.type == "message_delta" and response is not None:
+                    response.append(event.text)
+                yield event
+        except GeneratorExit:
+            raise
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            timing.finished_at = time.perf_counter()
+            if provider is not None:
+                # Idle time starts now, not when the request was sent
+                self._mark_used(provider)
+            if self.router is not None and timing.first_event_at is not None:
+                self.router.record_ttft(
+                    model, timing.first_event_at - timing.started_at
+                )
+            set_http_span()
+            setup_span.end(error)
+            if stream_span is not None:
+                stream_span.end(error)
+            span.end(error)
+
+
+def _add_usage(
+    usage: Optional[UsageEvent], other: Optional[UsageEvent]
+) -> Optional[UsageEvent]:
+    if usage is None:
+        return other
+    if other is None:
+        return usage
+    return usage + other
 
 
 @dataclass
@@ -176,7 +848,9 @@ def init_assistant(
     if args.temperature is not None:
         assistant.config["temperature"] = args.temperature
     if args.model is not None:
+        # An explicitly requested model disables routing
         assistant.config["model"] = args.model
+        assistant.router = None
     if args.top_p is not None:
         assistant.config["top_p"] = args.top_p
     if args.thinking_budget is not None:
@@ -0,0 +1,225 @@
+import glob
+import hashlib
+import json
+import os
+import sys
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO
+
+from gptcli.assistant import Assistant
+from gptcli.completion import Message, ResponseBuffer, UsageEvent
+from gptcli.ledger import BudgetExceededError
+from gptcli.mapreduce import bounded_map
+
+MANIFEST_FILENAME = ".gptcli-map.json"
+
+DONE = "done"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+
+def expand_globs(patterns: Iterable[str]) -> Iterator[str]:
+    """
+    Files matching the glob patterns (`**` matches any number of directories), lazily
+    and without duplicates.
+    """
+    seen = set()
+    for pattern in patterns:
+        for path in glob.iglob(os.path.expanduser(pattern), recursive=True):
+            if os.path.isfile(path) and path not in seen:
+                seen.add(path)
+                yield path
+
+
+def mirrored_path(output_dir: str, path: str, suffix: str = "") -> str:
+    """
+    The path of the output for the input file `path`, at the same place relative to
+    `output_dir` as the input relative to the current directory. Inputs outside the
+    current directory are mirrored by their absolute path.
+    """
+    relative = os.path.relpath(path)
+    if relative.startswith(os.pardir):
+        relative = os.path.splitdrive(os.path.abspath(path))[1].lstrip(os.sep)
+    return os.path.join(output_dir, relative + suffix)
+
+
+def render_prompt(template: str, path: str, content: str) -> str:
+    """
+    Substitute `{path}` and `{content}` in the template. The content is appended if the
+    template doesn't reference it.
+    """
+    if "{content}" not in template:
+        template += "\n\n{content}"
+    return template.replace("{path}", path).replace("{content}", content)
+
+
+def sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class Manifest:
+    """
+    The content and prompt hashes of the outputs written by previous runs, and the
+    files that failed, stored as JSON in the output directory. It's rewritten after
+    every file, so that an interrupted run picks up where it stopped.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries: Dict[str, Dict[str, str]] = {}
+        if os.path.isfile(path):
+            with open(path, "r") as f:
+                self.entries = json.load(f)
+
+    def is_current(self, key: str, content_hash: str, prompt_hash: str) -> bool:
+        with self.lock:
+            entry = self.entries.get(key)
+        return entry == {"content": content_hash, "prompt": prompt_hash}
+
+    def update(self, key: str, content_hash: str, prompt_hash: str):
+        self._write(key, {"content": content_hash, "prompt": prompt_hash})
+
+    def mark_failed(self, key: str, error: str):
+        """
+        Record that the file failed, so that it's processed again by the next run.
+        """
+        self._write(key, {"status": FAILED, "error": error})
+
+    def _write(self, key: str, entry: Dict[str, str]):
+        with self.lock:
+            self.entries[key] = entry
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w") as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+            os.replace(temp_path, self.path)
+
+
+class FileMapper:
+    """
+    Applies a prompt template to every file matching some globs, on a pool of
+    `parallelism` threads sharing the assistant's provider clients, and writes the
+    responses to a mirrored directory tree under `output_dir`.
+
+    Files whose content, prompt and assistant haven't changed since they were last
+    processed are skipped, unless `force` is set.
+    """
+
+    def __init__(
+        self,
+        assistant: Assistant,
+        template: str,
+        output_dir: str,
+        parallelism: int,
+        suffix: str = "",
+        force: bool = False,
+        progress: Optional[TextIO] = sys.stderr,
+    ):
+        self.assistant = assistant
+        self.template = template
+        self.output_dir = output_dir
+        self.parallelism = parallelism
+        self.suffix = suffix
+        self.force = force
+        self.progress = progress
+        self.manifest = Manifest(os.path.join(output_dir, MANIFEST_FILENAME))
+        self.prompt_hash = sha256(
+            json.dumps(
+                [template, assistant.init_messages(), assistant.config.get("model")]
+            ).encode()
+        )
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.done = 0
+        self.usage: Optional[UsageEvent] = None
+        self.stopped = False
+
+    def run(self, patterns: List[str]) -> Dict[str, int]:
+        """
+        Process the files, and return the number of files by outcome.
+        """
+
+        def paths():
+            for path in expand_globs(patterns):
+                # Stop dispatching files once the budget is exhausted
+                if self.stopped:
+                    return
+                with self.lock:
+                    self.submitted += 1
+                yield path
+
+        counts = {DONE: 0, SKIPPED: 0, FAILED: 0}
+        futures = list(bounded_map(self._process, paths(), self.parallelism))
+        for future in futures:
+            counts[future.result()] += 1
+        return counts
+
+    def _process(self, path: str) -> str:
+        """
+        Process a file. Errors only fail that file, the others are still processed.
+        """
+        output_path = mirrored_path(self.output_dir, path, self.suffix)
+        key = os.path.relpath(output_path, self.output_dir)
+        try:
+            return self._process_file(path, output_path, key)
+        except BudgetExceededError as e:
+            # Stop dispatching files once the budget is exhausted
+            self.stopped = True
+            error: Exception = e
+        except Exception as e:
+            # Unreadable inputs, unwritable outputs and provider errors alike
+            error = e
+        try:
+            self.manifest.mark_failed(key, str(error))
+        except OSError:
+            pass
+        self._report(path, f"failed: {error}")
+        return FAILED
+
+    def _process_file(self, path: str, output_path: str, key: str) -> str:
+        with open(path, "rb") as f:
+            data = f.read()
+        content_hash = sha256(data)
+
+        if (
+            not self.force
+            and os.path.exists(output_path)
+            and self.manifest.is_current(key, content_hash, self.prompt_hash)
+        ):
+            self._report(path, "unchanged, skipped")
+            return SKIPPED
+
+        messages: List[Message] = self.assistant.init_messages()
+        content = data.decode("utf-8", errors="replace")
+        messages.append(
+            {"role": "user", "content": render_prompt(self.template, path, content)}
+        )
+        response = ResponseBuffer()
+        usage: Optional[UsageEvent] = None
+        for event in self.assistant.complete_chat(messages, stream=False):
+            if event.type == "message_delta":
+                response.append(event.text)
+            elif event.type == "usage":
+                usage = event
+
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        with open(output_path, "w") as f:
+            f.write(response.getvalue())
+        self.manifest.update(key, content_hash, self.prompt_hash)
+
+        with self.lock:
+            if usage is not None:
+                self.usage = usage if self.usage is None else self.usage + usage
+        cost = f", ${usage.cost:.4f}" if usage is not None else ""
+        self._report(path, f"-> {output_path}{cost}")
+        return DONE
+
+    def _report(self, path: str, outcome: str):
+        with self.lock:
+            self.done += 1
+            if self.progress is not None:
+                self.progress.write(
+                    f"[{self.done}/{self.submitted}] {path} {outcome}\n"
+                )
+                self.progress.flush()
@@ -1,18 +1,23 @@
-from typing import Optional
+import hashlib
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
 
 from openai import BadRequestError, OpenAIError
 from prompt_toolkit import PromptSession
-from prompt_toolkit.history import FileHistory
+from prompt_toolkit.history import History
 from prompt_toolkit.key_binding import KeyBindings, KeyPressEvent
 from prompt_toolkit.key_binding.bindings import named_commands
+from prompt_toolkit.keys import Keys
 from rich.console import Console
 from rich.live import Live
 from rich.markdown import Markdown
 from rich.text import Text
 
-from gptcli.completion import ToolCallEvent
+from gptcli.completion import Message, ResponseBuffer, ToolCallEvent
 from gptcli.session import (
-    ALL_COMMANDS,
     COMMAND_CLEAR,
     COMMAND_QUIT,
     COMMAND_RERUN,
@@ -21,6 +26,8 @@ from gptcli.session import (
     ResponseStreamer,
     UserInputProvider,
 )
+from gptcli.profiling import hot_path
+from gptcli.tracing import traced
 
 TERMINAL_WELCOME = """
 Hi! I'm here to help. Type `:q` or Ctrl-D to exit, `:c` or Ctrl-C and Enter to clear
@@ -31,13 +38,54 @@ Try `:?` for help.
 """
 
 
+class RefreshScheduler:
+    """
+    Decides when a streaming printer should redraw, so that bursts of tiny deltas are
+    coalesced into at most `max_fps` terminal refreshes per second.
+    """
+
+    def __init__(self, max_fps: Optional[float] = None):
+        self.interval = 1.0 / max_fps if max_fps else 0.0
+        self.last_refresh = 0.0
+
+    def should_refresh(self) -> bool:
+        return time.monotonic() - self.last_refresh >= self.interval
+
+    def time_until_refresh(self) -> float:
+        return max(0.0, self.last_refresh + self.interval - time.monotonic())
+
+    def mark_refreshed(self):
+        self.last_refresh = time.monotonic()
+
+
 class StreamingMarkdownPrinter:
-    def __init__(self, console: Console, markdown: bool, style: str = "green"):
+    """
+    Prints streamed text, redrawing at most `max_fps` times per second. Text that
+    arrives too soon after a redraw is drawn by a refresher thread at the end of the
+    interval, so it shows up even if the stream pauses.
+    """
+
+    def __init__(
+        self,
+        console: Console,
+        markdown: bool,
+        style: str = "green",
+        max_fps: Optional[float] = None,
+    ):
         self.console = console
-        self.current_text = ""
+        self.current_text = ResponseBuffer()
+        self.pending_text = ResponseBuffer()
         self.markdown = markdown
         self.style = style
         self.live: Optional[Live] = None
+        self.scheduler = RefreshScheduler(max_fps)
+        # Flushes happen on the refresher thread as well as the caller's
+        self.lock = threading.RLock()
+        # Whether the refresher has pending text to draw
+        self.deferred = False
+        self.wakeup = threading.Event()
+        self.refresher: Optional[threading.Thread] = None
+        self.closed = False
 
     def __enter__(self) -> "StreamingMarkdownPrinter":
         if self.markdown:
@@ -45,19 +93,67 @@ class StreamingMarkdownPrinter:
                 console=self.console, auto_refresh=False, vertical_overflow="visible"
             )
             self.live.__enter__()
+        if self.scheduler.interval:
+            self.refresher = threading.Thread(
+                target=self._refresh, name="gptcli-refresher", daemon=True
+            )
+            self.refresher.start()
         return self
 
+    @hot_path
     def print(self, text: str):
-        self.current_text += text
+        with self.lock:
+            self.current_text.append(text)
+            self.pending_text.append(text)
+            if self.scheduler.should_refresh():
+                self.flush()
+            elif not self.deferred and self.refresher is not None:
+                self.deferred = True
+                self.wakeup.set()
+
+    def _refresh(self):
+        """
+        Draw the deferred text at the end of each refresh interval, until closed.
+        """
+        timeout: Optional[float] = None
+        while True:
+            self.wakeup.wait(timeout)
+            with self.lock:
+                self.wakeup.clear()
+                if self.closed:
+                    return
+                if self.deferred and self.scheduler.should_refresh():
+                    self.flush()
+                timeout = self.scheduler.time_until_refresh() if self.deferred else None
+
+    def flush(self):
+        with self.lock:
+            self.deferred = False
+            if self.pending_text:
+                self._draw()
+
+    def _draw(self):
         if self.markdown:
             assert self.live
-            content = Markdown(self.current_text, style=self.style)
+            content = Markdown(self.current_text.getvalue(), style=self.style)
             self.live.update(content)
             self.live.refresh()
         else:
-            self.console.print(Text(text, style=self.style), end="")
+            self.console.print(
+                Text(self.pending_text.getvalue(), style=self.style), end=""
+            )
+
+        self.pending_text.clear()
+        self.scheduler.mark_refreshed()
 
     def __exit__(self, *args):
+        # Always draw whatever is still buffered, including on KeyboardInterrupt
+        with self.lock:
+            self.flush()
+            self.closed = True
+            self.wakeup.set()
+        if self.refresher is not None:
+            self.refresher.join()
         if self.markdown:
             assert self.live
             self.live.__exit__(*args)
@@ -65,10 +161,13 @@ class StreamingMarkdownPrinter:
 
 
 class CLIResponseStreamer(ResponseStreamer):
-    def __init__(self, console: Console, markdown: bool):
+    def __init__(self, console: Console, markdown: bool, max_fps: Optional[float]):
         self.console = console
         self.markdown = markdown
-        self.printer = StreamingMarkdownPrinter(self.console, self.markdown)
+        self.max_fps = max_fps
+        self.printer = StreamingMarkdownPrinter(
+            self.console, self.markdown, max_fps=self.max_fps
+        )
         self.thinking_printer = None
         self.first_token = True
 
@@ -76,6 +175,7 @@ class CLIResponseStreamer(ResponseStreamer):
         self.printer.__enter__()
         return self
 
+    @hot_path
     def on_next_token(self, token: str):
         if self.first_token and token.startswith(" "):
             token = token[1:]
@@ -90,12 +190,16 @@ class CLIResponseStreamer(ResponseStreamer):
         if self.thinking_printer is None:
             self.console.print("[bold blue]Thinking...[/bold blue]", end="\n\n")
             self.thinking_printer = StreamingMarkdownPrinter(
-                self.console, self.markdown, style="dim blue"
+                self.console, self.markdown, style="dim blue", max_fps=self.max_fps
             )
             self.thinking_printer.__enter__()
         self.thinking_printer.print(token)
 
     def on_tool_call(self, tool_call: ToolCallEvent):
+        # Draw the buffered text first so the tool call appears in order
+        if self.thinking_printer is not None:
+            self.thinking_printer.flush()
+        self.printer.flush()
         self.console.print(f"[bold green]{tool_call.text}[/bold green]", end="\n")
 
     def __exit__(self, *args):
@@ -105,8 +209,15 @@ class CLIResponseStreamer(ResponseStreamer):
 
 
 class CLIChatListener(ChatListener):
-    def __init__(self, markdown: bool):
+    def __init__(
+        self,
+        markdown: bool,
+        max_fps: Optional[float] = None,
+        echo_input: bool = False,
+    ):
         self.markdown = markdown
+        self.max_fps = max_fps
+        self.echo_input = echo_input
         self.console = Console()
 
     def on_chat_start(self):
@@ -122,6 +233,14 @@ class CLIChatListener(ChatListener):
         else:
             self.console.print("[bold]Nothing to re-run.[/bold]")
 
+    def on_context_change(self, paths: List[str], num_files: int):
+        if paths:
+            self.console.print(
+                f"[bold]Indexed {num_files} files. The parts relevant to each prompt will be added to it.[/bold]"
+            )
+        else:
+            self.console.print("[bold]Stopped adding context.[/bold]")
+
     def on_error(self, e: Exception):
         if isinstance(e, BadRequestError):
             self.console.print(
@@ -136,28 +255,99 @@ class CLIChatListener(ChatListener):
         else:
             self.console.print(f"[red]Error: {type(e)}: {e}[/red]")
 
+    def on_chat_message(self, message: Message):
+        # Queued prompts are erased from the input line, and shown when they are answered
+        if self.echo_input and message["role"] == "user":
+            self.console.print(Text(f"> {message['content']}", style="bold"))
+
     def response_streamer(self) -> ResponseStreamer:
-        return CLIResponseStreamer(self.console, self.markdown)
+        return CLIResponseStreamer(self.console, self.markdown, self.max_fps)
+
+
+# Pastes longer than this are kept out of the input line
+LARGE_PASTE_CHARS = 10_000
+
+COMMAND_PASTE = ":paste"
+COMMAND_FILE = ":file"
 
 
-class CLIFileHistory(FileHistory):
-    def append_string(self, string: str) -> None:
-        if string in ALL_COMMANDS:
-            return
-        return super().append_string(string)
+def format_size(size: int) -> str:
+    if size < 1024:
+        return f"{size} B"
+    if size < 1024 * 1024:
+        return f"{size / 1024:.1f} KB"
+    return f"{size / 1024 / 1024:.1f} MB"
+
+
+def attachment_placeholder(name: str, content: str) -> str:
+    data = content.encode()
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    lines = content.count("\n") + 1
+    return f"[{name}: {lines} lines, {format_size(len(data))}, sha256:{digest}]"
 
 
 class CLIUserInputProvider(UserInputProvider):
-    def __init__(self, history_filename) -> None:
-        self.prompt_session = PromptSession[str](
-            history=CLIFileHistory(history_filename)
-        )
+    def __init__(
+        self,
+        history: History,
+        erase_when_done: bool = False,
+        on_interrupt: Optional[Callable[[], bool]] = None,
+        on_typing: Optional[Callable[[], Any]] = None,
+    ) -> None:
+        """
+        `on_interrupt` is called on Ctrl-C with an empty input line, and returns whether
+        it handled the key press (by aborting a response that is being generated).
+        `on_typing` is called whenever the input line changes.
+        """
+        self.prompt_session = PromptSession[str](history=history)
+        if on_typing is not None:
+            self.prompt_session.default_buffer.on_text_changed += lambda _: on_typing()
+        self.erase_when_done = erase_when_done
+        self.on_interrupt = on_interrupt
+        self.console = Console()
+        # Large pastes and attached files, by the placeholder that stands for them in
+        # the input line (and in the history)
+        self.attachments: Dict[str, str] = {}
+        self.next_default = ""
 
+    @traced("cli.get_user_input")
     def get_user_input(self) -> str:
         while (next_user_input := self._request_input()) == "":
             pass
 
-        return next_user_input
+        return self._expand_attachments(next_user_input)
+
+    def _attach(self, name: str, content: str) -> str:
+        placeholder = attachment_placeholder(name, content)
+        self.attachments[placeholder] = content
+        return placeholder
+
+    def _expand_attachments(self, text: str) -> str:
+        for placeholder, content in self.attachments.items():
+            if placeholder in text:
+                text = text.replace(placeholder, content)
+        return text
+
+    def _read_paste(self) -> str:
+        """
+        Read a paste straight from the terminal, without the line editor.
+        """
+        self.console.print(
+            "[bold]Paste the text, then press Ctrl-D on an empty line.[/bold]"
+        )
+        content = sys.stdin.read()
+        if not content:
+            return ""
+        return self._attach("paste", content)
+
+    def _read_file(self, path: str) -> str:
+        try:
+            with open(os.path.expanduser(path), "r", errors="replace") as f:
+                content = f.read()
+        except OSError as e:
+            self.console.print(f"[red]Cannot read {path}: {e.strerror}[/red]")
+            return ""
+        return self._attach(f"file {path}", content)
 
     def prompt(self, multiline=False):
         bindings = KeyBindings()
@@ -172,6 +362,8 @@ class CLIUserInputProvider(UserInputProvider):
         @bindings.add("c-c")
         def _(event: KeyPressEvent):
             if len(event.current_buffer.text) == 0 and not multiline:
+                if self.on_interrupt is not None and self.on_interrupt():
+                    return
                 event.current_buffer.text = COMMAND_CLEAR[0]
                 event.current_buffer.cursor_right(len(COMMAND_CLEAR[0]))
             else:
@@ -190,6 +382,17 @@ class CLIUserInputProvider(UserInputProvider):
                 event.current_buffer.text = COMMAND_RERUN[0]
                 event.current_buffer.validate_and_handle()
 
+        @bindings.add(Keys.BracketedPaste)
+        def _(event: KeyPressEvent):
+            data = event.data.replace("\r\n", "\n").replace("\r", "\n")
+            if len(data) > LARGE_PASTE_CHARS:
+                # Laying out a huge buffer on every key press is slow, keep a
+                # placeholder in the input line instead
+                data = self._attach("paste", data)
+            event.current_buffer.insert_text(data)
+
+        default = "" if multiline else self.next_default
+        self.next_default = ""
         try:
             return self.prompt_session.prompt(
                 "> " if not multiline else "multiline> ",
@@ -197,6 +400,8 @@ class CLIUserInputProvider(UserInputProvider):
                 multiline=multiline,
                 enable_open_in_editor=True,
                 key_bindings=bindings,
+                erase_when_done=self.erase_when_done,
+                default=default,
             )
         except KeyboardInterrupt:
             return ""
@@ -204,6 +409,18 @@ class CLIUserInputProvider(UserInputProvider):
     def _request_input(self):
         line = self.prompt()
 
+        command, _, argument = line.partition(" ")
+        placeholder = None
+        if line == COMMAND_PASTE:
+            placeholder = self._read_paste()
+        elif command == COMMAND_FILE and argument.strip():
+            placeholder = self._read_file(argument.strip())
+        if placeholder is not None:
+            # Pre-fill the next prompt with the placeholder, to be completed with a
+            # question
+            self.next_default = f"{placeholder} " if placeholder else ""
+            return ""
+
         if line != "\\":
             return line
 
@@ -1,38 +1,81 @@
+import contextlib
+import threading
 from abc import abstractmethod
-from typing import Iterator, List, Literal, TypedDict, Union
+from typing import Callable, Dict, Iterator, List, Literal, Optional, TypedDict, Union
 
+import httpx
 from attr import dataclass
 
 
-class Message(TypedDict):
+class ToolDefinition(TypedDict):
+    name: str
+    description: str
+    # JSON schema of the arguments object
+    parameters: dict
+
+
+class ToolCall(TypedDict):
+    id: str
+    name: str
+    arguments: dict
+
+
+class _RequiredMessage(TypedDict):
     role: str
     content: str
 
 
-class Pricing(TypedDict):
+class Message(_RequiredMessage, total=False):
+    # The tools an assistant message called
+    tool_calls: List[ToolCall]
+    # For "tool" messages, which hold the output of a tool call
+    tool_call_id: str
+    name: str
+
+
+class _RequiredPricing(TypedDict):
     prompt: float
     response: float
 
 
-@dataclass
+class Pricing(_RequiredPricing, total=False):
+    cache_read: float
+    cache_write: float
+
+
+@dataclass(slots=True)
 class MessageDeltaEvent:
     text: str
     type: Literal["message_delta"] = "message_delta"
 
 
-@dataclass
+@dataclass(slots=True)
 class ThinkingDeltaEvent:
     text: str
     type: Literal["thinking_delta"] = "thinking_delta"
 
 
-@dataclass
+@dataclass(slots=True)
 class ToolCallEvent:
     text: str
+    # The local tool being called, and once it returned, how long it took in seconds
+    name: Optional[str] = None
+    latency: Optional[float] = None
     type: Literal["tool_call"] = "tool_call"
 
 
-@dataclass
+@dataclass(slots=True)
+class ToolRequestEvent:
+    """
+    The model asks for a local tool to be called. The assistant runs the tool and
+    sends the result back, so this never reaches the session.
+    """
+
+    call: ToolCall
+    type: Literal["tool_request"] = "tool_request"
+
+
+@dataclass(slots=True)
 class UsageEvent:
     prompt_tokens: int
     completion_tokens: int
@@ -40,31 +83,285 @@ class UsageEvent:
     cost: float
     type: Literal["usage"] = "usage"
 
+    def __add__(self, other: "UsageEvent") -> "UsageEvent":
+        return UsageEvent(
+            prompt_tokens=self.prompt_tokens + other.prompt_tokens,
+            completion_tokens=self.completion_tokens + other.completion_tokens,
+            total_tokens=self.total_tokens + other.total_tokens,
+            cost=self.cost + other.cost,
+        )
+
     @staticmethod
     def with_pricing(
-        prompt_tokens: int, completion_tokens: int, total_tokens: int, pricing: Pricing
+        prompt_tokens: int,
+        completion_tokens: int,
+        total_tokens: int,
+        pricing: Pricing,
+        cache_read_tokens: int = 0,
+        cache_write_tokens: int = 0,
     ) -> "UsageEvent":
+        """
+        `prompt_tokens` includes the cache read and write tokens, which are billed at
+        the cache rates when the pricing has them.
+        """
+        cache_read_price = pricing.get("cache_read", pricing["prompt"])
+        cache_write_price = pricing.get("cache_write", pricing["prompt"])
+        uncached_tokens = prompt_tokens - cache_read_tokens - cache_write_tokens
         return UsageEvent(
             prompt_tokens=prompt_tokens,
             completion_tokens=completion_tokens,
             total_tokens=total_tokens,
-            cost=prompt_tokens * pricing["prompt"]
+            cost=uncached_tokens * pricing["prompt"]
+            + cache_read_tokens * cache_read_price
+            + cache_write_tokens * cache_write_price
             + completion_tokens * pricing["response"],
         )
 
 
 CompletionEvent = Union[
-    MessageDeltaEvent, ThinkingDeltaEvent, UsageEvent, ToolCallEvent
+    MessageDeltaEvent, ThinkingDeltaEvent, UsageEvent, ToolCallEvent, ToolRequestEvent
 ]
 
 
+class ResponseBuffer:
+    """
+    Accumulates streamed text as a list of chunks. Joining is deferred until the text
+    is needed and the result is cached, so appending stays O(1) per token instead of
+    copying the whole response every time.
+    """
+
+    __slots__ = ("_chunks", "_length")
+
+    def __init__(self, text: str = ""):
+        self._chunks: List[str] = [text] if text else []
+        self._length = len(text)
+
+    def append(self, text: str):
+        if text:
+            self._chunks.append(text)
+            self._length += len(text)
+
+    def getvalue(self) -> str:
+        if len(self._chunks) > 1:
+            self._chunks[:] = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+
+    def clear(self):
+        self._chunks.clear()
+        self._length = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __str__(self) -> str:
+        return self.getvalue()
+
+
+class CancellationToken:
+    """
+    Cancels a completion request, typically from another thread than the one reading
+    the response. Providers register callbacks that abort the underlying HTTP
+    request, so the connection is released and the provider stops generating.
+    """
+
+    def __init__(self):
+        self._cancelled = False
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def cancel(self):
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def register(self, callback: Callable[[], None]):
+        """
+        Call `callback` on cancellation, or right away if already cancelled.
+        """
+        with self._lock:
+            if not self._cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def child(self) -> "CancellationToken":
+        """
+        A token that is cancelled along with this one, but can also be cancelled on
+        its own, e.g. to abort a single request of a turn.
+        """
+        child = CancellationToken()
+        self.register(child.cancel)
+        return child
+
+    def unregister(self, callback: Callable[[], None]):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+@contextlib.contextmanager
+def abort_on_cancel(
+    cancel: Optional[CancellationToken], abort: Callable[[], None]
+) -> Iterator[None]:
+    """
+    Call `abort` (e.g. closing a response stream) if `cancel` is cancelled while in
+    the block. The errors the aborted request raises in the block are suppressed.
+    """
+    if cancel is None:
+        yield
+        return
+
+    cancel.register(abort)
+    try:
+        yield
+    except Exception:
+        if not cancel.cancelled:
+            raise
+    finally:
+        cancel.unregister(abort)
+
+
+class _TrackedRequests:
+    """
+    The settings and the HTTP responses of a `tracked_requests` block.
+    """
+
+    def __init__(self, timeout: Dict[str, float]):
+        self.timeout = timeout
+        self.responses: List[httpx.Response] = []
+        self.aborted = False
+        self.lock = threading.Lock()
+
+    def add(self, response: httpx.Response):
+        with self.lock:
+            if not self.aborted:
+                self.responses.append(response)
+                return
+        response.close()
+
+    def abort(self):
+        with self.lock:
+            self.aborted = True
+            responses = list(self.responses)
+        for response in responses:
+            response.close()
+
+
+_current_requests = threading.local()
+
+
+def _on_tracked_request(request: httpx.Request):
+    tracked = getattr(_current_requests, "tracked", None)
+    if tracked is not None and tracked.timeout:
+        request.extensions["timeout"] = {
+            **request.extensions.get("timeout", {}),
+            **tracked.timeout,
+        }
+
+
+def _on_tracked_response(response: httpx.Response):
+    tracked = getattr(_current_requests, "tracked", None)
+    if tracked is not None:
+        tracked.add(response)
+
+
+def track_requests(client: httpx.Client) -> httpx.Client:
+    """
+    Set up an httpx client for `tracked_requests`.
+    """
+    hooks = client.event_hooks
+    client.event_hooks = {
+        "request": [*hooks["request"], _on_tracked_request],
+        "response": [*hooks["response"], _on_tracked_response],
+    }
+    return client
+
+
+@contextlib.contextmanager
+def tracked_requests(cancel: Optional[CancellationToken], args: dict) -> Iterator[None]:
+    """
+    For SDKs that take neither separate connect and read timeouts nor expose the
+    HTTP response of a stream: the requests sent in the block by clients set up with
+    `track_requests` use the `connect_timeout` and `read_timeout` args, and are
+    aborted as with `abort_on_cancel`. The requests must be sent from the thread
+    running the block.
+    """
+    timeout = {
+        phase: args[f"{phase}_timeout"]
+        for phase in ("connect", "read")
+        if args.get(f"{phase}_timeout") is not None
+    }
+    tracked = _TrackedRequests(timeout)
+    previous = getattr(_current_requests, "tracked", None)
+    _current_requests.tracked = tracked
+    try:
+        with abort_on_cancel(cancel, tracked.abort):
+            yield
+    finally:
+        _current_requests.tracked = previous
+
+
+def is_cancelled(cancel: Optional[CancellationToken]) -> bool:
+    return cancel is not None and cancel.cancelled
+
+
+CONTINUATION_PROMPT = (
+    "Your previous response was cut off. Continue it exactly where it stopped, "
+    "without repeating anything and without any preamble."
+)
+
+
 class CompletionProvider:
     @abstractmethod
     def complete(
-        self, messages: List[Message], args: dict, stream: bool = False
+        self,
+        messages: List[Message],
+        args: dict,
+        stream: bool = False,
+        cancel: Optional[CancellationToken] = None,
     ) -> Iterator[CompletionEvent]:
+        """
+        When `cancel` is cancelled, the provider aborts the request and the iterator
+        ends without an error.
+
+        The model may call the tools in `args["tools"]` (`ToolDefinition`s), if any.
+        Each call is yielded as a `ToolRequestEvent`, and the outputs come back in the
+        next request as "tool" messages following an assistant message with the
+        `tool_calls`.
+        """
         pass
 
+    def prewarm(self, timeout: float):
+        """
+        Open a connection to the API endpoint, or refresh an idle one, in the client's
+        connection pool with a cheap request, so that the next completion doesn't wait
+        for the TCP and TLS handshakes. Errors are left to the caller.
+        """
+        pass
+
+    def continuation_messages(
+        self, messages: List[Message], partial: str, args: dict
+    ) -> List[Message]:
+        """
+        Messages for a request that continues the interrupted response `partial` to
+        `messages`.
+        """
+        return messages + [
+            {"role": "assistant", "content": partial},
+            {"role": "user", "content": CONTINUATION_PROMPT},
+        ]
+
 
 class CompletionError(Exception):
     pass
@@ -72,3 +369,52 @@ class CompletionError(Exception):
 
 class BadRequestError(CompletionError):
     pass
+
+
+TimeoutPhase = Literal["connect", "read", "first_token", "idle"]
+
+
+class CompletionTimeoutError(CompletionError):
+    """
+    The provider didn't connect, start responding or continue the response in time.
+    Unlike other completion errors, it's always safe to retry.
+    """
+
+    def __init__(
+        self,
+        message: str,
+        phase: TimeoutPhase,
+        limit: Optional[float] = None,
+        elapsed: Optional[float] = None,
+    ):
+        super().__init__(message)
+        self.phase = phase
+        self.limit = limit
+        self.elapsed = elapsed
+
+
+def http_timeout(args: dict, default: httpx.Timeout) -> Optional[httpx.Timeout]:
+    """
+    The httpx timeout for a request from its `connect_timeout` and `read_timeout`
+    args, falling back to the SDK's `default`. None if neither is set.
+    """
+    connect = args.get("connect_timeout")
+    read = args.get("read_timeout")
+    if connect is None and read is None:
+        return None
+    return httpx.Timeout(
+        read if read is not None else default.read,
+        connect=connect if connect is not None else default.connect,
+    )
+
+
+def timeout_error(e: Exception) -> CompletionTimeoutError:
+    """
+    Convert an httpx timeout, or an SDK timeout error caused by one, to a
+    `CompletionTimeoutError`.
+    """
+    cause = e if isinstance(e, httpx.TimeoutException) else e.__cause__
+    phase: TimeoutPhase = (
+        "connect" if isinstance(cause, httpx.ConnectTimeout) else "read"
+    )
+    return CompletionTimeoutError(f"Request timed out ({phase})", phase)
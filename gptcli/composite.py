@@ -1,8 +1,11 @@
+import logging
+import queue
+import threading
 from gptcli.completion import Message, ToolCallEvent, UsageEvent
 from gptcli.session import ChatListener, ResponseStreamer
 
 
-from typing import List, Optional
+from typing import Any, Callable, List, Optional, Tuple
 
 
 class CompositeResponseStreamer(ResponseStreamer):
@@ -39,6 +42,10 @@ class CompositeChatListener(ChatListener):
         for listener in self.listeners:
             listener.on_chat_start()
 
+    def on_chat_end(self):
+        for listener in self.listeners:
+            listener.on_chat_end()
+
     def on_chat_clear(self):
         for listener in self.listeners:
             listener.on_chat_clear()
@@ -47,6 +54,14 @@ class CompositeChatListener(ChatListener):
         for listener in self.listeners:
             listener.on_chat_rerun(success)
 
+    def on_chat_stats(self):
+        for listener in self.listeners:
+            listener.on_chat_stats()
+
+    def on_context_change(self, paths: List[str], num_files: int):
+        for listener in self.listeners:
+            listener.on_context_change(paths, num_files)
+
     def on_error(self, e: Exception):
         for listener in self.listeners:
             listener.on_error(e)
@@ -68,3 +83,126 @@ class CompositeChatListener(ChatListener):
     ):
         for listener in self.listeners:
             listener.on_chat_response(messages, response, usage)
+
+
+class BackgroundDispatcher:
+    """
+    Runs submitted calls in order on a single background thread. Exceptions raised
+    by the calls are logged and otherwise ignored.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger("gptcli-dispatch")
+        self.queue: "queue.Queue[Optional[Tuple[Callable, Tuple[Any, ...]]]]" = (
+            queue.Queue()
+        )
+        self.thread = threading.Thread(
+            target=self._run, name="gptcli-listeners", daemon=True
+        )
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                fn, args = item
+                try:
+                    fn(*args)
+                except Exception:
+                    self.logger.exception("Error in background listener %s", fn)
+            finally:
+                self.queue.task_done()
+
+    def submit(self, fn: Callable, *args):
+        self.queue.put((fn, args))
+
+    def flush(self):
+        """
+        Block until all submitted calls have been run.
+        """
+        self.queue.join()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+
+class BackgroundResponseStreamer(ResponseStreamer):
+    def __init__(self, dispatcher: BackgroundDispatcher, streamer: ResponseStreamer):
+        self.dispatcher = dispatcher
+        self.streamer = streamer
+
+    def __enter__(self):
+        self.dispatcher.submit(self.streamer.__enter__)
+        return self
+
+    def on_next_token(self, token: str):
+        self.dispatcher.submit(self.streamer.on_next_token, token)
+
+    def on_thinking_token(self, token: str):
+        self.dispatcher.submit(self.streamer.on_thinking_token, token)
+
+    def on_tool_call(self, tool_call: ToolCallEvent):
+        self.dispatcher.submit(self.streamer.on_tool_call, tool_call)
+
+    def __exit__(self, *args):
+        self.dispatcher.submit(self.streamer.__exit__, *args)
+
+
+class BackgroundChatListener(ChatListener):
+    """
+    Delivers events to `listener` through a background queue, so that slow listeners
+    (file logging, cost accounting) don't block the token loop. Errors raised by the
+    listener are logged and don't affect the session.
+    """
+
+    def __init__(self, listener: ChatListener):
+        self.listener = listener
+        self.dispatcher = BackgroundDispatcher()
+
+    def on_chat_start(self):
+        self.dispatcher.submit(self.listener.on_chat_start)
+
+    def on_chat_end(self):
+        self.dispatcher.submit(self.listener.on_chat_end)
+        self.dispatcher.close()
+
+    def on_chat_clear(self):
+        self.dispatcher.submit(self.listener.on_chat_clear)
+
+    def on_chat_rerun(self, success: bool):
+        self.dispatcher.submit(self.listener.on_chat_rerun, success)
+
+    def on_chat_stats(self):
+        self.dispatcher.submit(self.listener.on_chat_stats)
+        self.dispatcher.flush()
+
+    def on_context_change(self, paths: List[str], num_files: int):
+        self.dispatcher.submit(self.listener.on_context_change, paths, num_files)
+
+    def on_error(self, e: Exception):
+        self.dispatcher.submit(self.listener.on_error, e)
+
+    def response_streamer(self) -> ResponseStreamer:
+        return BackgroundResponseStreamer(
+            self.dispatcher, self.listener.response_streamer()
+        )
+
+    def on_chat_message(self, message: Message):
+        self.dispatcher.submit(self.listener.on_chat_message, message)
+
+    def on_chat_response(
+        self,
+        messages: List[Message],
+        response: Message,
+        usage: Optional[UsageEvent] = None,
+    ):
+        self.dispatcher.submit(
+            self.listener.on_chat_response, messages, response, usage
+        )
+        # Wait for the turn to be fully processed, so that anything the listeners
+        # print shows up before the next prompt
+        self.dispatcher.flush()
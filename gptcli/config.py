@@ -5,7 +5,10 @@ import yaml
 from attr import dataclass
 
 from gptcli.assistant import AssistantConfig
+from gptcli.ledger import BudgetConfig
+from gptcli.pricing import PriceEntry
 from gptcli.providers.llama import LLaMAModelConfig
+from gptcli.tools import ToolConfig
 
 CONFIG_FILE_PATHS = [
     os.path.join(os.path.expanduser("~"), ".config", "gpt-cli", "gpt.yml"),
@@ -17,6 +20,24 @@ CONFIG_FILE_PATHS = [
 class GptCliConfig:
     default_assistant: str = "general"
     markdown: bool = True
+    max_fps: Optional[float] = 30
+    pipeline: bool = False
+    batch_deltas: bool = True
+    queue_input: bool = False
+    prewarm: bool = False
+    chunk_tokens: int = 8000
+    context_tokens: int = 8000
+    map_parallelism: int = 4
+    async_listeners: bool = False
+    metrics_file: Optional[str] = None
+    trace_file: Optional[str] = None
+    # The usage ledger is only kept when this or `budget` is set
+    ledger_file: Optional[str] = None
+    archive_file: Optional[str] = None
+    history_backend: str = "file"
+    budget: Optional[BudgetConfig] = None
+    pricing: Dict[str, PriceEntry] = {}
+    pricing_file: Optional[str] = None
     show_price: bool = True
     api_key: Optional[str] = os.environ.get("OPENAI_API_KEY")
     openai_api_key: Optional[str] = os.environ.get("OPENAI_API_KEY")
@@ -28,6 +49,7 @@ class GptCliConfig:
     log_file: Optional[str] = None
     log_level: str = "INFO"
     assistants: Dict[str, AssistantConfig] = {}
+    tools: Dict[str, ToolConfig] = {}
     interactive: Optional[bool] = None
     llama_models: Optional[Dict[str, LLaMAModelConfig]] = None
 
@@ -0,0 +1,329 @@
+import math
+import os
+import re
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Pattern, Tuple
+
+from attr import dataclass
+
+from gptcli.pricing import CHARS_PER_TOKEN
+
+CHUNK_LINES = 60
+MAX_FILE_SIZE = 1024 * 1024
+WALK_PARALLELISM = 8
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+CONTEXT_HEADER = "Excerpts of files that may be relevant to the request:"
+CHUNK_TEMPLATE = "{path} (lines {start}-{end}):\n```\n{text}\n```"
+
+TERM_PATTERN = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|[0-9]+")
+
+
+def _stem(term: str) -> str:
+    # Plurals only, enough for "tables" to match `table`
+    if len(term) > 3 and term.endswith("s") and not term.endswith("ss"):
+        return term[:-1]
+    return term
+
+
+def terms(text: str) -> List[str]:
+    """
+    Lowercase words of the text, with identifiers split at underscores and camelCase
+    boundaries, so that `getUserNames` matches "user name".
+    """
+    return [_stem(term.lower()) for term in TERM_PATTERN.findall(text)]
+
+
+@dataclass
+class IgnoreRule:
+    # The directory of the .gitignore file
+    base: str
+    regex: Pattern
+    negate: bool
+    dir_only: bool
+
+
+def _pattern_regex(pattern: str) -> str:
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+        elif pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+        elif pattern[i] == "*":
+            regex += "[^/]*"
+            i += 1
+        elif pattern[i] == "?":
+            regex += "[^/]"
+            i += 1
+        elif pattern[i] == "[" and (end := pattern.find("]", i + 1)) != -1:
+            regex += "[" + pattern[i + 1 : end].replace("!", "^", 1) + "]"
+            i = end + 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return regex
+
+
+def parse_gitignore(path: str) -> List[IgnoreRule]:
+    """
+    The rules of a .gitignore file: negation (`!`), directory-only patterns (trailing
+    `/`), patterns anchored to the file's directory (containing a `/`) and `**`.
+    """
+    rules = []
+    base = os.path.dirname(path)
+    with open(path, "r", errors="replace") as f:
+        for line in f:
+            pattern = line.rstrip("\n").rstrip()
+            if not pattern or pattern.startswith("#"):
+                continue
+            negate = pattern.startswith("!")
+            pattern = pattern[1:] if negate else pattern
+            dir_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            if not pattern:
+                continue
+            regex = _pattern_regex(pattern.lstrip("/"))
+            if "/" not in pattern:
+                regex = "(?:.*/)?" + regex
+            rules.append(IgnoreRule(base, re.compile(regex), negate, dir_only))
+    return rules
+
+
+def is_ignored(rules: List[IgnoreRule], path: str, is_dir: bool) -> bool:
+    # As in git, the last matching rule wins
+    ignored = False
+    for rule in rules:
+        if rule.dir_only and not is_dir:
+            continue
+        relative = os.path.relpath(path, rule.base).replace(os.sep, "/")
+        if rule.regex.fullmatch(relative):
+            ignored = not rule.negate
+    return ignored
+
+
+def _scan(
+    directory: str, rules: List[IgnoreRule]
+) -> Tuple[List[Tuple[str, List[IgnoreRule]]], List[str]]:
+    gitignore = os.path.join(directory, ".gitignore")
+    if os.path.isfile(gitignore):
+        rules = rules + parse_gitignore(gitignore)
+
+    directories = []
+    files = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name == ".git":
+                    continue
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if is_ignored(rules, entry.path, is_dir):
+                    continue
+                if is_dir:
+                    directories.append((entry.path, rules))
+                elif entry.is_file():
+                    files.append(entry.path)
+    except OSError:
+        pass
+    return directories, files
+
+
+def walk_files(paths: List[str], parallelism: int = WALK_PARALLELISM) -> List[str]:
+    """
+    The files under `paths` that aren't ignored by a .gitignore file. The directories
+    of each level of the tree are listed in parallel.
+    """
+    files = [path for path in paths if os.path.isfile(path)]
+    level: List[Tuple[str, List[IgnoreRule]]] = [
+        (path, []) for path in paths if os.path.isdir(path)
+    ]
+    with ThreadPoolExecutor(parallelism) as executor:
+        while level:
+            next_level = []
+            for directories, directory_files in executor.map(
+                lambda item: _scan(*item), level
+            ):
+                next_level.extend(directories)
+                files.extend(directory_files)
+            level = next_level
+    return sorted(files)
+
+
+@dataclass
+class Chunk:
+    path: str
+    start_line: int
+    end_line: int
+    text: str
+    terms: Dict[str, int]
+    length: int
+
+    def format(self) -> str:
+        return CHUNK_TEMPLATE.format(
+            path=self.path, start=self.start_line, end=self.end_line, text=self.text
+        )
+
+
+@dataclass
+class FileEntry:
+    mtime: float
+    size: int
+    chunks: List[Chunk]
+
+
+def _split_file(path: str, content: str, chunk_lines: int) -> List[Chunk]:
+    lines = content.splitlines()
+    path_terms = terms(path)
+    chunks = []
+    for start in range(0, len(lines), chunk_lines):
+        text = "\n".join(lines[start : start + chunk_lines])
+        chunk_terms = Counter(terms(text) + path_terms)
+        chunks.append(
+            Chunk(
+                path=path,
+                start_line=start + 1,
+                end_line=min(start + chunk_lines, len(lines)),
+                text=text,
+                terms=chunk_terms,
+                length=sum(chunk_terms.values()),
+            )
+        )
+    return chunks
+
+
+def _load(
+    path: str, previous: Optional[FileEntry], chunk_lines: int
+) -> Optional[FileEntry]:
+    try:
+        stat = os.stat(path)
+        if previous is not None and (previous.mtime, previous.size) == (
+            stat.st_mtime,
+            stat.st_size,
+        ):
+            return previous
+        if stat.st_size > MAX_FILE_SIZE:
+            return FileEntry(stat.st_mtime, stat.st_size, [])
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    if b"\0" in data[:8192]:
+        # Binary files are kept without chunks, so that they aren't read again
+        return FileEntry(stat.st_mtime, stat.st_size, [])
+    content = data.decode("utf-8", errors="replace")
+    return FileEntry(
+        stat.st_mtime, stat.st_size, _split_file(path, content, chunk_lines)
+    )
+
+
+class ContextIndex:
+    """
+    A BM25 index of the text files under some paths, split into chunks of lines. It's
+    refreshed before every use, but files are only re-read and re-tokenized when their
+    mtime or size changed, and the statistics are only recomputed when a file did.
+    """
+
+    def __init__(
+        self,
+        paths: List[str],
+        chunk_lines: int = CHUNK_LINES,
+        parallelism: int = WALK_PARALLELISM,
+    ):
+        self.paths = paths
+        self.chunk_lines = chunk_lines
+        self.parallelism = parallelism
+        self.files: Dict[str, FileEntry] = {}
+        self.document_frequencies: Counter = Counter()
+        self.num_chunks = 0
+        self.average_length = 0.0
+
+    def refresh(self):
+        paths = walk_files(self.paths, self.parallelism)
+        with ThreadPoolExecutor(self.parallelism) as executor:
+            entries = list(
+                executor.map(
+                    lambda path: _load(path, self.files.get(path), self.chunk_lines),
+                    paths,
+                )
+            )
+
+        files = {path: entry for path, entry in zip(paths, entries) if entry}
+        changed = files.keys() != self.files.keys() or any(
+            entry is not self.files[path] for path, entry in files.items()
+        )
+        self.files = files
+        if changed:
+            self._update_statistics()
+
+    def _update_statistics(self):
+        self.document_frequencies = Counter()
+        total_length = 0
+        self.num_chunks = 0
+        for entry in self.files.values():
+            for chunk in entry.chunks:
+                self.document_frequencies.update(chunk.terms.keys())
+                total_length += chunk.length
+                self.num_chunks += 1
+        self.average_length = total_length / self.num_chunks if self.num_chunks else 0
+
+    def search(self, query: str) -> List[Tuple[float, Chunk]]:
+        """
+        The chunks matching the query, best first.
+        """
+        query_terms = set(terms(query))
+        idf = {
+            term: math.log(
+                1
+                + (self.num_chunks - self.document_frequencies[term] + 0.5)
+                / (self.document_frequencies[term] + 0.5)
+            )
+            for term in query_terms
+            if term in self.document_frequencies
+        }
+        results = []
+        for entry in self.files.values():
+            for chunk in entry.chunks:
+                score = 0.0
+                for term, term_idf in idf.items():
+                    frequency = chunk.terms.get(term, 0)
+                    if frequency:
+                        norm = 1 - B + B * chunk.length / self.average_length
+                        score += (
+                            term_idf * frequency * (K1 + 1) / (frequency + K1 * norm)
+                        )
+                if score > 0:
+                    results.append((score, chunk))
+        results.sort(key=lambda result: -result[0])
+        return results
+
+    def pack(self, query: str, max_tokens: int) -> List[Chunk]:
+        """
+        Greedily pick the best matching chunks that fit into `max_tokens` (estimated),
+        in the order of the files.
+        """
+        budget = max_tokens * CHARS_PER_TOKEN - len(CONTEXT_HEADER)
+        selected = []
+        for _, chunk in self.search(query):
+            size = len(chunk.format()) + 2
+            if size <= budget:
+                selected.append(chunk)
+                budget -= size
+        selected.sort(key=lambda chunk: (chunk.path, chunk.start_line))
+        return selected
+
+    def apply(self, prompt: str, max_tokens: int) -> str:
+        """
+        The prompt, preceded by the chunks most relevant to it.
+        """
+        chunks = self.pack(prompt, max_tokens)
+        if not chunks:
+            return prompt
+        excerpts = "\n\n".join(chunk.format() for chunk in chunks)
+        return f"{CONTEXT_HEADER}\n\n{excerpts}\n\n{prompt}"
@@ -27,7 +27,7 @@ class PriceChatListener(ChatListener):
         if usage is None:
             return
 
-        model = self.assistant._param("model")
+        model = self.assistant.active_model()
         num_tokens = usage.total_tokens
         cost = usage.cost
 
@@ -39,8 +39,11 @@ class PriceChatListener(ChatListener):
         self.logger.info(f"Token usage {num_tokens}")
         self.logger.info(f"Message price (model: {model}): ${cost:.3f}")
         self.logger.info(f"Current spend: ${self.current_spend:.3f}")
+        price_line = f"Tokens: {num_tokens} | Price: ${cost:.3f} | Total: ${self.current_spend:.3f}"
+        if self.assistant.router is not None or self.assistant.breakers is not None:
+            price_line = f"Model: {model} | {price_line}"
         self.console.print(
-            f"Tokens: {num_tokens} | Price: ${cost:.3f} | Total: ${self.current_spend:.3f}",
+            price_line,
             justify="right",
             style="dim",
         )
@@ -0,0 +1,174 @@
+import collections
+import logging
+import threading
+import time
+from typing import Callable, Deque, Dict, Optional, TypedDict
+
+
+class CircuitBreakerConfig(TypedDict, total=False):
+    # Number of recent requests the error rate is computed over
+    window: int
+    # The breaker trips when at least this share of the recent requests failed...
+    error_rate: float
+    # ...and there were at least this many of them
+    min_requests: int
+    # Requests with a slower time-to-first-token count as failures
+    slow_ttft: Optional[float]
+    # Seconds before a tripped backend is tried again
+    cooldown: float
+    # Probe tripped backends in the background instead of waiting for a user request
+    probe: bool
+
+
+BREAKER_DEFAULTS: CircuitBreakerConfig = {
+    "window": 10,
+    "error_rate": 0.5,
+    "min_requests": 3,
+    "slow_ttft": None,
+    "cooldown": 30.0,
+    "probe": True,
+}
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Tracks the outcomes of the recent requests to one backend.
+
+    The breaker starts closed. When too many of the recent requests fail (or are too
+    slow) it opens, and requests to the backend are skipped. After the cooldown it's
+    half-open: a single trial request, or a background probe, is let through, and
+    closes the breaker again if it succeeds. A probe only checks that the backend is
+    reachable, so the breaker opens again right away if the first request after it
+    fails.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        config: CircuitBreakerConfig,
+        probe: Optional[Callable[[], None]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.config: CircuitBreakerConfig = {**BREAKER_DEFAULTS, **config}
+        self.probe = probe if self.config["probe"] else None
+        self.clock = clock
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.outcomes: Deque[bool] = collections.deque(maxlen=self.config["window"])
+        # Closed by a probe, and no request has succeeded since
+        self.probed = False
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger("gptcli-failover")
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def allow(self) -> bool:
+        """
+        Whether a request may be sent to the backend now.
+        """
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            # A trial that never reported back (e.g. it was cancelled) doesn't keep
+            # the breaker half-open forever: another one is let through after the
+            # cooldown
+            now = self.clock()
+            if now - self.opened_at >= self.config["cooldown"]:
+                self.state = HALF_OPEN
+                self.opened_at = now
+                return True
+            return False
+
+    def record_success(self, ttft: Optional[float] = None):
+        slow_ttft = self.config["slow_ttft"]
+        if slow_ttft is not None and ttft is not None and ttft > slow_ttft:
+            self.logger.warning(
+                "%s was slow to respond (%.1fs to first token)", self.name, ttft
+            )
+            self.record_failure()
+            return
+
+        with self.lock:
+            if self.state != CLOSED:
+                self.logger.info("Circuit for %s closed", self.name)
+                self.state = CLOSED
+                self.outcomes.clear()
+            self.probed = False
+            self.outcomes.append(True)
+
+    def record_failure(self):
+        with self.lock:
+            self.outcomes.append(False)
+            if (
+                self.state == HALF_OPEN
+                or self.probed
+                or (
+                    self.state == CLOSED
+                    and len(self.outcomes) >= self.config["min_requests"]
+                    and self.error_rate >= self.config["error_rate"]
+                )
+            ):
+                self._trip()
+
+    def _trip(self):
+        self.logger.warning(
+            "Circuit for %s opened (error rate %.0f%%)",
+            self.name,
+            self.error_rate * 100,
+        )
+        self.state = OPEN
+        self.opened_at = self.clock()
+        self.probed = False
+        if self.probe is not None:
+            timer = threading.Timer(self.config["cooldown"], self._run_probe)
+            timer.daemon = True
+            timer.start()
+
+    def _run_probe(self):
+        if not self.allow():
+            return
+        assert self.probe is not None
+        try:
+            self.probe()
+        except Exception as e:
+            self.logger.info("Probe of %s failed: %s", self.name, e)
+            self.record_failure()
+        else:
+            with self.lock:
+                if self.state == HALF_OPEN:
+                    self.logger.info("Circuit for %s closed by a probe", self.name)
+                    self.state = CLOSED
+                    self.outcomes.clear()
+                    self.probed = True
+
+
+class BreakerRegistry:
+    def __init__(
+        self,
+        config: CircuitBreakerConfig,
+        probe: Optional[Callable[[str], None]] = None,
+    ):
+        self.config = config
+        self.probe = probe
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.lock = threading.Lock()
+
+    def get(self, model: str) -> CircuitBreaker:
+        with self.lock:
+            if model not in self.breakers:
+                probe = self.probe
+                self.breakers[model] = CircuitBreaker(
+                    model,
+                    self.config,
+                    (lambda: probe(model)) if probe is not None else None,
+                )
+            return self.breakers[model]
@@ -7,12 +7,17 @@ if sys.version_info < MIN_PYTHON:
     sys.exit("Python %s.%s or later is required.\n" % MIN_PYTHON)
 
 import os
-from typing import cast
+from typing import List, Optional, cast
 import openai
 import argparse
+from prompt_toolkit.history import History, ThreadedHistory
+from prompt_toolkit.patch_stdout import patch_stdout
 import sys
 import logging
+import sqlite3
 import datetime
+import itertools
+import json
 import gptcli.providers.anthropic
 import gptcli.providers.cohere
 import gptcli.providers.google as google
@@ -26,7 +31,15 @@ from gptcli.cli import (
     CLIChatListener,
     CLIUserInputProvider,
 )
-from gptcli.composite import CompositeChatListener
+from gptcli.archive import (
+    ArchiveChatListener,
+    ConversationArchive,
+    print_search_results,
+)
+from gptcli.batch import FAILED, FileMapper
+from gptcli.composite import BackgroundChatListener, CompositeChatListener
+from gptcli.completion import CompletionError
+from gptcli.context import ContextIndex
 from gptcli.config import (
     CONFIG_FILE_PATHS,
     GptCliConfig,
@@ -36,8 +49,28 @@ from gptcli.config import (
 from gptcli.providers.llama import init_llama_models
 from gptcli.logging_utils import LoggingChatListener
 from gptcli.cost import PriceChatListener
-from gptcli.session import ChatSession
-from gptcli.shell import execute, simple_response
+from gptcli.ledger import (
+    DEFAULT_LEDGER_PATH,
+    BudgetExceededError,
+    CostLedger,
+    LedgerAssistantListener,
+    print_usage_report,
+)
+from gptcli.jsonstream import load_schema
+from gptcli.history import (
+    DEFAULT_HISTORY_DB_PATH,
+    DEFAULT_HISTORY_PATH,
+    CLIFileHistory,
+    SQLiteHistory,
+)
+from gptcli.mapreduce import MapReduce, read_lines
+from gptcli.metrics import MetricsChatListener
+from gptcli.pricing import load_pricing_file, load_pricing_overrides
+from gptcli.session import ChatListener, ChatSession, InvalidArgumentError
+from gptcli.shell import OUTPUT_FORMATS, execute, simple_response
+from gptcli.profiling import SessionProfiler
+from gptcli.tools import ToolExecutor, load_tools
+from gptcli.tracing import init_tracing
 
 
 logger = logging.getLogger("gptcli")
@@ -75,6 +108,13 @@ development assistant with shorter responses. You can specify your own assistant
         help="Disable markdown formatting in the chat session.",
         default=config.markdown,
     )
+    parser.add_argument(
+        "--max_fps",
+        type=float,
+        default=config.max_fps,
+        help="The maximum number of times per second the streamed response is redrawn. Tokens arriving in \
+between are coalesced into the next redraw. Set to 0 to redraw on every token.",
+    )
     parser.add_argument(
         "--model",
         type=str,
@@ -138,6 +178,124 @@ before executing it. Implies --no_stream. Use `-` to read the prompt from standa
         default=False,
         help="If specified, will not stream the response to standard output. This is useful if you want to use the \
 response in a script. Ignored when the --prompt option is not specified.",
+    )
+    parser.add_argument(
+        "--output_format",
+        choices=OUTPUT_FORMATS,
+        default="text",
+        help="The format of the response printed with --prompt. `jsonl` prints every event of the response \
+(message and thinking deltas, tool calls and usage) as a JSON line with timestamps, flushed as soon as it's \
+received.",
+    )
+    parser.add_argument(
+        "--json_schema",
+        type=str,
+        default=None,
+        metavar="SCHEMA",
+        help="Make the model respond with JSON following this JSON schema (a file, or the schema itself), using \
+the provider's JSON mode. With --prompt, each item of the top-level array or field of the top-level object is \
+printed as a JSON line as soon as it's complete.",
+    )
+    parser.add_argument(
+        "--resume",
+        type=int,
+        default=None,
+        metavar="CONVERSATION",
+        help="Start the chat session with the messages of an archived conversation, as numbered by `gpt search`.",
+    )
+    parser.add_argument(
+        "--context",
+        type=str,
+        action="append",
+        default=None,
+        metavar="PATH",
+        help="Index the files under this path (skipping the ones ignored by .gitignore files), and add the parts \
+most relevant to each prompt to it. May be specified multiple times. Same as the `:context` command.",
+    )
+    parser.add_argument(
+        "--context_tokens",
+        type=int,
+        default=config.context_tokens,
+        help="Maximum estimated size of the context added to each prompt, in tokens.",
+    )
+    parser.add_argument(
+        "--map_reduce",
+        action="store_true",
+        default=False,
+        help="Answer the --prompt about an input that is too long for the context window: the input is split into \
+chunks, the prompt is applied to the chunks in parallel and the answers are combined. Reads the --input files, or \
+standard input if none are given. Progress and the cost of every chunk are printed to standard error.",
+    )
+    parser.add_argument(
+        "--input",
+        type=str,
+        action="append",
+        default=None,
+        help="A file to process with --map_reduce. May be specified multiple times. Use `-` for standard input.",
+    )
+    parser.add_argument(
+        "--chunk_tokens",
+        type=int,
+        default=config.chunk_tokens,
+        help="Maximum estimated size of a chunk of the input with --map_reduce, in tokens.",
+    )
+    parser.add_argument(
+        "--parallelism",
+        type=int,
+        default=config.map_parallelism,
+        help="Maximum number of chunks processed at the same time with --map_reduce.",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        default=config.pipeline,
+        help="Merge deltas that queue up while rendering falls behind, so that rendering catches up in one step. \
+Useful with fast models or slow terminals.",
+    )
+    parser.add_argument(
+        "--queue_input",
+        action="store_true",
+        default=config.queue_input,
+        help="Keep the input prompt open while a response streams. Prompts typed in the meantime are sent once the \
+response completes, and prompts starting with `&` are answered right away on the side. Responses are shown as \
+plain text in this mode.",
+    )
+    parser.add_argument(
+        "--prewarm",
+        action="store_true",
+        default=config.prewarm,
+        help="Open the connection to the model's API when the session starts, and keep it open while you type, so \
+that requests don't wait for the connection to be set up.",
+    )
+    parser.add_argument(
+        "--async_listeners",
+        action="store_true",
+        default=config.async_listeners,
+        help="Deliver events to the logging and price listeners on a background thread instead of the token loop.",
+    )
+    parser.add_argument(
+        "--metrics_file",
+        type=str,
+        default=config.metrics_file,
+        help="Export latency and throughput metrics of the session to this file. Written in the Prometheus \
+text format if the name ends with `.prom`, and as JSON otherwise.",
+    )
+    parser.add_argument(
+        "--trace_file",
+        type=str,
+        default=config.trace_file,
+        help="Record a trace of every turn, from user input to the final render, and append it to this file as \
+OTLP-compatible JSON lines.",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        nargs="?",
+        const="gptcli-profile-%Y%m%d-%H%M%S",
+        default=None,
+        metavar="PREFIX",
+        help="Profile CPU time and memory allocations of the session, including its background threads. On exit, \
+writes PREFIX.pstats and a PREFIX.txt report. Supports strftime format codes.",
     )
     parser.add_argument(
         "--no_price",
@@ -157,6 +315,188 @@ response in a script. Ignored when the --prompt option is not specified.",
     return parser.parse_args()
 
 
+def parse_usage_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="gpt usage",
+        description="Show the token usage and spend recorded in the local usage ledger.",
+    )
+    parser.add_argument(
+        "--days",
+        type=int,
+        default=30,
+        help="Number of days to report, including today.",
+    )
+    return parser.parse_args(argv)
+
+
+def ledger_path(config: GptCliConfig) -> Optional[str]:
+    """
+    The path of the usage ledger, which is only kept when `ledger_file` or a budget
+    is set.
+    """
+    if config.ledger_file:
+        return os.path.expanduser(config.ledger_file)
+    if config.budget:
+        return DEFAULT_LEDGER_PATH
+    return None
+
+
+def run_usage(config: GptCliConfig, argv):
+    args = parse_usage_args(argv)
+    path = ledger_path(config)
+    if path is None:
+        print(
+            "The usage ledger is disabled, set `ledger_file` or a `budget` in the "
+            "config to enable it."
+        )
+        sys.exit(1)
+
+    ledger = CostLedger(path)
+    since = datetime.date.today() - datetime.timedelta(days=args.days - 1)
+    print_usage_report(ledger, since, config.budget)
+
+
+def parse_map_args(config: GptCliConfig, argv):
+    parser = argparse.ArgumentParser(
+        prog="gpt map",
+        description="Apply a prompt to every file matching the patterns, and write the responses to a mirrored \
+directory tree. Files that haven't changed since the last run with the same prompt are skipped.",
+    )
+    parser.add_argument(
+        "patterns",
+        nargs="+",
+        metavar="PATTERN",
+        help="Glob patterns of the files to process. `**` matches any number of directories.",
+    )
+    parser.add_argument(
+        "--prompt",
+        "-p",
+        type=str,
+        required=True,
+        help="The prompt template. `{path}` is replaced with the path of the file and `{content}` with its \
+content; the content is appended if the template doesn't reference it.",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=str,
+        required=True,
+        help="The directory to write the responses to, at the same relative paths as the input files.",
+    )
+    parser.add_argument(
+        "--suffix",
+        type=str,
+        default="",
+        help="A suffix to append to the names of the output files, e.g. `.md`.",
+    )
+    parser.add_argument(
+        "--assistant",
+        type=str,
+        default=config.default_assistant,
+        help="The name of the assistant to use.",
+    )
+    parser.add_argument(
+        "--model",
+        type=str,
+        default=None,
+        help="The model to use. Overrides the model of the assistant.",
+    )
+    parser.add_argument(
+        "--parallelism",
+        type=int,
+        default=config.map_parallelism,
+        help="Maximum number of files processed at the same time.",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        default=False,
+        help="Process all files, including the ones that haven't changed since the last run.",
+    )
+    return parser.parse_args(argv)
+
+
+def run_map(config: GptCliConfig, argv):
+    args = parse_map_args(config, argv)
+    init_providers(config)
+    assistant = init_assistant(
+        AssistantGlobalArgs(args.assistant, model=args.model), config.assistants
+    )
+    init_ledger(assistant, args.assistant, config)
+    init_tools(assistant, config)
+
+    mapper = FileMapper(
+        assistant,
+        args.prompt,
+        args.output,
+        args.parallelism,
+        suffix=args.suffix,
+        force=args.force,
+    )
+    counts = mapper.run(args.patterns)
+    summary = ", ".join(f"{count} {outcome}" for outcome, count in counts.items())
+    if mapper.usage is not None:
+        summary += (
+            f" | Total: {mapper.usage.total_tokens} tokens, ${mapper.usage.cost:.4f}"
+        )
+    print(summary, file=sys.stderr)
+    if counts[FAILED]:
+        sys.exit(1)
+
+
+def parse_search_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="gpt search",
+        description="Search the messages of past conversations. All words of the query must match.",
+    )
+    parser.add_argument("query", nargs="+", help="The words to search for.")
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=20,
+        help="Maximum number of messages to show.",
+    )
+    return parser.parse_args(argv)
+
+
+def run_search(config: GptCliConfig, argv):
+    args = parse_search_args(argv)
+    if not config.archive_file:
+        print(
+            "The conversation archive is disabled (set `archive_file` in the config)."
+        )
+        sys.exit(1)
+
+    archive = ConversationArchive(os.path.expanduser(config.archive_file))
+    print_search_results(archive.search(" ".join(args.query), args.limit))
+
+
+SUBCOMMANDS = {
+    "usage": run_usage,
+    "search": run_search,
+    "map": run_map,
+}
+
+
+def find_subcommand(config: GptCliConfig, argv: List[str]):
+    """
+    The subcommand `argv` starts with, if any. An assistant defined in the config
+    with the same name takes precedence, since the positional argument also picks the
+    assistant.
+    """
+    if not argv or argv[0] not in SUBCOMMANDS:
+        return None
+    if argv[0] in config.assistants:
+        logger.warning(
+            "The assistant %s hides the `gpt %s` subcommand, rename it to use the "
+            "subcommand",
+            argv[0],
+            argv[0],
+        )
+        return None
+    return SUBCOMMANDS[argv[0]]
+
+
 def validate_args(args):
     if args.prompt is not None and args.execute is not None:
         print(
@@ -171,17 +511,26 @@ def main():
         config = read_yaml_config(config_file_path)
     else:
         config = GptCliConfig()
+
+    subcommand = find_subcommand(config, sys.argv[1:])
+    if subcommand is not None:
+        subcommand(config, sys.argv[2:])
+        return
+
     args = parse_args(config)
 
-    if args.log_file is not None:
-        filename = datetime.datetime.now().strftime(args.log_file)
-        logging.basicConfig(
-            filename=filename,
-            level=args.log_level,
-            format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        )
-        # Disable overly verbose logging for markdown_it
-        logging.getLogger("markdown_it").setLevel(logging.INFO)
+    if args.profile is not None:
+        with SessionProfiler(datetime.datetime.now().strftime(args.profile)):
+            run(args, config)
+    else:
+        run(args, config)
+
+
+def init_providers(config: GptCliConfig):
+    if config.pricing_file:
+        load_pricing_file(os.path.expanduser(config.pricing_file))
+    if config.pricing:
+        load_pricing_overrides(config.pricing)
 
     if config.openai_base_url:
         openai.base_url = config.openai_base_url
@@ -206,14 +555,68 @@ def main():
     if config.llama_models is not None:
         init_llama_models(config.llama_models)
 
+
+def init_ledger(assistant: Assistant, assistant_name: str, config: GptCliConfig):
+    path = ledger_path(config)
+    if path is not None:
+        try:
+            ledger = CostLedger(path)
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(
+                "Cannot open the usage ledger, not recording usage or enforcing "
+                "budgets: %s",
+                e,
+            )
+            return
+        assistant.listeners.append(
+            LedgerAssistantListener(ledger, assistant_name, config.budget)
+        )
+
+
+def init_tools(assistant: Assistant, config: GptCliConfig):
+    names = assistant.config.get("tools")
+    if not names:
+        return
+    try:
+        assistant.tools = ToolExecutor(load_tools(names, config.tools))
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+
+def run(args, config: GptCliConfig):
+    if args.log_file is not None:
+        filename = datetime.datetime.now().strftime(args.log_file)
+        logging.basicConfig(
+            filename=filename,
+            level=args.log_level,
+            format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        )
+        # Disable overly verbose logging for markdown_it
+        logging.getLogger("markdown_it").setLevel(logging.INFO)
+
+    if args.trace_file is not None:
+        init_tracing(args.trace_file)
+
+    init_providers(config)
+
     assistant = init_assistant(cast(AssistantGlobalArgs, args), config.assistants)
 
+    init_ledger(assistant, args.assistant_name, config)
+    init_tools(assistant, config)
+    if args.json_schema is not None:
+        try:
+            assistant.config["json_schema"] = load_schema(args.json_schema)
+        except (OSError, ValueError) as e:
+            print(f"Invalid JSON schema: {e}", file=sys.stderr)
+            sys.exit(1)
+
     if args.prompt is not None:
         run_non_interactive(args, assistant)
     elif args.execute is not None:
         run_execute(args, assistant)
     else:
-        run_interactive(args, assistant)
+        run_interactive(args, assistant, config)
 
 
 def run_execute(args, assistant):
@@ -224,7 +627,11 @@ def run_execute(args, assistant):
     )
     if args.execute == "-":
         args.execute = "".join(sys.stdin.readlines())
-    execute(assistant, args.execute)
+    try:
+        execute(assistant, args.execute)
+    except BudgetExceededError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
 
 
 def run_non_interactive(args, assistant):
@@ -233,40 +640,173 @@ def run_non_interactive(args, assistant):
         args.prompt,
         assistant.config,
     )
+    if args.map_reduce:
+        run_map_reduce(args, assistant)
+        return
+
     if "-" in args.prompt:
         args.prompt[args.prompt.index("-")] = "".join(sys.stdin.readlines())
 
-    simple_response(assistant, "\n".join(args.prompt), stream=not args.no_stream)
+    prompt = "\n".join(args.prompt)
+    if args.context:
+        context = ContextIndex(args.context)
+        context.refresh()
+        prompt = context.apply(prompt, args.context_tokens)
+
+    try:
+        simple_response(
+            assistant,
+            prompt,
+            stream=not args.no_stream,
+            output_format=args.output_format,
+            json_output=assistant.config.get("json_schema") is not None,
+        )
+    except BudgetExceededError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    except json.JSONDecodeError as e:
+        print(f"\nThe response isn't valid JSON: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+def run_map_reduce(args, assistant):
+    inputs = args.input or ["-"]
+    if "-" in args.prompt and "-" in inputs:
+        print("Standard input can't be read both as the prompt and as the input.")
+        sys.exit(1)
+    if "-" in args.prompt:
+        args.prompt[args.prompt.index("-")] = "".join(sys.stdin.readlines())
+
+    map_reduce = MapReduce(
+        assistant, "\n".join(args.prompt), args.chunk_tokens, args.parallelism
+    )
+    lines = itertools.chain.from_iterable(read_lines(path) for path in inputs)
+    try:
+        print(map_reduce.run(lines))
+    except CompletionError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
 
 
 class CLIChatSession(ChatSession):
     def __init__(
-        self, assistant: Assistant, markdown: bool, show_price: bool, stream: bool
+        self,
+        assistant: Assistant,
+        markdown: bool,
+        show_price: bool,
+        stream: bool,
+        max_fps: Optional[float] = None,
+        pipeline: bool = False,
+        batch_deltas: bool = False,
+        queue_input: bool = False,
+        context_tokens: int = 8000,
+        async_listeners: bool = False,
+        metrics_file: Optional[str] = None,
+        archive: Optional[ConversationArchive] = None,
+        assistant_name: Optional[str] = None,
     ):
-        listeners = [
-            CLIChatListener(markdown),
-            LoggingChatListener(),
+        # Live markdown redraws can't share the terminal with an open input prompt
+        markdown = markdown and not queue_input
+        # Metrics need timestamps taken in the token loop itself, and are cheap to record
+        listeners: List[ChatListener] = [
+            CLIChatListener(markdown, max_fps, echo_input=queue_input),
+            MetricsChatListener(assistant, metrics_file),
         ]
 
+        # Everything except the terminal UI can be dispatched off the critical path
+        background_listeners: List[ChatListener] = [LoggingChatListener()]
         if show_price:
-            listeners.append(PriceChatListener(assistant))
+            background_listeners.append(PriceChatListener(assistant))
+        if archive is not None:
+            background_listeners.append(ArchiveChatListener(archive, assistant_name))
+
+        if async_listeners:
+            listeners.append(
+                BackgroundChatListener(CompositeChatListener(background_listeners))
+            )
+        else:
+            listeners.extend(background_listeners)
 
         listener = CompositeChatListener(listeners)
-        super().__init__(assistant, listener, stream)
+        super().__init__(
+            assistant,
+            listener,
+            stream,
+            pipeline,
+            batch_deltas,
+            queue_input,
+            context_tokens,
+        )
 
 
-def run_interactive(args, assistant):
+def init_history(config: GptCliConfig) -> History:
+    os.makedirs(os.path.dirname(DEFAULT_HISTORY_PATH), exist_ok=True)
+    if config.history_backend == "sqlite":
+        # Load the history in the background, so that the prompt shows up right away
+        return ThreadedHistory(
+            SQLiteHistory(DEFAULT_HISTORY_DB_PATH, import_from=DEFAULT_HISTORY_PATH)
+        )
+    return CLIFileHistory(DEFAULT_HISTORY_PATH)
+
+
+def run_interactive(args, assistant, config: GptCliConfig):
     logger.info("Starting a new chat session. Assistant config: %s", assistant.config)
+    archive = None
+    if config.archive_file:
+        try:
+            archive = ConversationArchive(os.path.expanduser(config.archive_file))
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("Cannot open the conversation archive, not archiving: %s", e)
+
     session = CLIChatSession(
         assistant=assistant,
         markdown=args.markdown,
         show_price=args.show_price,
         stream=not args.no_stream,
+        max_fps=args.max_fps,
+        pipeline=args.pipeline,
+        batch_deltas=config.batch_deltas,
+        queue_input=args.queue_input,
+        context_tokens=args.context_tokens,
+        async_listeners=args.async_listeners,
+        metrics_file=args.metrics_file,
+        archive=archive,
+        assistant_name=args.assistant_name,
+    )
+    if args.resume is not None:
+        messages = archive.conversation(args.resume) if archive else []
+        if not messages:
+            print(f"No archived conversation #{args.resume}.", file=sys.stderr)
+            sys.exit(1)
+        session.seed(messages)
+        print(f"Continuing conversation #{args.resume} ({len(messages)} messages).")
+
+    if args.context:
+        try:
+            session.set_context(args.context)
+        except InvalidArgumentError as e:
+            print(e.message, file=sys.stderr)
+            sys.exit(1)
+
+    on_typing = None
+    if args.prewarm:
+        assistant.prewarm()
+        on_typing = assistant.prewarm
+
+    if not args.queue_input:
+        input_provider = CLIUserInputProvider(init_history(config), on_typing=on_typing)
+        session.loop(input_provider)
+        return
+
+    input_provider = CLIUserInputProvider(
+        init_history(config),
+        erase_when_done=True,
+        on_interrupt=session.interrupt,
+        on_typing=on_typing,
     )
-    history_filename = os.path.expanduser("~/.config/gpt-cli/history")
-    os.makedirs(os.path.dirname(history_filename), exist_ok=True)
-    input_provider = CLIUserInputProvider(history_filename=history_filename)
-    session.loop(input_provider)
+    # Print the responses above the input prompt instead of over it
+    with patch_stdout(raw=True):
+        session.loop(input_provider)
 
 
 if __name__ == "__main__":
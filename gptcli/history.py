@@ -0,0 +1,106 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterable, Optional
+
+from prompt_toolkit.history import FileHistory, History
+
+from gptcli.ledger import BUSY_TIMEOUT_SECONDS
+from gptcli.session import ALL_COMMANDS
+
+DEFAULT_HISTORY_PATH = os.path.join(
+    os.path.expanduser("~"), ".config", "gpt-cli", "history"
+)
+DEFAULT_HISTORY_DB_PATH = DEFAULT_HISTORY_PATH + ".db"
+
+# Every entry is stored once: using an entry again replaces its row, which moves it
+# to the end of the rowid order
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    text TEXT NOT NULL UNIQUE
+);
+"""
+
+PAGE_SIZE = 500
+
+
+class CLIFileHistory(FileHistory):
+    def append_string(self, string: str) -> None:
+        if string in ALL_COMMANDS:
+            return
+        return super().append_string(string)
+
+
+class SQLiteHistory(History):
+    """
+    Input history in SQLite, without duplicates. Entries are loaded most recent first,
+    a page at a time, so that together with `ThreadedHistory` the prompt is usable
+    right away however long the history is. Any number of concurrent sessions can
+    write to it.
+
+    The entries of `import_from`, a `FileHistory` file, are imported when the
+    database is empty.
+    """
+
+    def __init__(self, path: str, import_from: Optional[str] = None):
+        super().__init__()
+        self.path = path
+        self.import_from = import_from
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            path,
+            timeout=BUSY_TIMEOUT_SECONDS,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def _import(self):
+        with self.lock:
+            (count,) = self.connection.execute(
+                "SELECT COUNT(*) FROM history"
+            ).fetchone()
+        if count or not self.import_from or not os.path.isfile(self.import_from):
+            return
+
+        # `FileHistory` yields the most recent entries first
+        entries = list(FileHistory(self.import_from).load_history_strings())
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN")
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO history (timestamp, text) VALUES (?, ?)",
+                ((now, text) for text in reversed(entries)),
+            )
+            self.connection.execute("COMMIT")
+
+    def load_history_strings(self) -> Iterable[str]:
+        self._import()
+        last_id = None
+        while True:
+            with self.lock:
+                rows = self.connection.execute(
+                    "SELECT id, text FROM history WHERE ? IS NULL OR id < ? "
+                    "ORDER BY id DESC LIMIT ?",
+                    (last_id, last_id, PAGE_SIZE),
+                ).fetchall()
+            for _, text in rows:
+                yield text
+            if len(rows) < PAGE_SIZE:
+                return
+            last_id = rows[-1][0]
+
+    def store_string(self, string: str) -> None:
+        if string in ALL_COMMANDS:
+            return
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO history (timestamp, text) VALUES (?, ?)",
+                (time.time(), string),
+            )
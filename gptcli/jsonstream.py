@@ -0,0 +1,138 @@
+import json
+import re
+from typing import Any, List, Literal, Optional, Union
+
+from attr import dataclass
+
+# The characters that change the parser's state; everything in between is copied
+SPECIAL_CHARACTERS = re.compile(r'[\[\]{}",:\\]')
+
+
+@dataclass(slots=True)
+class JsonItemEvent:
+    """
+    A complete member of the top-level JSON value: an array item (`key` is its index)
+    or an object field.
+    """
+
+    key: Union[int, str]
+    value: Any
+    type: Literal["json_item"] = "json_item"
+
+    def to_json(self) -> str:
+        """
+        The item as a line of JSON Lines: array items as is, object fields as an
+        object with a single field.
+        """
+        if isinstance(self.key, str):
+            return json.dumps({self.key: self.value})
+        return json.dumps(self.value)
+
+
+class JsonStreamParser:
+    """
+    Parses a JSON document as it's streamed, and returns each member of the
+    top-level array or object as soon as it's complete, e.g. when the closing bracket
+    of an item or the comma after a field arrives. Text before the top-level value,
+    such as a Markdown code fence, is skipped.
+
+    Only the structural characters are examined, and each member is decoded once,
+    by `json.loads`, when it's complete.
+    """
+
+    def __init__(self):
+        # The text of the current member
+        self.member: List[str] = []
+        # "[" or "{" once the top-level value started
+        self.container: Optional[str] = None
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        # Whether the current object member is past the colon
+        self.in_value = False
+        self.index = 0
+        self.done = False
+
+    def feed(self, text: str) -> List[JsonItemEvent]:
+        items: List[JsonItemEvent] = []
+        position = 0
+        while position < len(text) and not self.done:
+            if self.escaped:
+                # The escaped character is copied along with the backslash
+                self.escaped = False
+                self.member.append(text[position])
+                position += 1
+                continue
+
+            match = SPECIAL_CHARACTERS.search(text, position)
+            end = match.start() if match else len(text)
+            if self.container is not None:
+                self.member.append(text[position:end])
+            if match is None:
+                break
+            position = end + 1
+            self._special(match.group(), items)
+        return items
+
+    def _special(self, char: str, items: List[JsonItemEvent]):
+        if self.container is None:
+            if char in "[{":
+                self.container = char
+                self.depth = 1
+            return
+
+        if self.in_string:
+            self.member.append(char)
+            if char == "\\":
+                self.escaped = True
+            elif char == '"':
+                self.in_string = False
+                if self.depth == 1 and (self.container == "[" or self.in_value):
+                    # A string item or field value
+                    self._emit(items)
+            return
+
+        if char in "]}":
+            self.depth -= 1
+            if self.depth == 0:
+                self._emit(items)
+                self.done = True
+                return
+        elif char in "[{":
+            self.depth += 1
+        elif char == '"':
+            self.in_string = True
+        elif self.depth == 1 and char == ",":
+            self._emit(items)
+            return
+        elif self.depth == 1 and char == ":":
+            self.in_value = True
+
+        self.member.append(char)
+        if char in "]}" and self.depth == 1:
+            # A nested container item or field value
+            self._emit(items)
+
+    def _emit(self, items: List[JsonItemEvent]):
+        text = "".join(self.member).strip()
+        self.member = []
+        self.in_value = False
+        if not text:
+            # The member was already emitted when its value closed
+            return
+        if self.container == "{":
+            ((key, value),) = json.loads("{" + text + "}").items()
+            items.append(JsonItemEvent(key, value))
+        else:
+            items.append(JsonItemEvent(self.index, json.loads(text)))
+            self.index += 1
+
+
+def load_schema(value: str) -> dict:
+    """
+    A JSON schema given inline or as the path of a file.
+    """
+    if value.lstrip().startswith("{"):
+        return json.loads(value)
+    with open(value, "r") as f:
+        return json.load(f)
@@ -0,0 +1,243 @@
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Literal, Optional, Tuple, TypedDict
+
+from rich.console import Console
+from rich.table import Table
+
+from gptcli.assistant import AssistantListener
+from gptcli.completion import BadRequestError, UsageEvent
+
+DEFAULT_LEDGER_PATH = os.path.join(
+    os.path.expanduser("~"), ".config", "gpt-cli", "usage.db"
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    day TEXT NOT NULL,
+    assistant TEXT,
+    model TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    total_tokens INTEGER NOT NULL,
+    cost REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS usage_day_model ON usage (day, model);
+CREATE INDEX IF NOT EXISTS usage_model_day ON usage (model, day);
+"""
+
+# Concurrent `gpt` processes wait for each other's writes for up to this long
+BUSY_TIMEOUT_SECONDS = 30
+
+
+class BudgetConfig(TypedDict, total=False):
+    daily: float
+    monthly: float
+    mode: Literal["soft", "hard"]
+
+
+class BudgetExceededError(BadRequestError):
+    pass
+
+
+class Rollup(TypedDict):
+    key: str
+    requests: int
+    prompt_tokens: int
+    completion_tokens: int
+    cost: float
+
+
+class CostLedger:
+    """
+    Local SQLite record of every usage event. Uses WAL mode and a busy timeout, so
+    that any number of `gpt` processes can write to the same ledger concurrently.
+    """
+
+    def __init__(self, path: str = DEFAULT_LEDGER_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            path,
+            timeout=BUSY_TIMEOUT_SECONDS,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def record(
+        self,
+        model: str,
+        usage: UsageEvent,
+        assistant: Optional[str] = None,
+        timestamp: Optional[float] = None,
+    ):
+        timestamp = timestamp if timestamp is not None else time.time()
+        day = datetime.date.fromtimestamp(timestamp).isoformat()
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO usage (timestamp, day, assistant, model, prompt_tokens, "
+                "completion_tokens, total_tokens, cost) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    timestamp,
+                    day,
+                    assistant,
+                    model,
+                    usage.prompt_tokens,
+                    usage.completion_tokens,
+                    usage.total_tokens,
+                    usage.cost or 0.0,
+                ),
+            )
+
+    def spend_since(self, day: datetime.date) -> float:
+        with self.lock:
+            (spend,) = self.connection.execute(
+                "SELECT COALESCE(SUM(cost), 0) FROM usage WHERE day >= ?",
+                (day.isoformat(),),
+            ).fetchone()
+        return spend
+
+    def _rollup(self, column: str, since: datetime.date) -> List[Rollup]:
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT {column}, COUNT(*), SUM(prompt_tokens), SUM(completion_tokens), "
+                f"SUM(cost) FROM usage WHERE day >= ? GROUP BY {column} ORDER BY {column}",
+                (since.isoformat(),),
+            ).fetchall()
+        return [
+            {
+                "key": key,
+                "requests": requests,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "cost": cost,
+            }
+            for key, requests, prompt_tokens, completion_tokens, cost in rows
+        ]
+
+    def daily_rollup(self, since: datetime.date) -> List[Rollup]:
+        return self._rollup("day", since)
+
+    def model_rollup(self, since: datetime.date) -> List[Rollup]:
+        return self._rollup("model", since)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def budget_periods(
+    budget: BudgetConfig, today: datetime.date
+) -> List[Tuple[str, float, datetime.date]]:
+    periods = []
+    if budget.get("daily") is not None:
+        periods.append(("daily", float(budget["daily"]), today))
+    if budget.get("monthly") is not None:
+        periods.append(("monthly", float(budget["monthly"]), today.replace(day=1)))
+    return periods
+
+
+class LedgerAssistantListener(AssistantListener):
+    """
+    Records every usage event in the ledger and checks the budget before each request.
+    In `hard` mode a request over budget raises `BudgetExceededError`; in `soft` mode
+    a warning is printed once per period.
+    """
+
+    def __init__(
+        self,
+        ledger: CostLedger,
+        assistant_name: Optional[str],
+        budget: Optional[BudgetConfig] = None,
+    ):
+        self.ledger = ledger
+        self.assistant_name = assistant_name
+        self.budget = budget
+        self.warned: set = set()
+        self.logger = logging.getLogger("gptcli-ledger")
+        self.console = Console(stderr=True)
+
+    def on_request(self, model: str):
+        if not self.budget:
+            return
+
+        today = datetime.date.today()
+        for period, limit, since in budget_periods(self.budget, today):
+            try:
+                spend = self.ledger.spend_since(since)
+            except sqlite3.Error:
+                self.logger.exception("Failed to read the spend from the ledger")
+                return
+            if spend < limit:
+                continue
+
+            message = f"The {period} budget of ${limit:.2f} is exhausted (spent ${spend:.2f})."
+            if self.budget.get("mode", "hard") == "hard":
+                raise BudgetExceededError(message)
+
+            if (period, since) not in self.warned:
+                self.warned.add((period, since))
+                self.logger.warning(message)
+                self.console.print(f"[yellow]{message}[/yellow]")
+
+    def on_usage(self, model: str, usage: UsageEvent):
+        try:
+            self.ledger.record(model, usage, self.assistant_name)
+        except sqlite3.Error:
+            self.logger.exception("Failed to record usage in the ledger")
+
+
+def print_usage_report(
+    ledger: CostLedger,
+    since: datetime.date,
+    budget: Optional[BudgetConfig] = None,
+    console: Optional[Console] = None,
+):
+    console = console or Console()
+    for title, rollup in [
+        ("Daily usage", ledger.daily_rollup(since)),
+        ("Usage by model", ledger.model_rollup(since)),
+    ]:
+        table = Table(title=f"{title} since {since.isoformat()}", title_justify="left")
+        table.add_column("Day" if title == "Daily usage" else "Model")
+        table.add_column("Requests", justify="right")
+        table.add_column("Prompt tokens", justify="right")
+        table.add_column("Completion tokens", justify="right")
+        table.add_column("Cost", justify="right")
+        for row in rollup:
+            table.add_row(
+                row["key"],
+                str(row["requests"]),
+                str(row["prompt_tokens"]),
+                str(row["completion_tokens"]),
+                f"${row['cost']:.3f}",
+            )
+        table.add_section()
+        table.add_row(
+            "Total",
+            str(sum(row["requests"] for row in rollup)),
+            str(sum(row["prompt_tokens"] for row in rollup)),
+            str(sum(row["completion_tokens"] for row in rollup)),
+            f"${sum(row['cost'] for row in rollup):.3f}",
+        )
+        console.print(table)
+
+    if budget:
+        for period, limit, period_start in budget_periods(
+            budget, datetime.date.today()
+        ):
+            spend = ledger.spend_since(period_start)
+            console.print(
+                f"{period.capitalize()} budget: ${spend:.2f} of ${limit:.2f} "
+                f"({budget.get('mode', 'hard')})"
+            )
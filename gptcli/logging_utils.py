@@ -18,7 +18,8 @@ class LoggingChatListener(ChatListener):
             self.logger.info("Re-generating the last message.")
 
     def on_error(self, e: Exception):
-        self.logger.exception(e)
+        # Pass the exception explicitly, this may run outside of the except block
+        self.logger.exception(e, exc_info=e)
 
     def on_chat_message(self, message: Message):
         self.logger.info(f"{message['role']}: {message['content']}")
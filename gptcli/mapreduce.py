@@ -0,0 +1,195 @@
+import mmap
+import os
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import (
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    TextIO,
+    Tuple,
+    TypeVar,
+)
+
+from gptcli.assistant import Assistant
+from gptcli.completion import Message, ResponseBuffer, UsageEvent
+from gptcli.pricing import CHARS_PER_TOKEN
+
+MAP_PROMPT = """{prompt}
+
+The input is too long to process at once, so it's split into parts. This is part {index}:
+
+{input}"""
+
+REDUCE_PROMPT = """{prompt}
+
+The input was too long to process at once, so it was split into parts and answered \
+part by part. Below are the answers for consecutive parts, in order. Combine them \
+into a single answer.
+
+{input}"""
+
+ANSWER_TEMPLATE = "Answer for part {index}:\n{answer}\n\n"
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def bounded_map(
+    fn: Callable[[T], R], items: Iterable[T], parallelism: int
+) -> Iterator["Future[R]"]:
+    """
+    Call `fn` on every item on a pool of `parallelism` threads, and yield the futures
+    in order. Items are consumed only as fast as they're processed, so that at most
+    `parallelism` of them are in memory at a time.
+    """
+    slots = threading.BoundedSemaphore(parallelism)
+    with ThreadPoolExecutor(parallelism) as executor:
+        for item in items:
+            slots.acquire()
+            future = executor.submit(fn, item)
+            future.add_done_callback(lambda _: slots.release())
+            yield future
+
+
+def read_lines(path: str) -> Iterator[str]:
+    """
+    Lines of the file at `path`, or of standard input if it's `-`. Files are
+    memory-mapped, so that only the part that is being chunked needs to be in memory.
+    """
+    if path == "-":
+        yield from sys.stdin
+        return
+
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for line in iter(mapped.readline, b""):
+                yield line.decode("utf-8", errors="replace")
+
+
+def pack_texts(texts: Iterable[str], max_tokens: int) -> Iterator[str]:
+    """
+    Pack consecutive texts into chunks of at most `max_tokens` estimated tokens. Texts
+    are kept whole, except for those that don't fit into a chunk on their own.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    chunk: List[str] = []
+    size = 0
+    for text in texts:
+        if size + len(text) > max_chars and chunk:
+            yield "".join(chunk)
+            chunk, size = [], 0
+        while len(text) > max_chars:
+            yield text[:max_chars]
+            text = text[max_chars:]
+        if text:
+            chunk.append(text)
+            size += len(text)
+    if chunk:
+        yield "".join(chunk)
+
+
+class MapReduce:
+    """
+    Answers a prompt about an input that doesn't fit into the context window: the
+    prompt is applied to token-budgeted chunks of the input concurrently (map), and the
+    answers are then combined, in as many rounds as needed for them to fit (reduce).
+
+    Progress and the cost of every request are reported to `progress`.
+    """
+
+    def __init__(
+        self,
+        assistant: Assistant,
+        prompt: str,
+        chunk_tokens: int,
+        parallelism: int,
+        progress: Optional[TextIO] = sys.stderr,
+    ):
+        self.assistant = assistant
+        self.prompt = prompt
+        self.chunk_tokens = chunk_tokens
+        self.parallelism = parallelism
+        self.progress = progress
+        self.usage: Optional[UsageEvent] = None
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.done = 0
+
+    def run(self, lines: Iterable[str]) -> str:
+        answers = self.map("map", MAP_PROMPT, pack_texts(lines, self.chunk_tokens))
+        while len(answers) > 1:
+            parts = [
+                ANSWER_TEMPLATE.format(index=index + 1, answer=answer)
+                for index, answer in enumerate(answers)
+            ]
+            groups = list(pack_texts(parts, self.chunk_tokens))
+            if len(groups) >= len(answers):
+                # The answers are too long to pack, combine them pairwise instead
+                groups = ["".join(parts[i : i + 2]) for i in range(0, len(parts), 2)]
+            answers = self.map("reduce", REDUCE_PROMPT, groups)
+
+        if self.usage is not None:
+            self._report(
+                f"Total: {self.usage.total_tokens} tokens, ${self.usage.cost:.4f}"
+            )
+        return answers[0] if answers else ""
+
+    def map(self, stage: str, template: str, inputs: Iterable[str]) -> List[str]:
+        """
+        Answer `template` for every input with at most `parallelism` requests in
+        flight. The inputs are consumed only as fast as they're processed.
+        """
+        self.submitted = self.done = 0
+
+        def contents() -> Iterator[Tuple[int, str]]:
+            for index, text in enumerate(inputs):
+                with self.lock:
+                    self.submitted += 1
+                yield index, template.format(
+                    prompt=self.prompt, index=index + 1, input=text
+                )
+
+        futures = list(
+            bounded_map(
+                lambda item: self._complete(stage, *item),
+                contents(),
+                self.parallelism,
+            )
+        )
+        return [future.result() for future in futures]
+
+    def _complete(self, stage: str, index: int, content: str) -> str:
+        messages: List[Message] = self.assistant.init_messages()
+        messages.append({"role": "user", "content": content})
+        answer = ResponseBuffer()
+        usage: Optional[UsageEvent] = None
+        for event in self.assistant.complete_chat(messages, stream=False):
+            if event.type == "message_delta":
+                answer.append(event.text)
+            elif event.type == "usage":
+                usage = event
+
+        with self.lock:
+            self.done += 1
+            line = f"[{stage} {self.done}/{self.submitted}] Part {index + 1}: "
+            if usage is None:
+                line += "no usage reported"
+            else:
+                self.usage = usage if self.usage is None else self.usage + usage
+                line += (
+                    f"{usage.prompt_tokens} prompt + {usage.completion_tokens} "
+                    f"completion tokens, ${usage.cost:.4f}"
+                )
+            self._report(line)
+        return answer.getvalue()
+
+    def _report(self, line: str):
+        if self.progress is not None:
+            self.progress.write(line + "\n")
+            self.progress.flush()
@@ -0,0 +1,370 @@
+import bisect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from rich.console import Console
+from rich.table import Table
+
+from gptcli.assistant import Assistant, get_provider_name
+from gptcli.completion import CompletionError, Message, ToolCallEvent, UsageEvent
+from gptcli.ledger import BudgetExceededError
+from gptcli.session import ChatListener, ResponseStreamer
+
+# Upper bounds of the histogram buckets, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+INTER_TOKEN_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+PHASES = ("thinking", "message", "tool_call")
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Approximate quantile: the upper bound of the bucket containing it.
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def to_dict(self) -> dict:
+        return {
+            "buckets": list(self.buckets),
+            "counts": self.counts,
+            "count": self.count,
+            "sum": self.sum,
+        }
+
+
+class ModelMetrics:
+    """
+    Aggregated metrics for a single (provider, model) pair.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.output_tokens = 0
+        self.generation_time = 0.0
+        self.ttft = Histogram(LATENCY_BUCKETS)
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.inter_token = {phase: Histogram(INTER_TOKEN_BUCKETS) for phase in PHASES}
+        self.phase_time = {phase: 0.0 for phase in PHASES}
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        if self.generation_time <= 0:
+            return None
+        return self.output_tokens / self.generation_time
+
+    def to_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "output_tokens": self.output_tokens,
+            "generation_time": self.generation_time,
+            "tokens_per_second": self.tokens_per_second,
+            "ttft": self.ttft.to_dict(),
+            "latency": self.latency.to_dict(),
+            "inter_token": {k: v.to_dict() for k, v in self.inter_token.items()},
+            "phase_time": self.phase_time,
+        }
+
+
+class RequestMetrics:
+    """
+    Timestamps collected for a single response while it's being streamed.
+    """
+
+    def __init__(self, started_at: float):
+        self.started_at = started_at
+        self.finished_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self.last_token_at: Optional[float] = None
+        self.deltas = 0
+        self.gaps: Dict[str, List[float]] = {phase: [] for phase in PHASES}
+        self.phase_start: Dict[str, float] = {}
+        self.phase_end: Dict[str, float] = {}
+        self.last_phase_at: Dict[str, float] = {}
+
+    def on_event(self, phase: str):
+        now = time.perf_counter()
+        if self.first_token_at is None:
+            self.first_token_at = now
+        self.last_token_at = now
+        self.deltas += 1
+
+        last = self.last_phase_at.get(phase)
+        if last is not None:
+            self.gaps[phase].append(now - last)
+        else:
+            self.phase_start[phase] = now
+        self.last_phase_at[phase] = now
+        self.phase_end[phase] = now
+
+
+class MetricsResponseStreamer(ResponseStreamer):
+    def __init__(self, listener: "MetricsChatListener"):
+        self.listener = listener
+        self.request: Optional[RequestMetrics] = None
+
+    def __enter__(self):
+        # The provider iterator is lazy, so the request goes out right after this
+        self.request = RequestMetrics(time.perf_counter())
+        return self
+
+    def on_next_token(self, token: str):
+        assert self.request
+        self.request.on_event("message")
+
+    def on_thinking_token(self, token: str):
+        assert self.request
+        self.request.on_event("thinking")
+
+    def on_tool_call(self, tool_call: ToolCallEvent):
+        assert self.request
+        self.request.on_event("tool_call")
+
+    def __exit__(self, *args):
+        assert self.request
+        self.request.finished_at = time.perf_counter()
+        self.listener.pending_request = self.request
+
+
+class MetricsChatListener(ChatListener):
+    """
+    Records time-to-first-token, total latency, output throughput and inter-token
+    latency histograms per provider, model and phase (thinking, message, tool calls).
+    """
+
+    def __init__(self, assistant: Assistant, export_path: Optional[str] = None):
+        self.assistant = assistant
+        self.export_path = export_path
+        self.metrics: Dict[Tuple[str, str], ModelMetrics] = {}
+        # Side turns render and report their responses on their own threads
+        self.local = threading.local()
+        self.logger = logging.getLogger("gptcli-metrics")
+        self.console = Console()
+
+    def _current_metrics(self) -> ModelMetrics:
+        model = self.assistant.active_model()
+        key = (get_provider_name(model), model)
+        if key not in self.metrics:
+            self.metrics[key] = ModelMetrics()
+        return self.metrics[key]
+
+    @property
+    def pending_request(self) -> Optional[RequestMetrics]:
+        """
+        The metrics of the response the current thread rendered last.
+        """
+        return getattr(self.local, "pending_request", None)
+
+    @pending_request.setter
+    def pending_request(self, request: Optional[RequestMetrics]):
+        self.local.pending_request = request
+
+    def response_streamer(self) -> ResponseStreamer:
+        return MetricsResponseStreamer(self)
+
+    def on_error(self, e: Exception):
+        self.pending_request = None
+        # Local errors such as an invalid `:context` path or a refusal to exceed the
+        # budget aren't the provider's
+        if isinstance(e, CompletionError) and not isinstance(e, BudgetExceededError):
+            self._current_metrics().errors += 1
+
+    def on_chat_response(
+        self,
+        messages: List[Message],
+        response: Message,
+        usage: Optional[UsageEvent] = None,
+    ):
+        request, self.pending_request = self.pending_request, None
+        if request is None or request.finished_at is None:
+            return
+
+        started_at = request.started_at
+        first_token_at = request.first_token_at
+        finished_at = request.finished_at
+
+        # Prefer the timestamps taken at the provider boundary, so that time spent
+        # rendering isn't attributed to the provider
+        timing = self.assistant.last_timing
+        if timing is not None and timing.started_at >= started_at:
+            started_at = timing.started_at
+            first_token_at = timing.first_event_at or first_token_at
+            finished_at = timing.finished_at or finished_at
+
+        metrics = self._current_metrics()
+        metrics.requests += 1
+        metrics.latency.observe(finished_at - started_at)
+        if first_token_at is not None:
+            metrics.ttft.observe(first_token_at - started_at)
+            metrics.generation_time += finished_at - first_token_at
+            metrics.output_tokens += (
+                usage.completion_tokens if usage is not None else request.deltas
+            )
+
+        for phase in PHASES:
+            for gap in request.gaps[phase]:
+                metrics.inter_token[phase].observe(gap)
+            if phase in request.phase_start:
+                metrics.phase_time[phase] += (
+                    request.phase_end[phase] - request.phase_start[phase]
+                )
+
+        if first_token_at is not None and request.first_token_at is not None:
+            self.logger.info(
+                "Request metrics: ttft %.3fs, latency %.3fs, local delay %.3fs",
+                first_token_at - started_at,
+                finished_at - started_at,
+                request.first_token_at - first_token_at,
+            )
+
+        if self.export_path:
+            self.export(self.export_path)
+
+    def on_chat_stats(self):
+        table = Table(title="Session stats", title_justify="left")
+        for column in [
+            "Provider",
+            "Model",
+            "Requests",
+            "Errors",
+            "TTFT p50",
+            "Latency p50",
+            "Tokens/s",
+            "Token gap p50",
+            "Token gap p99",
+        ]:
+            table.add_column(column)
+
+        def fmt_seconds(value: Optional[float]) -> str:
+            if value is None:
+                return "-"
+            return f"{value * 1000:.0f}ms" if value < 1 else f"{value:.1f}s"
+
+        for (provider, model), metrics in sorted(self.metrics.items()):
+            tokens_per_second = metrics.tokens_per_second
+            table.add_row(
+                provider,
+                model,
+                str(metrics.requests),
+                str(metrics.errors),
+                fmt_seconds(metrics.ttft.quantile(0.5)),
+                fmt_seconds(metrics.latency.quantile(0.5)),
+                f"{tokens_per_second:.1f}" if tokens_per_second is not None else "-",
+                fmt_seconds(metrics.inter_token["message"].quantile(0.5)),
+                fmt_seconds(metrics.inter_token["message"].quantile(0.99)),
+            )
+
+        if not self.metrics:
+            self.console.print("[bold]No requests yet.[/bold]")
+        else:
+            self.console.print(table)
+
+    def on_chat_end(self):
+        if self.export_path:
+            self.export(self.export_path)
+
+    def to_dict(self) -> dict:
+        return {
+            "models": [
+                {"provider": provider, "model": model, **metrics.to_dict()}
+                for (provider, model), metrics in sorted(self.metrics.items())
+            ]
+        }
+
+    def to_prometheus(self) -> str:
+        lines: List[str] = []
+
+        def histogram(name: str, labels: str, hist: Histogram):
+            for bound, cumulative in zip(
+                [*hist.buckets, float("inf")],
+                _cumulative(hist.counts),
+            ):
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{labels}}} {hist.sum}")
+            lines.append(f"{name}_count{{{labels}}} {hist.count}")
+
+        header = [
+            ("gptcli_requests_total", "counter", "Completed requests."),
+            ("gptcli_errors_total", "counter", "Failed requests."),
+            ("gptcli_output_tokens_total", "counter", "Generated output tokens."),
+            ("gptcli_ttft_seconds", "histogram", "Time to first token."),
+            ("gptcli_latency_seconds", "histogram", "Total request latency."),
+            ("gptcli_inter_token_seconds", "histogram", "Gaps between deltas."),
+        ]
+        for name, kind, help in header:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (provider, model), metrics in sorted(self.metrics.items()):
+            labels = f'provider="{provider}",model="{_escape(model)}"'
+            lines.append(f"gptcli_requests_total{{{labels}}} {metrics.requests}")
+            lines.append(f"gptcli_errors_total{{{labels}}} {metrics.errors}")
+            lines.append(
+                f"gptcli_output_tokens_total{{{labels}}} {metrics.output_tokens}"
+            )
+            histogram("gptcli_ttft_seconds", labels, metrics.ttft)
+            histogram("gptcli_latency_seconds", labels, metrics.latency)
+            for phase, hist in metrics.inter_token.items():
+                histogram(
+                    "gptcli_inter_token_seconds", f'{labels},phase="{phase}"', hist
+                )
+
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: str):
+        """
+        Write the metrics to `path`, as a Prometheus textfile if it ends with `.prom`
+        and as JSON otherwise. The file is replaced atomically.
+        """
+        if path.endswith(".prom"):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_dict(), indent=2)
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w", dir=directory, prefix=".gptcli-metrics-", delete=False
+        ) as f:
+            f.write(content)
+        os.replace(f.name, path)
+
+
+def _cumulative(counts: List[int]) -> List[int]:
+    total = 0
+    result = []
+    for count in counts:
+        total += count
+        result.append(total)
+    return result
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"')
@@ -0,0 +1,256 @@
+import logging
+import queue
+import threading
+import time
+from typing import Any, Iterator, Optional, Tuple
+
+from attr import dataclass
+
+from gptcli.completion import (
+    CancellationToken,
+    CompletionEvent,
+    CompletionTimeoutError,
+    MessageDeltaEvent,
+    ThinkingDeltaEvent,
+)
+
+DEFAULT_QUEUE_SIZE = 1024
+
+# How often blocked queue operations wake up to check for cancellation
+POLL_INTERVAL = 0.1
+
+_END = object()
+
+logger = logging.getLogger("gptcli-pipeline")
+
+
+@dataclass
+class PipelineStats:
+    events: int = 0
+    max_queue_depth: int = 0
+    total_lag: float = 0.0
+    max_lag: float = 0.0
+    batches: int = 0
+    # Seconds from the start until the first event, and the longest gap between two
+    # events, as read from the provider
+    first_event_wait: Optional[float] = None
+    max_gap: float = 0.0
+
+    @property
+    def mean_lag(self) -> float:
+        return self.total_lag / self.events if self.events else 0.0
+
+
+class CompletionPipeline:
+    """
+    Drains a completion iterator on a background reader thread into a bounded queue,
+    so that a slow consumer (rendering, listeners) never stops the provider stream
+    from being read. Iterating over the pipeline yields the events in order and
+    re-raises any error raised by the underlying iterator.
+
+    With `batch=True`, consecutive message or thinking deltas that are already waiting
+    in the queue are merged into a single event, so a consumer that falls behind
+    catches up in one step instead of handling every delta separately.
+
+    The pipeline also acts as a watchdog: since the consumer never blocks on the
+    provider, it raises `CompletionTimeoutError` if the first event doesn't arrive
+    within `first_event_timeout` seconds, or no event arrives for `idle_timeout`
+    seconds after that. The request's `cancel` token is then cancelled, as it is when
+    the pipeline is closed early, so that the provider aborts the stalled request
+    instead of the reader thread waiting on it until the read timeout.
+    """
+
+    def __init__(
+        self,
+        completion_iter: Iterator[CompletionEvent],
+        max_queue_size: int = DEFAULT_QUEUE_SIZE,
+        batch: bool = False,
+        first_event_timeout: Optional[float] = None,
+        idle_timeout: Optional[float] = None,
+        cancel: Optional[CancellationToken] = None,
+    ):
+        self.completion_iter = completion_iter
+        self.cancel = cancel
+        self.batch = batch
+        self.first_event_timeout = first_event_timeout
+        self.idle_timeout = idle_timeout
+        self.started_at: Optional[float] = None
+        self.last_event_at: Optional[float] = None
+        self.held: Optional[Tuple[float, Any, Optional[BaseException]]] = None
+        self.queue: "queue.Queue[Tuple[float, Any, Optional[BaseException]]]" = (
+            queue.Queue(maxsize=max_queue_size)
+        )
+        self.stats = PipelineStats()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self._read, name="gptcli-reader", daemon=True
+        )
+
+    def _put(self, item, error: Optional[BaseException] = None) -> bool:
+        while not self.stopped.is_set():
+            try:
+                self.queue.put((time.monotonic(), item, error), timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _read(self):
+        try:
+            for event in self.completion_iter:
+                if not self._put(event):
+                    break
+            else:
+                self._put(_END)
+        except BaseException as e:
+            self._put(_END, e)
+        finally:
+            close = getattr(self.completion_iter, "close", None)
+            if close is not None:
+                close()
+
+    def _get(self) -> Tuple[float, Any, Optional[BaseException]]:
+        if self.held is not None:
+            item, self.held = self.held, None
+            return item
+
+        deadline = self._deadline()
+        while True:
+            timeout = POLL_INTERVAL
+            if deadline is not None:
+                timeout = max(0.0, min(timeout, deadline - time.monotonic()))
+            try:
+                return self.queue.get(timeout=timeout)
+            except queue.Empty:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise self._timeout_error()
+
+    def _deadline(self) -> Optional[float]:
+        if self.last_event_at is None:
+            if self.first_event_timeout is None or self.started_at is None:
+                return None
+            return self.started_at + self.first_event_timeout
+        if self.idle_timeout is None:
+            return None
+        return self.last_event_at + self.idle_timeout
+
+    def _timeout_error(self) -> CompletionTimeoutError:
+        now = time.monotonic()
+        if self.last_event_at is None:
+            assert self.started_at is not None
+            elapsed = now - self.started_at
+            error = CompletionTimeoutError(
+                f"No response after {elapsed:.1f}s",
+                "first_token",
+                self.first_event_timeout,
+                elapsed,
+            )
+        else:
+            elapsed = now - self.last_event_at
+            error = CompletionTimeoutError(
+                f"Response stalled for {elapsed:.1f}s",
+                "idle",
+                self.idle_timeout,
+                elapsed,
+            )
+        logger.warning(
+            "Completion timed out (%s): %.2fs elapsed, limit %.2fs, %d events received",
+            error.phase,
+            elapsed,
+            error.limit,
+            self.stats.events,
+        )
+        return error
+
+    def _record(self, enqueued_at: float):
+        lag = time.monotonic() - enqueued_at
+        self.stats.events += 1
+        self.stats.total_lag += lag
+        self.stats.max_lag = max(self.stats.max_lag, lag)
+
+        if self.last_event_at is None:
+            if self.started_at is not None:
+                self.stats.first_event_wait = enqueued_at - self.started_at
+        else:
+            self.stats.max_gap = max(
+                self.stats.max_gap, enqueued_at - self.last_event_at
+            )
+        self.last_event_at = enqueued_at
+
+    def _merge(self, event: CompletionEvent) -> CompletionEvent:
+        if not isinstance(event, (MessageDeltaEvent, ThinkingDeltaEvent)):
+            return event
+        event_class = type(event)
+
+        chunks = None
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if type(item[1]) is not event_class:
+                self.held = item
+                break
+            if chunks is None:
+                chunks = [event.text]
+            chunks.append(item[1].text)
+            self._record(item[0])
+
+        if chunks is None:
+            return event
+        return event_class("".join(chunks))
+
+    def start(self):
+        """
+        Start reading the completion iterator. Called automatically on iteration.
+        """
+        if self.thread.ident is None:
+            self.started_at = time.monotonic()
+            self.thread.start()
+
+    def __iter__(self) -> Iterator[CompletionEvent]:
+        self.start()
+        try:
+            while True:
+                depth = self.queue.qsize()
+                enqueued_at, event, error = self._get()
+                if event is _END:
+                    if error is not None:
+                        raise error
+                    return
+
+                self._record(enqueued_at)
+                self.stats.max_queue_depth = max(self.stats.max_queue_depth, depth)
+                if self.batch:
+                    event = self._merge(event)
+                self.stats.batches += 1
+                yield event
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Stop the reader thread and abort the request. Safe to call more than once.
+        """
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        if self.cancel is not None:
+            self.cancel.cancel()
+        logger.debug(
+            "Pipeline closed: %d events in %d batches, max queue depth %d, mean lag %.2fms, max lag %.2fms",
+            self.stats.events,
+            self.stats.batches,
+            self.stats.max_queue_depth,
+            self.stats.mean_lag * 1000,
+            self.stats.max_lag * 1000,
+        )
+        if self.first_event_timeout is not None or self.idle_timeout is not None:
+            first_event_wait = self.stats.first_event_wait
+            logger.info(
+                "Stream timings: first event after %s (limit %s), longest gap %.2fs (limit %s)",
+                f"{first_event_wait:.2f}s" if first_event_wait is not None else "-",
+                self.first_event_timeout,
+                self.stats.max_gap,
+                self.idle_timeout,
+            )
@@ -0,0 +1,220 @@
+from typing import Any, Dict, List, Optional, TypedDict
+
+import yaml
+
+from gptcli.completion import Message, Pricing, UsageEvent
+
+
+class PriceTier(TypedDict, total=False):
+    # The tier applies to requests with at least this many prompt tokens
+    min_prompt_tokens: int
+    prompt: float
+    response: float
+    cache_read: float
+    cache_write: float
+
+
+class PriceEntry(TypedDict, total=False):
+    """
+    Prices in USD per 1M tokens.
+    """
+
+    prompt: float
+    response: float
+    cache_read: float
+    cache_write: float
+    tiers: List[PriceTier]
+
+
+def _anthropic(prompt: float, response: float) -> PriceEntry:
+    return {
+        "prompt": prompt,
+        "response": response,
+        "cache_read": prompt * 0.1,
+        "cache_write": prompt * 1.25,
+    }
+
+
+# Keys are model name prefixes, the longest matching prefix wins
+DEFAULT_PRICES: Dict[str, PriceEntry] = {
+    # OpenAI
+    "gpt-3.5-turbo": {"prompt": 0.50, "response": 1.50},
+    "gpt-3.5-turbo-16k": {"prompt": 3.0, "response": 4.0},
+    "gpt-4": {"prompt": 30.0, "response": 60.0},
+    "gpt-4-32k": {"prompt": 60.0, "response": 120.0},
+    "gpt-4-turbo": {"prompt": 10.0, "response": 30.0},
+    "gpt-4-1106-preview": {"prompt": 10.0, "response": 30.0},
+    "gpt-4-0125-preview": {"prompt": 10.0, "response": 30.0},
+    "gpt-4o": {"prompt": 2.50, "response": 10.0, "cache_read": 1.25},
+    "gpt-4o-2024-05-13": {"prompt": 5.0, "response": 15.0},
+    "chatgpt-4o-latest": {"prompt": 5.0, "response": 15.0},
+    "gpt-4o-mini": {"prompt": 0.150, "response": 0.600, "cache_read": 0.075},
+    "gpt-4.1": {"prompt": 2.0, "response": 8.0, "cache_read": 0.50},
+    "gpt-4.1-mini": {"prompt": 0.40, "response": 1.60, "cache_read": 0.10},
+    "gpt-4.1-nano": {"prompt": 0.10, "response": 0.40, "cache_read": 0.025},
+    "gpt-4.5": {"prompt": 75.0, "response": 150.0, "cache_read": 37.5},
+    "o1": {"prompt": 15.0, "response": 60.0, "cache_read": 7.5},
+    "o1-pro": {"prompt": 150.0, "response": 600.0},
+    "o1-preview": {"prompt": 15.0, "response": 60.0, "cache_read": 7.5},
+    "o1-mini": {"prompt": 3.0, "response": 12.0, "cache_read": 1.5},
+    "o3": {"prompt": 10.0, "response": 40.0, "cache_read": 2.5},
+    "o3-mini": {"prompt": 1.10, "response": 4.40, "cache_read": 0.55},
+    "o4-mini": {"prompt": 1.10, "response": 4.40, "cache_read": 0.275},
+    # Anthropic
+    "claude-instant": _anthropic(1.63, 5.51),
+    "claude-2": _anthropic(11.02, 32.68),
+    "claude-3-opus": _anthropic(15.0, 75.0),
+    "claude-3-sonnet": _anthropic(3.0, 15.0),
+    "claude-3-5-sonnet": _anthropic(3.0, 15.0),
+    "claude-3-7-sonnet": _anthropic(3.0, 15.0),
+    "claude-3-haiku": _anthropic(0.25, 1.25),
+    "claude-3-5-haiku": _anthropic(0.80, 4.0),
+    "claude-sonnet-4": _anthropic(3.0, 15.0),
+    "claude-opus-4": _anthropic(15.0, 75.0),
+    # Google
+    "gemini-pro": {"prompt": 0.50, "response": 1.50},
+    "gemini-1.5-flash": {
+        "prompt": 0.075,
+        "response": 0.30,
+        "tiers": [{"min_prompt_tokens": 128_000, "prompt": 0.15, "response": 0.60}],
+    },
+    "gemini-1.5-flash-8b": {
+        "prompt": 0.0375,
+        "response": 0.15,
+        "tiers": [{"min_prompt_tokens": 128_000, "prompt": 0.075, "response": 0.30}],
+    },
+    "gemini-1.5-pro": {
+        "prompt": 1.25,
+        "response": 5.0,
+        "tiers": [{"min_prompt_tokens": 128_000, "prompt": 2.50, "response": 10.0}],
+    },
+    "gemini-2.0-flash": {"prompt": 0.10, "response": 0.40},
+    "gemini-2.0-flash-lite": {"prompt": 0.075, "response": 0.30},
+    "gemini-2.5-pro": {
+        "prompt": 1.25,
+        "response": 10.0,
+        "tiers": [{"min_prompt_tokens": 200_000, "prompt": 2.50, "response": 15.0}],
+    },
+    # Cohere
+    "command-r": {"prompt": 0.5, "response": 1.5},
+    "command-r-plus": {"prompt": 3.0, "response": 15.0},
+    "command-r7b": {"prompt": 0.0375, "response": 0.15},
+    "command-a": {"prompt": 2.5, "response": 10.0},
+}
+
+
+class PrefixTrie:
+    """
+    Character trie mapping prefixes to values, with longest-prefix lookup.
+    """
+
+    _VALUE = ""  # children are keyed by single characters, so this can't clash
+
+    def __init__(self):
+        self.root: Dict[str, Any] = {}
+
+    def insert(self, prefix: str, value: Any):
+        node = self.root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[self._VALUE] = value
+
+    def longest_prefix(self, key: str) -> Optional[Any]:
+        node = self.root
+        result = node.get(self._VALUE)
+        for char in key:
+            child = node.get(char)
+            if child is None:
+                break
+            node = child
+            result = node.get(self._VALUE, result)
+        return result
+
+
+class PricingRegistry:
+    def __init__(self, prices: Dict[str, PriceEntry]):
+        self.trie = PrefixTrie()
+        self.cache: Dict[str, Optional[PriceEntry]] = {}
+        self.update(prices)
+
+    def update(self, prices: Dict[str, PriceEntry]):
+        for prefix, entry in prices.items():
+            self.trie.insert(prefix, entry)
+        self.cache.clear()
+
+    def lookup(self, model: str) -> Optional[PriceEntry]:
+        if model not in self.cache:
+            self.cache[model] = self.trie.longest_prefix(model)
+        return self.cache[model]
+
+    def pricing(self, model: str, prompt_tokens: int = 0) -> Optional[Pricing]:
+        """
+        Per-token pricing for `model`, for a request with `prompt_tokens` prompt tokens.
+        """
+        entry = self.lookup(model)
+        if entry is None:
+            return None
+
+        prices: Dict[str, Any] = dict(entry)
+        tiers = prices.pop("tiers", None) or []
+        for tier in sorted(tiers, key=lambda tier: tier.get("min_prompt_tokens", 0)):
+            if prompt_tokens >= tier.get("min_prompt_tokens", 0):
+                prices.update(
+                    {k: v for k, v in tier.items() if k != "min_prompt_tokens"}
+                )
+
+        pricing: Pricing = {
+            "prompt": prices["prompt"] / 1_000_000,
+            "response": prices["response"] / 1_000_000,
+        }
+        if "cache_read" in prices:
+            pricing["cache_read"] = prices["cache_read"] / 1_000_000
+        if "cache_write" in prices:
+            pricing["cache_write"] = prices["cache_write"] / 1_000_000
+        return pricing
+
+
+registry = PricingRegistry(DEFAULT_PRICES)
+
+
+def get_pricing(model: str, prompt_tokens: int = 0) -> Optional[Pricing]:
+    return registry.pricing(model, prompt_tokens)
+
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(messages: List[Message]) -> int:
+    """
+    Rough token count of the messages, about 4 characters per token.
+    """
+    return sum(len(message["content"]) for message in messages) // CHARS_PER_TOKEN + 1
+
+
+def estimate_usage(
+    model: str, messages: List[Message], completion: str
+) -> Optional[UsageEvent]:
+    """
+    Estimated usage of a request whose usage wasn't reported, e.g. because the
+    response was interrupted. None if the model has no pricing.
+    """
+    prompt_tokens = estimate_tokens(messages)
+    completion_tokens = len(completion) // CHARS_PER_TOKEN
+    pricing = get_pricing(model, prompt_tokens)
+    if pricing is None:
+        return None
+    return UsageEvent.with_pricing(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=prompt_tokens + completion_tokens,
+        pricing=pricing,
+    )
+
+
+def load_pricing_overrides(prices: Dict[str, PriceEntry]):
+    registry.update(prices)
+
+
+def load_pricing_file(path: str):
+    with open(path, "r") as file:
+        load_pricing_overrides(yaml.safe_load(file) or {})
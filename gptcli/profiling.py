@@ -0,0 +1,155 @@
+import cProfile
+import linecache
+import pstats
+import sys
+import threading
+import tracemalloc
+from typing import Callable, Dict, List, Tuple, TypeVar
+
+F = TypeVar("F", bound=Callable)
+
+# pstats keys (filename, first line, function name) of the functions marked as hot
+# paths, mapped to a readable name
+HOT_PATHS: Dict[Tuple[str, int, str], str] = {}
+
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+TRACEMALLOC_FRAMES = 10
+
+# Before Python 3.12, a cProfile profiler only sees the thread that enabled it; since
+# then it sees all threads
+PER_THREAD_PROFILES = sys.version_info < (3, 12)
+
+
+def hot_path(fn: F) -> F:
+    """
+    Mark a function as part of the per-token hot path. It's returned unchanged, so
+    there is no runtime cost; profile reports list these functions and their callees
+    separately, which makes regressions in them easy to spot.
+    """
+    code = fn.__code__
+    HOT_PATHS[(code.co_filename, code.co_firstlineno, code.co_name)] = fn.__qualname__
+    return fn
+
+
+class SessionProfiler:
+    """
+    Runs the wrapped block under cProfile and tracemalloc. On exit writes
+    `<prefix>.pstats` (load with `python -m pstats` or snakeviz) and a
+    `<prefix>.txt` report with the top functions, the hot paths and the top
+    allocations.
+
+    The threads started in the block (stream readers, turns, tools) are profiled too,
+    and their stats are merged with the main thread's. Threads still running on exit
+    are left out, since their profile can't be stopped from another thread.
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.profiler = cProfile.Profile()
+        self.thread_profiles: List[Tuple[threading.Thread, cProfile.Profile]] = []
+        self.lock = threading.Lock()
+
+    def __enter__(self) -> "SessionProfiler":
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        if PER_THREAD_PROFILES:
+            threading.setprofile(self._profile_thread)
+        self.profiler.enable()
+        return self
+
+    def _profile_thread(self, frame, event, arg):
+        # Called on the first event of every new thread; the thread's own profiler
+        # then replaces this hook
+        profile = cProfile.Profile()
+        with self.lock:
+            self.thread_profiles.append((threading.current_thread(), profile))
+        profile.enable()
+
+    def __exit__(self, *args):
+        self.profiler.disable()
+        if PER_THREAD_PROFILES:
+            threading.setprofile(None)  # type: ignore
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        stats_path = f"{self.prefix}.pstats"
+        report_path = f"{self.prefix}.txt"
+        stats, threads, running = self._merged_stats()
+        stats.dump_stats(stats_path)
+        with open(report_path, "w") as f:
+            stats.stream = f  # type: ignore
+            if PER_THREAD_PROFILES:
+                f.write(
+                    f"Profiled the main thread and {threads} other threads "
+                    f"({running} still running on exit were left out)\n\n"
+                )
+            self._write_report(f, stats, snapshot, peak)
+
+        print(
+            f"Profile written to {stats_path} and {report_path}",
+            file=sys.stderr,
+        )
+
+    def _merged_stats(self) -> Tuple[pstats.Stats, int, int]:
+        """
+        The stats of the main thread and of the threads that finished, the number of
+        threads merged and the number left out.
+        """
+        stats = pstats.Stats(self.profiler)
+        with self.lock:
+            thread_profiles = list(self.thread_profiles)
+        running = 0
+        for thread, profile in thread_profiles:
+            if thread.is_alive():
+                running += 1
+                continue
+            stats.add(profile)  # type: ignore
+        return stats, len(thread_profiles) - running, running
+
+    def _write_report(
+        self, f, stats: pstats.Stats, snapshot: tracemalloc.Snapshot, peak: int
+    ):
+        f.write("== Top functions by cumulative time ==\n")
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+
+        f.write("== Hot paths ==\n")
+        stats.calc_callees()
+        raw_stats = stats.stats  # type: ignore
+        for key, name in HOT_PATHS.items():
+            if key not in raw_stats:
+                f.write(f"{name}: not called\n\n")
+                continue
+            _, ncalls, tottime, cumtime, _ = raw_stats[key]
+            f.write(
+                f"{name}: {ncalls} calls, {tottime:.4f}s own, {cumtime:.4f}s cumulative, "
+                f"{cumtime / ncalls * 1e6:.2f}us per call\n"
+            )
+            callees = stats.all_callees.get(key, {})  # type: ignore
+            for callee, callee_stats in sorted(
+                callees.items(), key=lambda item: item[1][3], reverse=True
+            )[:10]:
+                filename, lineno, funcname = callee
+                f.write(
+                    f"    {callee_stats[3]:.4f}s  {callee_stats[1]:>8} calls  "
+                    f"{funcname} ({filename}:{lineno})\n"
+                )
+            f.write("\n")
+
+        f.write(f"== Top allocations (peak traced memory: {peak / 1024:.1f} KiB) ==\n")
+        snapshot = snapshot.filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            ]
+        )
+        for stat in snapshot.statistics("traceback")[:TOP_ALLOCATIONS]:
+            frame = stat.traceback[0]
+            f.write(
+                f"{stat.size / 1024:.1f} KiB in {stat.count} blocks: "
+                f"{frame.filename}:{frame.lineno}\n"
+            )
+            line = linecache.getline(frame.filename, frame.lineno).strip()
+            if line:
+                f.write(f"    {line}\n")
@@ -1,18 +1,28 @@
+import json
 import os
+import threading
 from typing import Iterator, List, Optional
 import anthropic
 
 from gptcli.completion import (
+    CancellationToken,
     CompletionEvent,
     CompletionProvider,
     Message,
     CompletionError,
     BadRequestError,
     MessageDeltaEvent,
+    http_timeout,
+    timeout_error,
     Pricing,
     UsageEvent,
     ThinkingDeltaEvent,
+    ToolDefinition,
+    ToolRequestEvent,
+    abort_on_cancel,
 )
+from gptcli.pricing import get_pricing
+from gptcli.tracing import httpx_event_hooks
 
 api_key = os.environ.get("ANTHROPIC_API_KEY")
 
@@ -21,12 +31,108 @@ def get_client():
     if not api_key:
         raise ValueError("ANTHROPIC_API_KEY environment variable not set")
 
-    return anthropic.Anthropic(api_key=api_key)
+    event_hooks = httpx_event_hooks()
+    return anthropic.Anthropic(
+        api_key=api_key,
+        http_client=(
+            anthropic.DefaultHttpxClient(event_hooks=event_hooks)
+            if event_hooks
+            else None
+        ),
+    )
+
+
+def map_messages(messages: List[Message]) -> List[dict]:
+    """
+    Tool calls are content blocks of the assistant message, and the outputs of
+    consecutive tool calls are the content blocks of a single user message.
+    """
+    mapped: List[dict] = []
+    tool_results: Optional[List[dict]] = None
+    for message in messages:
+        if message["role"] == "tool":
+            if tool_results is None:
+                tool_results = []
+                mapped.append({"role": "user", "content": tool_results})
+            tool_results.append(
+                {
+                    "type": "tool_result",
+                    "tool_use_id": message["tool_call_id"],
+                    "content": message["content"],
+                }
+            )
+            continue
+
+        tool_results = None
+        if message.get("tool_calls"):
+            content: List[dict] = []
+            if message["content"]:
+                content.append({"type": "text", "text": message["content"]})
+            for call in message["tool_calls"]:
+                content.append(
+                    {
+                        "type": "tool_use",
+                        "id": call["id"],
+                        "name": call["name"],
+                        "input": call["arguments"],
+                    }
+                )
+            mapped.append({"role": "assistant", "content": content})
+        else:
+            mapped.append({"role": message["role"], "content": message["content"]})
+    return mapped
+
+
+def map_tool(tool: ToolDefinition) -> dict:
+    return {
+        "name": tool["name"],
+        "description": tool["description"],
+        "input_schema": tool["parameters"],
+    }
+
+
+# Claude has no JSON mode: it's forced to call this tool with the response as input
+JSON_RESPONSE_TOOL = "json_response"
+JSON_INSTRUCTION = "Respond only with JSON that follows this JSON schema:\n{schema}"
+
+
+def json_response_tool(json_schema: dict) -> dict:
+    return {
+        "name": JSON_RESPONSE_TOOL,
+        "description": "Respond to the user with JSON.",
+        "input_schema": json_schema,
+    }
+
+
+def tool_requests(content) -> Iterator[ToolRequestEvent]:
+    for block in content:
+        if block.type == "tool_use" and block.name != JSON_RESPONSE_TOOL:
+            yield ToolRequestEvent(
+                {"id": block.id, "name": block.name, "arguments": block.input}
+            )
 
 
 class AnthropicCompletionProvider(CompletionProvider):
+    def __init__(self):
+        # Created on first use, so that a missing API key only fails the request
+        self.client: Optional[anthropic.Anthropic] = None
+        self.client_lock = threading.Lock()
+
+    def _client(self) -> anthropic.Anthropic:
+        with self.client_lock:
+            if self.client is None:
+                self.client = get_client()
+            return self.client
+
+    def prewarm(self, timeout: float):
+        self._client().with_options(timeout=timeout, max_retries=0).models.list(limit=1)
+
     def complete(
-        self, messages: List[Message], args: dict, stream: bool = False
+        self,
+        messages: List[Message],
+        args: dict,
+        stream: bool = False,
+        cancel: Optional[CancellationToken] = None,
     ) -> Iterator[CompletionEvent]:
         # Default max tokens and max allowed by Claude API
         DEFAULT_MAX_TOKENS = 4096
@@ -77,102 +183,107 @@ class AnthropicCompletionProvider(CompletionProvider):
             kwargs["system"] = messages[0]["content"]
             messages = messages[1:]
 
-        kwargs["messages"] = messages
+        kwargs["messages"] = map_messages(messages)
+        tools = [map_tool(tool) for tool in args.get("tools", [])]
+        json_schema = args.get("json_schema")
+        json_tool = (
+            json_schema is not None and json_schema.get("type", "object") == "object"
+        )
+        if json_schema is not None:
+            if json_tool:
+                tools.append(json_response_tool(json_schema or {"type": "object"}))
+                kwargs["tool_choice"] = {"type": "tool", "name": JSON_RESPONSE_TOOL}
+            else:
+                # Tool inputs can only be objects
+                instruction = JSON_INSTRUCTION.format(schema=json.dumps(json_schema))
+                system = kwargs.get("system")
+                kwargs["system"] = (
+                    f"{system}\n\n{instruction}" if system else instruction
+                )
+        if tools:
+            kwargs["tools"] = tools
+        if timeout := http_timeout(args, anthropic.DEFAULT_TIMEOUT):
+            kwargs["timeout"] = timeout
 
-        client = get_client()
-        input_tokens = None
+        client = self._client()
+        input_usage: Optional[anthropic.types.Usage] = None
         try:
             if stream:
-                with client.messages.stream(**kwargs) as completion:
+                with (
+                    client.messages.stream(**kwargs) as completion,
+                    abort_on_cancel(cancel, completion.close),
+                ):
                     for event in completion:
                         if event.type == "content_block_delta":
                             if event.delta.type == "thinking_delta":
                                 yield ThinkingDeltaEvent(event.delta.thinking)
                             elif event.delta.type == "text_delta":
                                 yield MessageDeltaEvent(event.delta.text)
+                            elif event.delta.type == "input_json_delta" and json_tool:
+                                # The input of the JSON response tool
+                                yield MessageDeltaEvent(event.delta.partial_json)
                             # Skip other delta types
                         if event.type == "message_start":
-                            input_tokens = event.message.usage.input_tokens
+                            input_usage = event.message.usage
                         if (
                             event.type == "message_delta"
-                            and (pricing := claude_pricing(args["model"]))
-                            and input_tokens
+                            and (pricing := get_pricing(args["model"]))
+                            and input_usage
                         ):
-                            yield UsageEvent.with_pricing(
-                                prompt_tokens=input_tokens,
-                                completion_tokens=event.usage.output_tokens,
-                                total_tokens=input_tokens + event.usage.output_tokens,
-                                pricing=pricing,
+                            yield usage_event(
+                                input_usage, event.usage.output_tokens, pricing
                             )
 
+                    yield from tool_requests(completion.get_final_message().content)
+
             else:
                 response = client.messages.create(**kwargs, stream=False)
                 yield MessageDeltaEvent(
                     "".join(
-                        c.text if c.type == "text" else "" for c in response.content
+                        (
+                            json.dumps(c.input)
+                            if c.type == "tool_use" and c.name == JSON_RESPONSE_TOOL
+                            else c.text if c.type == "text" else ""
+                        )
+                        for c in response.content
                     )
                 )
-                if pricing := claude_pricing(args["model"]):
-                    yield UsageEvent.with_pricing(
-                        prompt_tokens=response.usage.input_tokens,
-                        completion_tokens=response.usage.output_tokens,
-                        total_tokens=response.usage.input_tokens
-                        + response.usage.output_tokens,
-                        pricing=pricing,
+                yield from tool_requests(response.content)
+                if pricing := get_pricing(args["model"]):
+                    yield usage_event(
+                        response.usage, response.usage.output_tokens, pricing
                     )
         except anthropic.BadRequestError as e:
             raise BadRequestError(e.message) from e
+        except anthropic.APITimeoutError as e:
+            raise timeout_error(e) from e
         except anthropic.APIError as e:
             raise CompletionError(e.message) from e
 
+    def continuation_messages(
+        self, messages: List[Message], partial: str, args: dict
+    ) -> List[Message]:
+        if args.get("thinking_budget"):
+            # Prefilling isn't supported with extended thinking
+            return super().continuation_messages(messages, partial, args)
 
-CLAUDE_PRICE_PER_TOKEN: Pricing = {
-    "prompt": 11.02 / 1_000_000,
-    "response": 32.68 / 1_000_000,
-}
-
-CLAUDE_INSTANT_PRICE_PER_TOKEN: Pricing = {
-    "prompt": 1.63 / 1_000_000,
-    "response": 5.51 / 1_000_000,
-}
-
-CLAUDE_3_OPUS_PRICING: Pricing = {
-    "prompt": 15.0 / 1_000_000,
-    "response": 75.0 / 1_000_000,
-}
-
-CLAUDE_3_SONNET_PRICING: Pricing = {
-    "prompt": 3.0 / 1_000_000,
-    "response": 15.0 / 1_000_000,
-}
-
-CLAUDE_3_7_SONNET_PRICING: Pricing = {
-    "prompt": 3.0 / 1_000_000,
-    "response": 15.0 / 1_000_000,
-}
-
-CLAUDE_3_HAIKU_PRICING: Pricing = {
-    "prompt": 0.25 / 1_000_000,
-    "response": 1.25 / 1_000_000,
-}
-
-
-def claude_pricing(model: str) -> Optional[Pricing]:
-    if "instant" in model:
-        pricing = CLAUDE_INSTANT_PRICE_PER_TOKEN
-    elif "claude-3" in model:
-        if "opus" in model:
-            pricing = CLAUDE_3_OPUS_PRICING
-        elif "3-7-sonnet" in model:
-            pricing = CLAUDE_3_7_SONNET_PRICING
-        elif "sonnet" in model:
-            pricing = CLAUDE_3_SONNET_PRICING
-        elif "haiku" in model:
-            pricing = CLAUDE_3_HAIKU_PRICING
-        else:
-            return None
-    elif "claude-2" in model:
-        pricing = CLAUDE_PRICE_PER_TOKEN
-    else:
-        return None
-    return pricing
+        # Claude continues a trailing assistant message, which can't end with
+        # whitespace
+        return messages + [{"role": "assistant", "content": partial.rstrip()}]
+
+
+def usage_event(
+    usage: anthropic.types.Usage, output_tokens: int, pricing: Pricing
+) -> UsageEvent:
+    # input_tokens excludes the tokens read from and written to the prompt cache
+    cache_read_tokens = usage.cache_read_input_tokens or 0
+    cache_write_tokens = usage.cache_creation_input_tokens or 0
+    prompt_tokens = usage.input_tokens + cache_read_tokens + cache_write_tokens
+    return UsageEvent.with_pricing(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=output_tokens,
+        total_tokens=prompt_tokens + output_tokens,
+        pricing=pricing,
+        cache_read_tokens=cache_read_tokens,
+        cache_write_tokens=cache_write_tokens,
+    )
@@ -1,6 +1,6 @@
 import openai
 from openai import AzureOpenAI
-from gptcli.providers.openai import OpenAICompletionProvider
+from gptcli.providers.openai import OpenAICompletionProvider, http_client
 
 
 class AzureOpenAICompletionProvider(OpenAICompletionProvider):
@@ -10,4 +10,5 @@ class AzureOpenAICompletionProvider(OpenAICompletionProvider):
             api_key=openai.api_key,
             base_url=openai.base_url,
             api_version=openai.api_version,
+            http_client=http_client(),
         )
@@ -1,44 +1,142 @@
+import contextlib
+import math
 import os
+import uuid
 import cohere
-from typing import Iterator, List
+import httpx
+from typing import Dict, Iterator, List, Optional, Sequence
 
 from gptcli.completion import (
+    CancellationToken,
     CompletionEvent,
     CompletionProvider,
     Message,
     CompletionError,
     BadRequestError,
     MessageDeltaEvent,
-    Pricing,
+    ToolCall,
+    ToolDefinition,
+    ToolRequestEvent,
     UsageEvent,
+    is_cancelled,
+    timeout_error,
+    track_requests,
+    tracked_requests,
 )
+from gptcli.pricing import get_pricing
+from gptcli.tracing import httpx_event_hooks
 
 api_key = os.environ.get("COHERE_API_KEY")
 
-ROLE_MAP = {
-    "system": "SYSTEM",
-    "user": "USER",
-    "assistant": "CHATBOT",
+# Cohere's parameter types for JSON schema types
+PARAMETER_TYPES = {
+    "string": "str",
+    "integer": "int",
+    "number": "float",
+    "boolean": "bool",
+    "array": "list",
+    "object": "dict",
 }
 
 
-def map_message(message: Message) -> cohere.Message:
-    if message["role"] == "system":
-        return cohere.Message_System(message=message["content"])
-    elif message["role"] == "user":
-        return cohere.Message_User(message=message["content"])
-    elif message["role"] == "assistant":
-        return cohere.Message_Chatbot(message=message["content"])
-    else:
-        raise ValueError(f"Unknown message role: {message['role']}")
+def map_messages(messages: List[Message]) -> List[cohere.Message]:
+    """
+    The outputs of tool calls are matched with the calls by id, since Cohere
+    identifies a call by its name and parameters.
+    """
+    calls: Dict[str, ToolCall] = {}
+    mapped: List[cohere.Message] = []
+    tool_message: Optional[cohere.ToolMessage] = None
+    for message in messages:
+        if message["role"] == "tool":
+            call = calls[message["tool_call_id"]]
+            result = cohere.ToolResult(
+                call=cohere.ToolCall(name=call["name"], parameters=call["arguments"]),
+                outputs=[{"output": message["content"]}],
+            )
+            if tool_message is None:
+                tool_message = cohere.ToolMessage(tool_results=[])
+                mapped.append(tool_message)
+            assert tool_message.tool_results is not None
+            tool_message.tool_results.append(result)
+            continue
+
+        tool_message = None
+        if message["role"] == "system":
+            mapped.append(cohere.SystemMessage(message=message["content"]))
+        elif message["role"] == "user":
+            mapped.append(cohere.UserMessage(message=message["content"]))
+        elif message["role"] == "assistant":
+            tool_calls = message.get("tool_calls", [])
+            calls.update((call["id"], call) for call in tool_calls)
+            mapped.append(
+                cohere.ChatbotMessage(
+                    message=message["content"],
+                    tool_calls=[
+                        cohere.ToolCall(name=call["name"], parameters=call["arguments"])
+                        for call in tool_calls
+                    ]
+                    or None,
+                )
+            )
+        else:
+            raise ValueError(f"Unknown message role: {message['role']}")
+    return mapped
+
+
+def map_tool(tool: ToolDefinition) -> cohere.Tool:
+    properties = tool["parameters"].get("properties", {})
+    required = tool["parameters"].get("required", [])
+    return cohere.Tool(
+        name=tool["name"],
+        description=tool["description"],
+        parameter_definitions={
+            name: cohere.ToolParameterDefinitionsValue(
+                description=schema.get("description"),
+                type=PARAMETER_TYPES.get(schema.get("type", "string"), "str"),
+                required=name in required,
+            )
+            for name, schema in properties.items()
+        },
+    )
+
+
+def tool_requests(
+    tool_calls: Optional[Sequence[cohere.ToolCall]],
+) -> Iterator[ToolRequestEvent]:
+    for call in tool_calls or []:
+        # Cohere's calls have no id
+        yield ToolRequestEvent(
+            {"id": uuid.uuid4().hex, "name": call.name, "arguments": call.parameters}
+        )
 
 
 class CohereCompletionProvider(CompletionProvider):
     def __init__(self):
-        self.client = cohere.Client(api_key=api_key)
+        # Cohere's default client. The SDK only takes a single timeout for the whole
+        # request and doesn't expose the response of a stream to abort it with
+        self.http_client = track_requests(
+            httpx.Client(
+                timeout=300, follow_redirects=True, event_hooks=httpx_event_hooks()
+            )
+        )
+        self.client = cohere.Client(api_key=api_key, httpx_client=self.http_client)
+
+    def prewarm(self, timeout: float):
+        self.client.models.list(
+            page_size=1,
+            request_options={
+                "timeout_in_seconds": math.ceil(timeout),
+                "max_retries": 0,
+            },
+        )
 
     def complete(
-        self, messages: List[Message], args: dict, stream: bool = False
+        self,
+        messages: List[Message],
+        args: dict,
+        stream: bool = False,
+        cancel: Optional[CancellationToken] = None,
     ) -> Iterator[CompletionEvent]:
         kwargs = {}
         if "temperature" in args:
@@ -52,58 +150,82 @@ class CohereCompletionProvider(CompletionProvider):
             kwargs["preamble"] = messages[0]["content"]
             messages = messages[1:]
 
-        message = messages[-1]
-        assert message["role"] == "user", "Last message must be user message"
-
-        chat_history = [map_message(m) for m in messages[:-1]]
+        if args.get("tools"):
+            kwargs["tools"] = [map_tool(tool) for tool in args["tools"]]
+        if "json_schema" in args:
+            kwargs["response_format"] = cohere.JsonObjectResponseFormat(
+                schema_=args["json_schema"] or None
+            )
+
+        chat_history = map_messages(messages)
+        message = ""
+        last_message = chat_history.pop()
+        if isinstance(last_message, cohere.ToolMessage):
+            # The outputs of the calls of the last message are sent without a message
+            kwargs["tool_results"] = last_message.tool_results
+        else:
+            assert isinstance(
+                last_message, cohere.UserMessage
+            ), "Last message must be user message"
+            message = last_message.message
 
         try:
             if stream:
                 response_iter = self.client.chat_stream(
                     chat_history=chat_history,
-                    message=message["content"],
+                    message=message,
                     model=model,
                     **kwargs,
                 )
 
-                for response in response_iter:
-                    if response.event_type == "text-generation":
-                        yield MessageDeltaEvent(response.text)
-
-                    if (
-                        response.event_type == "stream-end"
-                        and response.response.meta
-                        and response.response.meta.tokens
-                        and (pricing := COHERE_PRICING.get(args["model"]))
-                    ):
-                        input_tokens = int(
-                            response.response.meta.tokens.input_tokens or 0
-                        )
-                        output_tokens = int(
-                            response.response.meta.tokens.output_tokens or 0
-                        )
-                        total_tokens = input_tokens + output_tokens
-
-                        yield UsageEvent.with_pricing(
-                            prompt_tokens=input_tokens,
-                            completion_tokens=output_tokens,
-                            total_tokens=total_tokens,
-                            pricing=pricing,
-                        )
+                with (
+                    contextlib.closing(response_iter),
+                    tracked_requests(cancel, args),
+                ):
+                    for response in response_iter:
+                        if is_cancelled(cancel):
+                            break
+                        if response.event_type == "text-generation":
+                            yield MessageDeltaEvent(response.text)
+                        elif response.event_type == "tool-calls-generation":
+                            yield from tool_requests(response.tool_calls)
+
+                        if (
+                            response.event_type == "stream-end"
+                            and response.response.meta
+                            and response.response.meta.tokens
+                            and (pricing := get_pricing(args["model"]))
+                        ):
+                            input_tokens = int(
+                                response.response.meta.tokens.input_tokens or 0
+                            )
+                            output_tokens = int(
+                                response.response.meta.tokens.output_tokens or 0
+                            )
+                            total_tokens = input_tokens + output_tokens
+
+                            yield UsageEvent.with_pricing(
+                                prompt_tokens=input_tokens,
+                                completion_tokens=output_tokens,
+                                total_tokens=total_tokens,
+                                pricing=pricing,
+                            )
 
             else:
-                response = self.client.chat(
-                    chat_history=chat_history,
-                    message=message["content"],
-                    model=model,
-                    **kwargs,
-                )
+                with tracked_requests(cancel, args):
+                    response = self.client.chat(
+                        chat_history=chat_history,
+                        message=message,
+                        model=model,
+                        **kwargs,
+                    )
                 yield MessageDeltaEvent(response.text)
+                yield from tool_requests(response.tool_calls)
 
                 if (
                     response.meta
                     and response.meta.tokens
-                    and (pricing := COHERE_PRICING.get(args["model"]))
+                    and (pricing := get_pricing(args["model"]))
                 ):
                     input_tokens = int(response.meta.tokens.input_tokens or 0)
                     output_tokens = int(response.meta.tokens.output_tokens or 0)
@@ -118,21 +240,11 @@ class CohereCompletionProvider(CompletionProvider):
 
         except cohere.BadRequestError as e:
             raise BadRequestError(e.body) from e
+        except httpx.TimeoutException as e:
+            raise timeout_error(e) from e
         except (
             cohere.TooManyRequestsError,
             cohere.InternalServerError,
             cohere.core.api_error.ApiError,  # type: ignore
         ) as e:
             raise CompletionError(e.body) from e
-
-
-COHERE_PRICING: dict[str, Pricing] = {
-    "command-r": {
-        "prompt": 0.5 / 1_000_000,
-        "response": 1.5 / 1_000_000,
-    },
-    "command-r-plus": {
-        "prompt": 3.0 / 1_000_000,
-        "response": 15.0 / 1_000_000,
-    },
-}
@@ -1,17 +1,26 @@
+import contextlib
 import os
+import threading
+import uuid
 from google import genai
 from google.genai import types
 
 from typing import Iterator, List, Optional
 
 from gptcli.completion import (
+    CancellationToken,
     CompletionEvent,
     CompletionProvider,
     Message,
     MessageDeltaEvent,
-    Pricing,
+    ToolDefinition,
+    ToolRequestEvent,
     UsageEvent,
+    is_cancelled,
+    track_requests,
+    tracked_requests,
 )
+from gptcli.pricing import get_pricing
 
 ROLE_MAP = {
     "user": "user",
@@ -22,24 +31,118 @@ ROLE_MAP = {
 api_key = os.environ.get("GEMINI_API_KEY")
 
 
+def map_contents(messages: List[Message]) -> List[types.Content]:
+    """
+    Tool calls are parts of the model's message, and the outputs of consecutive
+    tool calls are the parts of a single user message.
+    """
+    contents: List[types.Content] = []
+    tool_results: Optional[types.Content] = None
+    for message in messages:
+        if message["role"] == "tool":
+            if tool_results is None:
+                tool_results = types.Content(role="user", parts=[])
+                contents.append(tool_results)
+            assert tool_results.parts is not None
+            tool_results.parts.append(
+                types.Part.from_function_response(
+                    name=message["name"], response={"output": message["content"]}
+                )
+            )
+            continue
+
+        tool_results = None
+        parts = []
+        if message["content"] or not message.get("tool_calls"):
+            parts.append(types.Part.from_text(text=message["content"]))
+        for call in message.get("tool_calls", []):
+            parts.append(
+                types.Part(
+                    function_call=types.FunctionCall(
+                        id=call["id"], name=call["name"], args=call["arguments"]
+                    )
+                )
+            )
+        contents.append(types.Content(role=ROLE_MAP[message["role"]], parts=parts))
+    return contents
+
+
+def map_tools(tools: List[ToolDefinition]) -> List[types.Tool]:
+    declarations = []
+    for tool in tools:
+        declaration = types.FunctionDeclaration(
+            name=tool["name"], description=tool["description"]
+        )
+        # Gemini rejects objects without properties
+        if tool["parameters"].get("properties"):
+            declaration.parameters = types.Schema.model_validate(tool["parameters"])
+        declarations.append(declaration)
+    return [types.Tool(function_declarations=declarations)]
+
+
+def response_schema(json_schema: dict) -> Optional[types.Schema]:
+    if not json_schema:
+        return None
+    try:
+        return types.Schema.model_validate(json_schema)
+    except ValueError:
+        # Gemini only supports a subset of JSON schema. The response is still JSON
+        return None
+
+
+def tool_requests(
+    function_calls: Optional[List[types.FunctionCall]],
+) -> Iterator[ToolRequestEvent]:
+    for call in function_calls or []:
+        yield ToolRequestEvent(
+            {
+                # Gemini doesn't always identify the calls
+                "id": call.id or uuid.uuid4().hex,
+                "name": call.name or "",
+                "arguments": call.args or {},
+            }
+        )
+
+
 class GoogleCompletionProvider(CompletionProvider):
+    def __init__(self):
+        # Shared by all requests, so that they reuse its connections
+        self.client: Optional[genai.Client] = None
+        self.client_lock = threading.Lock()
+
+    def _client(self) -> genai.Client:
+        with self.client_lock:
+            if self.client is None:
+                self.client = genai.Client(api_key=api_key)
+                # The SDK only takes a single timeout, which is also sent to the
+                # server as the deadline of the whole request, and doesn't expose
+                # the response of a stream to abort it with
+                track_requests(self.client._api_client._httpx_client)
+            return self.client
+
+    def prewarm(self, timeout: float):
+        self._client().models.list(
+            config=types.ListModelsConfig(
+                page_size=1,
+                http_options=types.HttpOptions(timeout=int(timeout * 1000)),
+            )
+        )
+
     def complete(
-        self, messages: List[Message], args: dict, stream: bool = False
+        self,
+        messages: List[Message],
+        args: dict,
+        stream: bool = False,
+        cancel: Optional[CancellationToken] = None,
     ) -> Iterator[CompletionEvent]:
-        client = genai.Client(api_key=api_key)
+        client = self._client()
         model = args["model"]
         system_instruction = None
         if messages[0]["role"] == "system":
             system_instruction = messages[0]["content"]
             messages = messages[1:]
 
-        contents = [
-            types.Content(
-                role=ROLE_MAP[m["role"]],
-                parts=[types.Part.from_text(text=m["content"])],
-            )
-            for m in messages
-        ]
+        contents = map_contents(messages)
 
         generate_content_config = types.GenerateContentConfig(
             system_instruction=system_instruction,
@@ -54,7 +157,13 @@ class GoogleCompletionProvider(CompletionProvider):
                 else None
             ),
             response_mime_type="text/plain",
+            tools=map_tools(args["tools"]) if args.get("tools") else None,
         )
+        if "json_schema" in args:
+            generate_content_config.response_mime_type = "application/json"
+            generate_content_config.response_schema = response_schema(
+                args["json_schema"]
+            )
 
         if stream:
             response = client.models.generate_content_stream(
@@ -63,20 +172,31 @@ class GoogleCompletionProvider(CompletionProvider):
                 config=generate_content_config,
             )
 
-            for chunk in response:
-                if chunk.usage_metadata:
-                    prompt_tokens = chunk.usage_metadata.prompt_token_count or 0
-                    completion_tokens = chunk.usage_metadata.candidates_token_count or 0
-                    total_tokens = prompt_tokens + completion_tokens
-                yield MessageDeltaEvent(chunk.text or "")
+            with contextlib.closing(response), tracked_requests(cancel, args):
+                for chunk in response:
+                    if is_cancelled(cancel):
+                        break
+                    if chunk.usage_metadata:
+                        prompt_tokens = chunk.usage_metadata.prompt_token_count or 0
+                        completion_tokens = (
+                            chunk.usage_metadata.candidates_token_count or 0
+                        )
+                        total_tokens = prompt_tokens + completion_tokens
+                    yield MessageDeltaEvent(chunk.text or "")
+                    yield from tool_requests(chunk.function_calls)
+
+            if is_cancelled(cancel):
+                return
 
         else:
-            response = client.models.generate_content(
-                model=model,
-                contents=list(contents),
-                config=generate_content_config,
-            )
+            with tracked_requests(cancel, args):
+                response = client.models.generate_content(
+                    model=model,
+                    contents=list(contents),
+                    config=generate_content_config,
+                )
             yield MessageDeltaEvent(response.text or "")
+            yield from tool_requests(response.function_calls)
 
             prompt_tokens = 0
             completion_tokens = 0
@@ -86,7 +206,7 @@ class GoogleCompletionProvider(CompletionProvider):
                 completion_tokens = response.usage_metadata.candidates_token_count or 0
                 total_tokens = prompt_tokens + completion_tokens
 
-        pricing = get_gemini_pricing(model, prompt_tokens)
+        pricing = get_pricing(model, prompt_tokens)
         if pricing:
             yield UsageEvent.with_pricing(
                 prompt_tokens=prompt_tokens,
@@ -94,43 +214,3 @@ class GoogleCompletionProvider(CompletionProvider):
                 total_tokens=total_tokens,
                 pricing=pricing,
             )
-
-
-def get_gemini_pricing(model: str, prompt_tokens: int) -> Optional[Pricing]:
-    if model.startswith("gemini-1.5-flash-8b"):
-        return {
-            "prompt": (0.0375 if prompt_tokens < 128000 else 0.075) / 1_000_000,
-            "response": (0.15 if prompt_tokens < 128000 else 0.30) / 1_000_000,
-        }
-    if model.startswith("gemini-1.5-flash"):
-        return {
-            "prompt": (0.075 if prompt_tokens < 128000 else 0.15) / 1_000_000,
-            "response": (0.30 if prompt_tokens < 128000 else 0.60) / 1_000_000,
-        }
-    elif model.startswith("gemini-1.5-pro"):
-        return {
-            "prompt": (1.25 if prompt_tokens < 128000 else 2.50) / 1_000_000,
-            "response": (5.0 if prompt_tokens < 128000 else 10.0) / 1_000_000,
-        }
-    elif model.startswith("gemini-2.0-flash-lite"):
-        return {
-            "prompt": 0.075 / 1_000_000,
-            "response": 0.30 / 1_000_000,
-        }
-    elif model.startswith("gemini-2.0-flash"):
-        return {
-            "prompt": 0.10 / 1_000_000,
-            "response": 0.40 / 1_000_000,
-        }
-    elif model.startswith("gemini-2.5-pro"):
-        return {
-            "prompt": (1.25 if prompt_tokens < 200000 else 2.50) / 1_000_000,
-            "response": (10.0 if prompt_tokens < 200000 else 15.0) / 1_000_000,
-        }
-    elif model.startswith("gemini-pro"):
-        return {
-            "prompt": 0.50 / 1_000_000,
-            "response": 1.50 / 1_000_000,
-        }
-    else:
-        return None
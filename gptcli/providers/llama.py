@@ -10,10 +10,12 @@ except ImportError:
     LLAMA_AVAILABLE = False
 
 from gptcli.completion import (
+    CancellationToken,
     CompletionEvent,
     CompletionProvider,
     Message,
     MessageDeltaEvent,
+    is_cancelled,
 )
 
 
@@ -68,7 +70,11 @@ def make_prompt(messages: List[Message], model_config: LLaMAModelConfig) -> str:
 
 class LLaMACompletionProvider(CompletionProvider):
     def complete(
-        self, messages: List[Message], args: dict, stream: bool = False
+        self,
+        messages: List[Message],
+        args: dict,
+        stream: bool = False,
+        cancel: Optional[CancellationToken] = None,
     ) -> Iterator[CompletionEvent]:
         assert LLAMA_MODELS, "LLaMA models not initialized"
 
@@ -100,6 +106,8 @@ class LLaMACompletionProvider(CompletionProvider):
         )
         if stream:
             for x in cast(Iterator[CompletionChunk], gen):
+                if is_cancelled(cancel):
+                    break
                 yield MessageDeltaEvent(x["choices"][0]["text"])
         else:
             yield MessageDeltaEvent(cast(Completion, gen)["choices"][0]["text"])
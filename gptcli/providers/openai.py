@@ -1,21 +1,97 @@
-import re
+import json
 from typing import Iterator, List, Optional, cast
 import openai
 from openai import OpenAI
-from openai.types.responses import ResponseInputParam
+from openai.types.responses import ResponseInputParam, ResponseUsage
 
 from gptcli.completion import (
+    CancellationToken,
     CompletionEvent,
     CompletionProvider,
     Message,
     CompletionError,
     BadRequestError,
     MessageDeltaEvent,
+    http_timeout,
+    timeout_error,
     Pricing,
     ThinkingDeltaEvent,
     ToolCallEvent,
+    ToolDefinition,
+    ToolRequestEvent,
     UsageEvent,
+    abort_on_cancel,
 )
+from gptcli.pricing import get_pricing
+from gptcli.tracing import httpx_event_hooks
+
+
+def http_client() -> Optional[openai.DefaultHttpxClient]:
+    event_hooks = httpx_event_hooks()
+    if event_hooks is None:
+        return None
+    return openai.DefaultHttpxClient(event_hooks=event_hooks)
+
+
+def map_messages(messages: List[Message]) -> ResponseInputParam:
+    """
+    Messages as input items of the Responses API. Tool calls and their outputs are
+    items of their own.
+    """
+    items: list = []
+    for message in messages:
+        if message["role"] == "tool":
+            items.append(
+                {
+                    "type": "function_call_output",
+                    "call_id": message["tool_call_id"],
+                    "output": message["content"],
+                }
+            )
+            continue
+        if message["content"] or not message.get("tool_calls"):
+            items.append({"role": message["role"], "content": message["content"]})
+        for call in message.get("tool_calls", []):
+            items.append(
+                {
+                    "type": "function_call",
+                    "call_id": call["id"],
+                    "name": call["name"],
+                    "arguments": json.dumps(call["arguments"]),
+                }
+            )
+    return cast(ResponseInputParam, items)
+
+
+def map_tool(tool: ToolDefinition) -> dict:
+    return {
+        "type": "function",
+        "name": tool["name"],
+        "description": tool["description"],
+        "parameters": tool["parameters"],
+        "strict": False,
+    }
+
+
+def tool_request(item) -> ToolRequestEvent:
+    return ToolRequestEvent(
+        {
+            "id": item.call_id,
+            "name": item.name,
+            "arguments": json.loads(item.arguments or "{}"),
+        }
+    )
+
+
+def response_format(json_schema: dict) -> dict:
+    # Not the `json_object` format for an empty schema: it's rejected unless the
+    # messages mention JSON
+    return {
+        "type": "json_schema",
+        "name": "response",
+        "schema": json_schema or {"type": "object"},
+        "strict": False,
+    }
 
 
 def is_reasoning_model(model: str) -> bool:
@@ -25,11 +101,20 @@ def is_reasoning_model(model: str) -> bool:
 class OpenAICompletionProvider(CompletionProvider):
     def __init__(self, base_url: Optional[str] = None, api_key: Optional[str] = None):
         self.client = OpenAI(
-            api_key=api_key or openai.api_key, base_url=base_url or openai.base_url
+            api_key=api_key or openai.api_key,
+            base_url=base_url or openai.base_url,
+            http_client=http_client(),
         )
 
+    def prewarm(self, timeout: float):
+        self.client.with_options(timeout=timeout, max_retries=0).models.list()
+
     def complete(
-        self, messages: List[Message], args: dict, stream: bool = False
+        self,
+        messages: List[Message],
+        args: dict,
+        stream: bool = False,
+        cancel: Optional[CancellationToken] = None,
     ) -> Iterator[CompletionEvent]:
         model = args["model"]
         if model.startswith("oai-compat:"):
@@ -44,202 +129,82 @@ class OpenAICompletionProvider(CompletionProvider):
             kwargs["temperature"] = args["temperature"]
         if "top_p" in args and not is_reasoning:
             kwargs["top_p"] = args["top_p"]
+        tools = [map_tool(tool) for tool in args.get("tools", [])]
         if is_reasoning:
             kwargs["reasoning"] = {"effort": "high", "summary": "auto"}
-            kwargs["tools"] = [
+            tools.append(
                 {"type": "web_search_preview"}
-            ]  # provide reasoning models with search capabilities
+            )  # provide reasoning models with search capabilities
+        if tools:
+            kwargs["tools"] = tools
+        if "json_schema" in args:
+            kwargs["text"] = {"format": response_format(args["json_schema"])}
+        if timeout := http_timeout(args, openai.DEFAULT_TIMEOUT):
+            kwargs["timeout"] = timeout
 
         try:
             if stream:
                 response_iter = self.client.responses.create(
                     model=model,
-                    input=cast(ResponseInputParam, messages),
+                    input=map_messages(messages),
                     stream=True,
                     store=False,
                     **kwargs,
                 )
 
-                for response in response_iter:
-                    if response.type == "response.output_text.delta":
-                        yield MessageDeltaEvent(response.delta)
-                    elif response.type == "response.reasoning_summary_text.delta":
-                        yield ThinkingDeltaEvent(response.delta)
-                    elif response.type == "response.reasoning_summary_part.done":
-                        yield ThinkingDeltaEvent("\n\n")
-                    elif response.type == "response.web_search_call.in_progress":
-                        yield ToolCallEvent("Searching the web...")
-                    elif response.type == "response.completed" and (
-                        pricing := gpt_pricing(args["model"])
-                    ):
-                        if response.response.usage:
-                            yield UsageEvent.with_pricing(
-                                prompt_tokens=response.response.usage.input_tokens,
-                                completion_tokens=response.response.usage.output_tokens,
-                                total_tokens=response.response.usage.input_tokens
-                                + response.response.usage.output_tokens,
-                                pricing=pricing,
-                            )
+                with response_iter, abort_on_cancel(cancel, response_iter.close):
+                    for response in response_iter:
+                        if response.type == "response.output_text.delta":
+                            yield MessageDeltaEvent(response.delta)
+                        elif response.type == "response.reasoning_summary_text.delta":
+                            yield ThinkingDeltaEvent(response.delta)
+                        elif response.type == "response.reasoning_summary_part.done":
+                            yield ThinkingDeltaEvent("\n\n")
+                        elif response.type == "response.web_search_call.in_progress":
+                            yield ToolCallEvent("Searching the web...")
+                        elif (
+                            response.type == "response.output_item.done"
+                            and response.item.type == "function_call"
+                        ):
+                            yield tool_request(response.item)
+                        elif response.type == "response.completed" and (
+                            pricing := get_pricing(args["model"])
+                        ):
+                            if response.response.usage:
+                                yield usage_event(response.response.usage, pricing)
             else:
                 response = self.client.responses.create(
                     model=model,
-                    input=cast(ResponseInputParam, messages),
+                    input=map_messages(messages),
                     stream=False,
                     store=False,
                     **kwargs,
                 )
 
                 yield MessageDeltaEvent(response.output_text)
+                for item in response.output:
+                    if item.type == "function_call":
+                        yield tool_request(item)
 
-                if response.usage and (pricing := gpt_pricing(args["model"])):
-                    yield UsageEvent.with_pricing(
-                        prompt_tokens=response.usage.input_tokens,
-                        completion_tokens=response.usage.output_tokens,
-                        total_tokens=response.usage.input_tokens
-                        + response.usage.output_tokens,
-                        pricing=pricing,
-                    )
+                if response.usage and (pricing := get_pricing(args["model"])):
+                    yield usage_event(response.usage, pricing)
 
         except openai.BadRequestError as e:
             raise BadRequestError(e.message) from e
+        except openai.APITimeoutError as e:
+            raise timeout_error(e) from e
         except openai.APIError as e:
             raise CompletionError(e.message) from e
 
 
-GPT_3_5_TURBO_PRICE_PER_TOKEN: Pricing = {
-    "prompt": 0.50 / 1_000_000,
-    "response": 1.50 / 1_000_000,
-}
-
-GPT_3_5_TURBO_16K_PRICE_PER_TOKEN: Pricing = {
-    "prompt": 0.003 / 1000,
-    "response": 0.004 / 1000,
-}
-
-GPT_4_PRICE_PER_TOKEN: Pricing = {
-    "prompt": 30.0 / 1_000_000,
-    "response": 60.0 / 1_000_000,
-}
-
-GPT_4_TURBO_PRICE_PER_TOKEN: Pricing = {
-    "prompt": 10.0 / 1_000_000,
-    "response": 30.0 / 1_000_000,
-}
-
-GPT_4_32K_PRICE_PER_TOKEN: Pricing = {
-    "prompt": 60.0 / 1_000_000,
-    "response": 120.0 / 1_000_000,
-}
-
-GPT_4_O_2024_05_13_PRICE_PER_TOKEN: Pricing = {
-    "prompt": 5.0 / 1_000_000,
-    "response": 15.0 / 1_000_000,
-}
-
-GPT_4_O_2024_08_06_PRICE_PER_TOKEN: Pricing = {
-    "prompt": 2.50 / 1_000_000,
-    "response": 10.0 / 1_000_000,
-}
-
-GPT_4_O_MINI_PRICE_PER_TOKEN: Pricing = {
-    "prompt": 0.150 / 1_000_000,
-    "response": 0.600 / 1_000_000,
-}
-
-GPT_4_1_PRICE_PER_TOKEN: Pricing = {
-    "prompt": 2.0 / 1_000_000,
-    "response": 8.0 / 1_000_000,
-}
-
-GPT_4_1_MINI_PRICE_PER_TOKEN: Pricing = {
-    "prompt": 0.400 / 1_000_000,
-    "response": 1.600 / 1_000_000,
-}
-
-GPT_4_1_NANO_PRICE_PER_TOKEN: Pricing = {
-    "prompt": 0.1 / 1_000_000,
-    "response": 0.4 / 1_000_000,
-}
-
-GPT_4_5_PRICE_PER_TOKEN: Pricing = {
-    "prompt": 75.0 / 1_000_000,
-    "response": 150.0 / 1_000_000,
-}
-
-O_1_PRO_PRICE_PER_TOKEN: Pricing = {
-    "prompt": 150.0 / 1_000_000,
-    "response": 600.0 / 1_000_000,
-}
-
-O_1_PRICE_PER_TOKEN: Pricing = {
-    "prompt": 15.0 / 1_000_000,
-    "response": 60.0 / 1_000_000,
-}
-
-O_1_PREVIEW_PRICE_PER_TOKEN: Pricing = {
-    "prompt": 15.0 / 1_000_000,
-    "response": 60.0 / 1_000_000,
-}
-
-O_1_MINI_PRICE_PER_TOKEN: Pricing = {
-    "prompt": 3.0 / 1_000_000,
-    "response": 12.0 / 1_000_000,
-}
-
-O_3_MINI_PRICE_PER_TOKEN: Pricing = {
-    "prompt": 1.1 / 1_000_000,
-    "response": 4.4 / 1_000_000,
-}
-
-O_3_PRICE_PER_TOKEN: Pricing = {
-    "prompt": 10.0 / 1_000_000,
-    "response": 40.0 / 1_000_000,
-}
-
-O_4_MINI_PRICE_PER_TOKEN: Pricing = {
-    "prompt": 1.1 / 1_000_000,
-    "response": 4.4 / 1_000_000,
-}
-
-
-def gpt_pricing(model: str) -> Optional[Pricing]:
-    if model.startswith("gpt-3.5-turbo-16k"):
-        return GPT_3_5_TURBO_16K_PRICE_PER_TOKEN
-    elif model.startswith("gpt-3.5-turbo"):
-        return GPT_3_5_TURBO_PRICE_PER_TOKEN
-    elif model.startswith("gpt-4-32k"):
-        return GPT_4_32K_PRICE_PER_TOKEN
-    elif model.startswith("gpt-4o-mini"):
-        return GPT_4_O_MINI_PRICE_PER_TOKEN
-    elif model.startswith("gpt-4o-2024-05-13") or model.startswith("chatgpt-4o-latest"):
-        return GPT_4_O_2024_05_13_PRICE_PER_TOKEN
-    elif model.startswith("gpt-4o"):
-        return GPT_4_O_2024_08_06_PRICE_PER_TOKEN
-    elif model.startswith("gpt-4.1-mini"):
-        return GPT_4_1_MINI_PRICE_PER_TOKEN
-    elif model.startswith("gpt-4.1-nano"):
-        return GPT_4_1_NANO_PRICE_PER_TOKEN
-    elif model.startswith("gpt-4.1"):
-        return GPT_4_1_PRICE_PER_TOKEN
-    elif model.startswith("gpt-4.5"):
-        return GPT_4_5_PRICE_PER_TOKEN
-    elif model.startswith("gpt-4-turbo") or re.match(r"gpt-4-\d\d\d\d-preview", model):
-        return GPT_4_TURBO_PRICE_PER_TOKEN
-    elif model.startswith("gpt-4"):
-        return GPT_4_PRICE_PER_TOKEN
-    elif model.startswith("o1-pro"):
-        return O_1_PRO_PRICE_PER_TOKEN
-    elif model.startswith("o1-preview"):
-        return O_1_PREVIEW_PRICE_PER_TOKEN
-    elif model.startswith("o1-mini"):
-        return O_1_MINI_PRICE_PER_TOKEN
-    elif model.startswith("o1"):
-        return O_1_PRICE_PER_TOKEN
-    elif model.startswith("o3-mini"):
-        return O_3_MINI_PRICE_PER_TOKEN
-    elif model.startswith("o3"):
-        return O_3_PRICE_PER_TOKEN
-    elif model.startswith("o4-mini"):
-        return O_4_MINI_PRICE_PER_TOKEN
-    else:
-        return None
+def usage_event(usage: ResponseUsage, pricing: Pricing) -> UsageEvent:
+    cached_tokens = 0
+    if usage.input_tokens_details:
+        cached_tokens = usage.input_tokens_details.cached_tokens or 0
+    return UsageEvent.with_pricing(
+        prompt_tokens=usage.input_tokens,
+        completion_tokens=usage.output_tokens,
+        total_tokens=usage.input_tokens + usage.output_tokens,
+        pricing=pricing,
+        cache_read_tokens=cached_tokens,
+    )
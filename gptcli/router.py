@@ -0,0 +1,127 @@
+import re
+import threading
+from typing import Dict, List, Literal, Optional, TypedDict
+
+from gptcli.completion import Message
+from gptcli.pricing import estimate_tokens, get_pricing
+
+RoutingPolicy = Literal["length", "cheapest", "fastest", "classifier"]
+ROUTING_POLICIES = ("length", "cheapest", "fastest", "classifier")
+
+
+class RoutingConfig(TypedDict, total=False):
+    policy: RoutingPolicy
+    # A model is only adequate for prompts up to this many (estimated) tokens.
+    # Models without a limit are adequate for any prompt.
+    max_prompt_tokens: Dict[str, int]
+
+
+# Used to compare prices, since the length of the response isn't known upfront
+EXPECTED_RESPONSE_TOKENS = 500
+
+# Weight of the latest measurement in the moving average of the TTFT
+TTFT_SMOOTHING = 0.3
+
+COMPLEX_PROMPT_PATTERN = re.compile(
+    r"\b(explain|why|design|architect\w*|implement|refactor|debug|prove|analy[sz]e|"
+    r"compare|optimi[sz]e|step[- ]by[- ]step|trade-?offs?)\b",
+    re.IGNORECASE,
+)
+COMPLEX_PROMPT_TOKENS = 400
+
+
+def is_simple_prompt(messages: List[Message]) -> bool:
+    """
+    Cheap local heuristic for whether the last user prompt can be answered by a small
+    model: short, without code and without words that ask for reasoning.
+    """
+    if not messages:
+        return True
+    prompt = messages[-1]["content"]
+    if "```" in prompt or COMPLEX_PROMPT_PATTERN.search(prompt):
+        return False
+    return estimate_tokens([messages[-1]]) < COMPLEX_PROMPT_TOKENS
+
+
+class ModelRouter:
+    """
+    Picks the model for each turn from an assistant's candidate models:
+
+    - `length`: the first candidate, in the configured order, that is adequate for
+      the prompt length.
+    - `cheapest`: the adequate candidate with the lowest expected cost.
+    - `fastest`: the adequate candidate with the lowest recently measured
+      time-to-first-token. Candidates without measurements are tried first.
+    - `classifier`: the cheapest adequate candidate for simple prompts, the
+      assistant's `model` otherwise.
+
+    The assistant's `model` is used when no candidate is adequate.
+    """
+
+    def __init__(self, default_model: str, models: List[str], routing: RoutingConfig):
+        self.default_model = default_model
+        self.models = models
+        self.policy = routing.get("policy", "cheapest")
+        if self.policy not in ROUTING_POLICIES:
+            raise ValueError(f"Unknown routing policy: {self.policy}")
+        self.max_prompt_tokens = routing.get("max_prompt_tokens", {})
+        self.ttft: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def adequate_models(self, prompt_tokens: int) -> List[str]:
+        return [
+            model
+            for model in self.models
+            if prompt_tokens <= self.max_prompt_tokens.get(model, prompt_tokens)
+        ]
+
+    def expected_cost(self, model: str, prompt_tokens: int) -> float:
+        pricing = get_pricing(model, prompt_tokens)
+        if pricing is None:
+            return float("inf")
+        return (
+            prompt_tokens * pricing["prompt"]
+            + EXPECTED_RESPONSE_TOKENS * pricing["response"]
+        )
+
+    def cheapest(self, models: List[str], prompt_tokens: int) -> Optional[str]:
+        if not models:
+            return None
+        return min(models, key=lambda model: self.expected_cost(model, prompt_tokens))
+
+    def fastest(self, models: List[str]) -> Optional[str]:
+        if not models:
+            return None
+        with self.lock:
+            unmeasured = [model for model in models if model not in self.ttft]
+            if unmeasured:
+                return unmeasured[0]
+            return min(models, key=lambda model: self.ttft[model])
+
+    def choose(self, messages: List[Message]) -> str:
+        prompt_tokens = estimate_tokens(messages)
+        models = self.adequate_models(prompt_tokens)
+
+        if self.policy == "length":
+            model = models[0] if models else None
+        elif self.policy == "fastest":
+            model = self.fastest(models)
+        elif self.policy == "classifier":
+            if is_simple_prompt(messages):
+                model = self.cheapest(models, prompt_tokens)
+            else:
+                model = self.default_model
+        else:
+            model = self.cheapest(models, prompt_tokens)
+
+        return model or self.default_model
+
+    def record_ttft(self, model: str, seconds: float):
+        with self.lock:
+            previous = self.ttft.get(model)
+            if previous is None:
+                self.ttft[model] = seconds
+            else:
+                self.ttft[model] = (
+                    TTFT_SMOOTHING * seconds + (1 - TTFT_SMOOTHING) * previous
+                )
@@ -1,13 +1,24 @@
+import os
+import queue
+import shlex
+import threading
 from abc import abstractmethod
 from gptcli.assistant import Assistant
 from gptcli.completion import (
+    CancellationToken,
+    CompletionEvent,
     Message,
     CompletionError,
+    ResponseBuffer,
     BadRequestError,
     ToolCallEvent,
     UsageEvent,
 )
-from typing import List, Optional
+from gptcli.context import ContextIndex
+from gptcli.pipeline import PipelineStats
+from gptcli.profiling import hot_path
+from gptcli.tracing import get_tracer, trace_response_streamer, traced
+from typing import List, Optional, Tuple
 
 
 class ResponseStreamer:
@@ -31,12 +42,21 @@ class ChatListener:
     def on_chat_start(self):
         pass
 
+    def on_chat_end(self):
+        pass
+
     def on_chat_clear(self):
         pass
 
     def on_chat_rerun(self, success: bool):
         pass
 
+    def on_chat_stats(self):
+        pass
+
+    def on_context_change(self, paths: List[str], num_files: int):
+        pass
+
     def on_error(self, error: Exception):
         pass
 
@@ -61,6 +81,14 @@ class UserInputProvider:
         pass
 
 
+class QueuedInputProvider(UserInputProvider):
+    def __init__(self, prompts: "queue.Queue[str]"):
+        self.prompts = prompts
+
+    def get_user_input(self) -> str:
+        return self.prompts.get()
+
+
 class InvalidArgumentError(Exception):
     def __init__(self, message: str):
         self.message = message
@@ -70,13 +98,32 @@ COMMAND_CLEAR = (":clear", ":c")
 COMMAND_QUIT = (":quit", ":q")
 COMMAND_RERUN = (":rerun", ":r")
 COMMAND_HELP = (":help", ":h", ":?")
-ALL_COMMANDS = [*COMMAND_CLEAR, *COMMAND_QUIT, *COMMAND_RERUN, *COMMAND_HELP]
+COMMAND_STATS = (":stats",)
+COMMAND_CONTEXT = (":context",)
+ALL_COMMANDS = [
+    *COMMAND_CLEAR,
+    *COMMAND_QUIT,
+    *COMMAND_RERUN,
+    *COMMAND_HELP,
+    *COMMAND_STATS,
+    *COMMAND_CONTEXT,
+]
+ASIDE_PREFIX = "&"
 COMMANDS_HELP = """
 Commands:
 - `:clear` / `:c` / Ctrl+C - Clear the conversation.
 - `:quit` / `:q` / Ctrl+D - Quit the program.
 - `:rerun` / `:r` / Ctrl+R - Re-run the last message.
+- `:stats` - Show latency and throughput stats for this session.
+- `:paste` - Paste a large text straight from the terminal, to send with the next message.
+- `:file <path>` - Send the content of a file with the next message.
+- `:context <paths>` - Add the parts of the files under the paths that are most relevant to
+  each prompt to it. `:context` without paths stops adding them.
 - `:help` / `:h` / `:?` - Show this help message.
+
+With --queue_input, prompts typed while a response streams are sent after it. Start
+a prompt with `&` to ask it on the side right away, without adding it to the
+conversation.
 """
 
 
@@ -86,12 +133,36 @@ class ChatSession:
         assistant: Assistant,
         listener: ChatListener,
         stream: bool = True,
+        pipeline: bool = False,
+        batch_deltas: bool = False,
+        queue_input: bool = False,
+        context_tokens: int = 8000,
     ):
         self.assistant = assistant
         self.messages: List[Message] = assistant.init_messages()
         self.user_prompts: List[Message] = []
         self.listener = listener
         self.stream = stream
+        self.pipeline = pipeline
+        self.batch_deltas = batch_deltas
+        self.pipeline_stats: Optional[PipelineStats] = None
+        self.queue_input = queue_input
+        # Held while a turn renders, so that side turns don't interleave with it
+        self.output_lock = threading.RLock()
+        self.current_cancel: Optional[CancellationToken] = None
+        self.side_turns: List[Tuple[threading.Thread, CancellationToken]] = []
+        self.context: Optional[ContextIndex] = None
+        self.context_tokens = context_tokens
+
+    def seed(self, messages: List[Message]):
+        """
+        Continue from a previous conversation: the messages follow the assistant's
+        initial messages, and can be re-run or cleared like the session's own.
+        """
+        self.messages = self.messages + messages
+        self.user_prompts = self.user_prompts + [
+            message for message in messages if message["role"] == "user"
+        ]
 
     def _clear(self):
         self.messages = self.assistant.init_messages()
@@ -109,21 +180,66 @@ class ChatSession:
         self.listener.on_chat_rerun(True)
         self._respond()
 
+    def set_context(self, paths: List[str]):
+        """
+        Index the files under `paths`, and add the chunks most relevant to each prompt
+        to it from now on. No paths stop adding context.
+        """
+        missing = [path for path in paths if not os.path.exists(path)]
+        if missing:
+            raise InvalidArgumentError(f"No such file or directory: {missing[0]}")
+
+        if not paths:
+            self.context = None
+            self.listener.on_context_change([], 0)
+            return
+
+        context = ContextIndex(paths)
+        context.refresh()
+        self.context = context
+        self.listener.on_context_change(paths, len(context.files))
+
+    def _request_messages(self) -> List[Message]:
+        """
+        The messages to send, with the context added to the last prompt. The context is
+        not kept in the conversation, each prompt gets the context relevant to it.
+        """
+        if self.context is None:
+            return self.messages
+
+        with get_tracer().span("chat_session.pack_context"):
+            self.context.refresh()
+            prompt = self.messages[-1]["content"]
+            content = self.context.apply(prompt, self.context_tokens)
+        return self.messages[:-1] + [{"role": "user", "content": content}]
+
+    @traced("chat_session.respond")
+    @hot_path
     def _respond(self) -> bool:
         """
         Respond to the user's input and return whether the assistant's response was saved.
         """
-        next_response: str = ""
+        next_response = ResponseBuffer()
         usage: Optional[UsageEvent] = None
+        cancel = self.current_cancel = CancellationToken()
+        messages = self._request_messages()
         try:
+            # With `pipeline`, the assistant reads streamed responses on a separate
+            # thread and batches the deltas that queue up while rendering lags
             completion_iter = self.assistant.complete_chat(
-                self.messages, stream=self.stream
+                messages,
+                stream=self.stream,
+                cancel=cancel,
+                batch_deltas=self.pipeline and self.batch_deltas,
             )
 
-            with self.listener.response_streamer() as stream:
+            with (
+                self.output_lock,
+                trace_response_streamer(self.listener.response_streamer()) as stream,
+            ):
                 for event in completion_iter:
                     if event.type == "message_delta":
-                        next_response += event.text
+                        next_response.append(event.text)
                         stream.on_next_token(event.text)
                     elif event.type == "thinking_delta":
                         stream.on_thinking_token(event.text)
@@ -133,18 +249,31 @@ class ChatSession:
                         usage = event
 
         except KeyboardInterrupt:
-            # If the user interrupts the chat completion, we'll just return what we have so far
-            pass
+            # If the user interrupts the chat completion, we'll just return what we have so far.
+            # Abort the request so the provider stops generating
+            cancel.cancel()
         except BadRequestError as e:
             self.listener.on_error(e)
             return False
         except CompletionError as e:
             self.listener.on_error(e)
             return True
-
-        next_message: Message = {"role": "assistant", "content": next_response}
-        self.listener.on_chat_message(next_message)
-        self.listener.on_chat_response(self.messages, next_message, usage)
+        finally:
+            self.current_cancel = None
+            if self.pipeline and self.stream:
+                self.pipeline_stats = self.assistant.last_pipeline_stats
+
+        if cancel.cancelled and usage is None:
+            # Account for what was generated before the request was aborted
+            usage = self.assistant.cancelled_usage()
+
+        next_message: Message = {
+            "role": "assistant",
+            "content": next_response.getvalue(),
+        }
+        with get_tracer().span("listeners.on_chat_response"):
+            self.listener.on_chat_message(next_message)
+            self.listener.on_chat_response(self.messages, next_message, usage)
 
         self.messages = self.messages + [next_message]
         return True
@@ -178,15 +307,155 @@ class ChatSession:
         elif user_input in COMMAND_HELP:
             self._print_help()
             return True
+        elif user_input in COMMAND_STATS:
+            self.listener.on_chat_stats()
+            return True
+        elif user_input.partition(" ")[0] in COMMAND_CONTEXT:
+            try:
+                self.set_context(shlex.split(user_input.partition(" ")[2]))
+            except ValueError as e:
+                self.listener.on_error(InvalidArgumentError(f"Invalid paths: {e}"))
+            except InvalidArgumentError as e:
+                self.listener.on_error(e)
+            return True
 
-        self._add_user_message(user_input)
-        response_saved = self._respond()
-        if not response_saved:
-            self._rollback_user_message()
+        with self.output_lock:
+            self._add_user_message(user_input)
+            response_saved = self._respond()
+            if not response_saved:
+                self._rollback_user_message()
 
         return True
 
+    def interrupt(self) -> bool:
+        """
+        Abort the responses that are being generated, including side turns, and return
+        whether there were any.
+        """
+        running = [cancel for thread, cancel in self.side_turns if thread.is_alive()]
+        if self.current_cancel is not None:
+            running.append(self.current_cancel)
+        cancels = [cancel for cancel in running if not cancel.cancelled]
+        for cancel in cancels:
+            cancel.cancel()
+        return bool(cancels)
+
+    def _side_turn(
+        self,
+        messages: List[Message],
+        cancel: CancellationToken,
+        errors: List[BaseException],
+    ):
+        """
+        Answer the last message of `messages` without adding it to the conversation. The
+        response is rendered in one piece once complete. It's requested with a fork of
+        the assistant, so that it doesn't clobber the state of the current turn's
+        request. Unexpected errors are added to `errors`.
+        """
+        assistant = self.assistant.fork()
+        events: List[CompletionEvent] = []
+        try:
+            for event in assistant.complete_chat(
+                messages, stream=self.stream, cancel=cancel
+            ):
+                events.append(event)
+        except CompletionError as e:
+            with self.output_lock:
+                self.listener.on_error(e)
+            return
+        except Exception as e:
+            errors.append(e)
+            return
+
+        response = ResponseBuffer()
+        usage: Optional[UsageEvent] = None
+        with self.output_lock:
+            self.listener.on_chat_message(messages[-1])
+            with self.listener.response_streamer() as stream:
+                for event in events:
+                    if event.type == "message_delta":
+                        response.append(event.text)
+                        stream.on_next_token(event.text)
+                    elif event.type == "thinking_delta":
+                        stream.on_thinking_token(event.text)
+                    elif event.type == "tool_call":
+                        stream.on_tool_call(event)
+                    elif event.type == "usage":
+                        usage = event
+
+            if cancel.cancelled and usage is None:
+                # Account for what was generated before the request was aborted
+                usage = assistant.cancelled_usage()
+
+            next_message: Message = {
+                "role": "assistant",
+                "content": response.getvalue(),
+            }
+            self.listener.on_chat_message(next_message)
+            self.listener.on_chat_response(messages, next_message, usage)
+
+    def _start_side_turn(self, user_input: str, errors: List[BaseException]):
+        user_message: Message = {"role": "user", "content": user_input}
+        cancel = CancellationToken()
+        thread = threading.Thread(
+            target=self._side_turn,
+            args=(self.messages + [user_message], cancel, errors),
+            name="gptcli-side-turn",
+            daemon=True,
+        )
+        thread.start()
+        self.side_turns.append((thread, cancel))
+
     def loop(self, input_provider: UserInputProvider):
         self.listener.on_chat_start()
-        while self.process_input(input_provider.get_user_input()):
-            pass
+        try:
+            if self.queue_input:
+                self._queued_loop(input_provider)
+            else:
+                while self._next_turn(input_provider):
+                    pass
+        finally:
+            self.listener.on_chat_end()
+
+    def _queued_loop(self, input_provider: UserInputProvider):
+        """
+        Keep reading input on this thread while the turns are processed in order on a
+        worker thread, so that the next prompts can be typed while a response streams.
+        """
+        prompts: "queue.Queue[str]" = queue.Queue()
+        errors: List[BaseException] = []
+
+        def process_prompts():
+            try:
+                while self._next_turn(QueuedInputProvider(prompts)):
+                    pass
+            except BaseException as e:
+                errors.append(e)
+
+        worker = threading.Thread(
+            target=process_prompts, name="gptcli-turns", daemon=True
+        )
+        worker.start()
+        try:
+            while worker.is_alive():
+                user_input = input_provider.get_user_input()
+                if user_input.startswith(ASIDE_PREFIX) and user_input[1:].strip():
+                    self._start_side_turn(user_input[1:].strip(), errors)
+                    continue
+
+                prompts.put(user_input)
+                if user_input in COMMAND_QUIT:
+                    break
+        finally:
+            if worker.is_alive():
+                prompts.put(COMMAND_QUIT[0])
+            worker.join()
+            for thread, _ in self.side_turns:
+                thread.join()
+
+        if errors:
+            raise errors[0]
+
+    @traced("chat_session.turn")
+    def _next_turn(self, input_provider: UserInputProvider) -> bool:
+        return self.process_input(input_provider.get_user_input())
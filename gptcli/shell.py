@@ -1,27 +1,102 @@
+import json
 import os
 import logging
 import sys
 import subprocess
 import tempfile
+import time
+from typing import Callable, Optional, TextIO, Union
+
+import attr
+
 from gptcli.assistant import Assistant
+from gptcli.completion import (
+    CancellationToken,
+    CompletionEvent,
+    MessageDeltaEvent,
+    ResponseBuffer,
+)
+from gptcli.jsonstream import JsonItemEvent, JsonStreamParser
+
+OUTPUT_FORMATS = ["text", "jsonl"]
+
+
+class JsonlEventWriter:
+    """
+    Writes completion events to `stream` as compact JSON lines, with the wall-clock
+    time of the event and the seconds elapsed since the request was sent. Every line is
+    flushed as soon as it's complete, so that a process reading from a pipe gets each
+    event right away instead of when the pipe's block buffer fills up.
+    """
 
+    def __init__(self, stream: TextIO, clock: Callable[[], float] = time.time):
+        self.stream = stream
+        self.clock = clock
+        self.started_at = clock()
 
-def simple_response(assistant: Assistant, prompt: str, stream: bool) -> None:
+    def write(self, event: Union[CompletionEvent, JsonItemEvent]):
+        now = self.clock()
+        record = {
+            **attr.asdict(event),
+            "ts": round(now, 6),
+            "elapsed": round(now - self.started_at, 6),
+        }
+        self.stream.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.stream.flush()
+
+
+def simple_response(
+    assistant: Assistant,
+    prompt: str,
+    stream: bool,
+    output_format: str = "text",
+    json_output: bool = False,
+) -> None:
+    """
+    Print the response to the prompt. With `json_output`, each member of the
+    top-level array or object of the response is printed as a line of JSON as soon
+    as it's complete (with the jsonl format, it's written as a `json_item` event
+    among the others). Raises `json.JSONDecodeError` if the response isn't valid
+    JSON.
+    """
     messages = assistant.init_messages()
     messages.append({"role": "user", "content": prompt})
     logging.info("User: %s", prompt)
-    response_iter = assistant.complete_chat(messages, stream=stream)
-    result = ""
+    cancel = CancellationToken()
+    writer = JsonlEventWriter(sys.stdout) if output_format == "jsonl" else None
+    parser = JsonStreamParser() if json_output else None
+    response_iter = assistant.complete_chat(messages, stream=stream, cancel=cancel)
+    result = ResponseBuffer()
     try:
         for response in response_iter:
             if response.type == "message_delta":
-                result += response.text
+                result.append(response.text)
+            if writer is not None:
+                writer.write(response)
+            elif response.type == "message_delta" and parser is None:
                 sys.stdout.write(response.text)
+            if response.type == "message_delta" and parser is not None:
+                for item in parser.feed(response.text):
+                    _write_json_item(item, writer)
+        if parser is not None and not parser.done:
+            # The response is a single JSON value rather than an array or object
+            _write_json_item(JsonItemEvent(0, json.loads(result.getvalue())), writer)
     except KeyboardInterrupt:
-        pass
+        cancel.cancel()
+        usage = assistant.cancelled_usage()
+        if writer is not None and usage is not None:
+            writer.write(usage)
     finally:
         sys.stdout.flush()
-        logging.info("Assistant: %s", result)
+        logging.info("Assistant: %s", result.getvalue())
+
+
+def _write_json_item(item: JsonItemEvent, writer: Optional[JsonlEventWriter]):
+    if writer is not None:
+        writer.write(item)
+    else:
+        sys.stdout.write(item.to_json() + "\n")
+        sys.stdout.flush()
 
 
 def execute(assistant: Assistant, prompt: str) -> None:
@@ -29,9 +104,9 @@ def execute(assistant: Assistant, prompt: str) -> None:
     messages.append({"role": "user", "content": prompt})
     logging.info("User: %s", prompt)
     response_iter = assistant.complete_chat(messages, stream=False)
-    result = next(response_iter)
-    assert result.type == "message_delta"
-    result = result.text
+    event = next(iter(response_iter))
+    assert isinstance(event, MessageDeltaEvent)
+    result = event.text
     logging.info("Assistant: %s", result)
 
     with tempfile.NamedTemporaryFile(mode="w", prefix="gptcli-", delete=False) as f:
@@ -0,0 +1,206 @@
+import importlib
+import json
+import shlex
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypedDict
+
+from attr import dataclass
+
+from gptcli.completion import Message, ToolCall, ToolDefinition
+from gptcli.tracing import get_tracer
+
+DEFAULT_TOOL_TIMEOUT = 30.0
+TOOL_PARALLELISM = 8
+# Outputs are cut to this many characters before being sent to the model
+MAX_OUTPUT_CHARS = 20_000
+
+EMPTY_PARAMETERS = {"type": "object", "properties": {}}
+
+
+class ToolConfig(TypedDict, total=False):
+    description: str
+    # JSON schema of the arguments object
+    parameters: dict
+    # Shell command. `{name}` is replaced by the shell-quoted argument `name`, and
+    # all arguments are also passed as a JSON object on stdin
+    command: str
+    # "package.module:function", called with the arguments as keyword arguments
+    function: str
+    # In seconds
+    timeout: float
+
+
+class ToolError(Exception):
+    pass
+
+
+def _resolve(function: str) -> Callable[..., Any]:
+    module_name, _, attribute = function.partition(":")
+    if not attribute:
+        raise ValueError(f"Expected `module:function`, got `{function}`")
+    try:
+        module = importlib.import_module(module_name)
+        return getattr(module, attribute)
+    except (ImportError, AttributeError) as e:
+        raise ValueError(f"Cannot load `{function}`: {e}") from e
+
+
+class Tool:
+    """
+    A tool the model can call, defined in the config by a shell command or a Python
+    function.
+    """
+
+    def __init__(self, name: str, config: ToolConfig):
+        if ("command" in config) == ("function" in config):
+            raise ValueError(f"Tool `{name}` needs either a `command` or a `function`")
+        self.name = name
+        self.description = config.get("description", "")
+        self.parameters = config.get("parameters", EMPTY_PARAMETERS)
+        self.timeout = float(config.get("timeout", DEFAULT_TOOL_TIMEOUT))
+        self.command = config.get("command")
+        self.function = _resolve(config["function"]) if "function" in config else None
+
+    def definition(self) -> ToolDefinition:
+        return {
+            "name": self.name,
+            "description": self.description,
+            "parameters": self.parameters,
+        }
+
+    def __call__(self, arguments: Dict[str, Any]) -> str:
+        if self.command is not None:
+            return self._run_command(self.command, arguments)
+        return self._call_function(arguments)
+
+    def _run_command(self, command: str, arguments: Dict[str, Any]) -> str:
+        for key, value in arguments.items():
+            if not isinstance(value, str):
+                value = json.dumps(value)
+            command = command.replace("{" + key + "}", shlex.quote(value))
+        try:
+            result = subprocess.run(
+                command,
+                shell=True,
+                input=json.dumps(arguments),
+                capture_output=True,
+                text=True,
+                timeout=self.timeout,
+            )
+        except subprocess.TimeoutExpired as e:
+            raise ToolError(f"Timed out after {self.timeout:g}s") from e
+        if result.returncode != 0:
+            raise ToolError(
+                f"Exited with status {result.returncode}: {result.stderr.strip()}"
+            )
+        return result.stdout
+
+    def _call_function(self, arguments: Dict[str, Any]) -> str:
+        # Threads can't be killed, so a function that times out is left running in
+        # the background and its result is dropped
+        outcome: Dict[str, Any] = {}
+
+        def call():
+            try:
+                outcome["result"] = self.function(**arguments)
+            except BaseException as e:
+                outcome["error"] = e
+
+        thread = threading.Thread(target=call, name=f"gptcli-tool-{self.name}")
+        thread.daemon = True
+        thread.start()
+        thread.join(self.timeout)
+        if thread.is_alive():
+            raise ToolError(f"Timed out after {self.timeout:g}s")
+        if "error" in outcome:
+            error = outcome["error"]
+            raise ToolError(f"{type(error).__name__}: {error}") from error
+        result = outcome["result"]
+        return result if isinstance(result, str) else json.dumps(result)
+
+
+@dataclass
+class ToolResult:
+    call: ToolCall
+    output: str
+    # In seconds
+    latency: float
+    error: Optional[str] = None
+
+    def message(self) -> Message:
+        content = f"Error: {self.error}" if self.error is not None else self.output
+        if len(content) > MAX_OUTPUT_CHARS:
+            content = content[:MAX_OUTPUT_CHARS] + "\n[output truncated]"
+        return {
+            "role": "tool",
+            "content": content,
+            "tool_call_id": self.call["id"],
+            "name": self.call["name"],
+        }
+
+    def summary(self) -> str:
+        if self.error is not None:
+            return f"{self.call['name']} failed after {self.latency:.2f}s: {self.error}"
+        return f"{self.call['name']} returned in {self.latency:.2f}s"
+
+
+def describe_call(call: ToolCall) -> str:
+    arguments = ", ".join(
+        f"{key}={json.dumps(value)}" for key, value in call["arguments"].items()
+    )
+    return f"{call['name']}({arguments})"
+
+
+class ToolExecutor:
+    """
+    Runs the tool calls of a model turn at the same time on a thread pool (shell
+    commands in their own processes), each one with its own timeout.
+    """
+
+    def __init__(self, tools: List[Tool], parallelism: int = TOOL_PARALLELISM):
+        self.tools = {tool.name: tool for tool in tools}
+        self.parallelism = parallelism
+
+    def definitions(self) -> List[ToolDefinition]:
+        return [tool.definition() for tool in self.tools.values()]
+
+    def run(
+        self, calls: List[ToolCall], parent_span: Any = None
+    ) -> Iterator[ToolResult]:
+        """
+        The results of the calls, as they complete.
+        """
+        with ThreadPoolExecutor(
+            min(len(calls), self.parallelism), thread_name_prefix="gptcli-tools"
+        ) as executor:
+            futures = [executor.submit(self._run, call, parent_span) for call in calls]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def _run(self, call: ToolCall, parent_span: Any) -> ToolResult:
+        started_at = time.perf_counter()
+        tool = self.tools.get(call["name"])
+        with get_tracer().span("tool.run", parent=parent_span, tool=call["name"]):
+            try:
+                if tool is None:
+                    raise ToolError(f"Unknown tool `{call['name']}`")
+                output = tool(call["arguments"])
+                error = None
+            except ToolError as e:
+                output, error = "", str(e)
+        return ToolResult(call, output, time.perf_counter() - started_at, error)
+
+
+def load_tools(names: List[str], configs: Dict[str, ToolConfig]) -> List[Tool]:
+    """
+    The tools called `names` among those defined in the config.
+    """
+    tools = []
+    for name in names:
+        if name not in configs:
+            raise ValueError(f"Unknown tool `{name}`, define it under `tools`")
+        tools.append(Tool(name, configs[name]))
+    return tools
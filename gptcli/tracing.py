@@ -0,0 +1,368 @@
+"""
+Lightweight span tracing exported as OTLP-compatible JSON lines.
+
+Tracing is disabled by default: the global tracer is a `NoopTracer` whose spans are
+shared do-nothing objects, so instrumented code paths cost a couple of method calls.
+Call `init_tracing(path)` to record spans and append them to `path`, one OTLP
+`ExportTraceServiceRequest` JSON document per line.
+"""
+
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import gptcli
+
+
+class Span:
+    __slots__ = (
+        "tracer",
+        "name",
+        "trace_id",
+        "span_id",
+        "parent_span_id",
+        "start_time",
+        "end_time",
+        "attributes",
+        "events",
+        "error",
+    )
+
+    def __init__(
+        self,
+        tracer: "Tracer",
+        name: str,
+        parent: Optional["Span"],
+        attributes: Dict[str, Any],
+        start_time: Optional[int] = None,
+    ):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id: str = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_span_id = parent.span_id if parent else ""
+        self.start_time = start_time or time.time_ns()
+        self.end_time: Optional[int] = None
+        self.attributes = attributes
+        self.events: List[dict] = []
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def add_event(self, name: str, **attributes):
+        self.events.append(
+            {"name": name, "time": time.time_ns(), "attributes": attributes}
+        )
+
+    def end(self, error: Optional[BaseException] = None):
+        if self.end_time is not None:
+            return
+        self.end_time = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.tracer._on_end(self)
+
+    def __enter__(self) -> "Span":
+        self.tracer._push(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer._pop(self)
+        self.end(exc_value)
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_time),
+            "endTimeUnixNano": str(self.end_time),
+            "attributes": _otlp_attributes(self.attributes),
+            "events": [
+                {
+                    "timeUnixNano": str(event["time"]),
+                    "name": event["name"],
+                    "attributes": _otlp_attributes(event["attributes"]),
+                }
+                for event in self.events
+            ],
+            "status": {"code": 2, "message": self.error} if self.error else {},
+        }
+        return span
+
+
+class NoopSpan:
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def add_event(self, name: str, **attributes):
+        pass
+
+    def end(self, error: Optional[BaseException] = None):
+        pass
+
+    def __enter__(self) -> "NoopSpan":
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class NoopTracer:
+    enabled = False
+
+    def span(self, name: str, parent: Any = None, **attributes) -> Any:
+        return NOOP_SPAN
+
+    def start_span(self, name: str, parent: Any = None, **attributes) -> Any:
+        return NOOP_SPAN
+
+    def current_span(self) -> Any:
+        return None
+
+    def shutdown(self):
+        pass
+
+
+class Tracer:
+    enabled = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.finished: List[Span] = []
+
+    def _stack(self) -> List[Span]:
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def _push(self, span: Span):
+        self._stack().append(span)
+
+    def _pop(self, span: Span):
+        stack = self._stack()
+        if stack and stack[-1] is span:
+            stack.pop()
+
+    def current_span(self) -> Optional[Span]:
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def start_span(
+        self,
+        name: str,
+        parent: Optional[Span] = None,
+        start_time: Optional[int] = None,
+        **attributes,
+    ) -> Span:
+        """
+        Start a span without making it current. `parent` defaults to the current span
+        of the calling thread. The caller must call `end()`.
+        """
+        if parent is None:
+            parent = self.current_span()
+        return Span(self, name, parent, attributes, start_time)
+
+    def span(self, name: str, parent: Optional[Span] = None, **attributes) -> Span:
+        """
+        Create a span to be used as a context manager, which makes it the current
+        span of the calling thread for its duration.
+        """
+        return self.start_span(name, parent, **attributes)
+
+    def _on_end(self, span: Span):
+        with self.lock:
+            self.finished.append(span)
+        if not span.parent_span_id:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            spans, self.finished = self.finished, []
+        if not spans:
+            return
+
+        document = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": _otlp_attributes(
+                            {
+                                "service.name": "gptcli",
+                                "service.version": gptcli.__version__,
+                            }
+                        )
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": "gptcli"},
+                            "spans": [span.to_otlp() for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+        with open(self.path, "a") as f:
+            f.write(json.dumps(document, separators=(",", ":")) + "\n")
+
+    def shutdown(self):
+        self.flush()
+
+
+tracer: Any = NoopTracer()
+
+
+def get_tracer() -> Any:
+    return tracer
+
+
+def init_tracing(path: str):
+    global tracer
+    tracer = Tracer(path)
+    atexit.register(tracer.shutdown)
+
+
+def traced(name: str) -> Callable:
+    """
+    Decorator that wraps every call of the function in a span.
+    """
+
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class TracingResponseStreamer:
+    """
+    Wraps a response streamer and records on `span` how much time was spent
+    dispatching events to listeners (including rendering), and the final flush.
+    """
+
+    def __init__(self, streamer, span: Span):
+        self.streamer = streamer
+        self.span = span
+        self.dispatch_ns = 0
+        self.dispatch_calls = 0
+
+    def _dispatch(self, fn: Callable, *args):
+        start = time.perf_counter_ns()
+        fn(*args)
+        self.dispatch_ns += time.perf_counter_ns() - start
+        self.dispatch_calls += 1
+
+    def __enter__(self):
+        with tracer.span("listeners.enter"):
+            self.streamer.__enter__()
+        return self
+
+    def on_next_token(self, token: str):
+        self._dispatch(self.streamer.on_next_token, token)
+
+    def on_thinking_token(self, token: str):
+        self._dispatch(self.streamer.on_thinking_token, token)
+
+    def on_tool_call(self, tool_call):
+        self._dispatch(self.streamer.on_tool_call, tool_call)
+
+    def __exit__(self, *args):
+        self.span.set_attribute("listeners.dispatch_ms", self.dispatch_ns / 1e6)
+        self.span.set_attribute("listeners.dispatch_calls", self.dispatch_calls)
+        with tracer.span("listeners.exit"):
+            self.streamer.__exit__(*args)
+
+
+def trace_response_streamer(streamer):
+    span = tracer.current_span()
+    if span is None:
+        return streamer
+    return TracingResponseStreamer(streamer, span)
+
+
+# Thread-local slot for the span that HTTP requests of the current provider call
+# should be attributed to, and the request setup span that the first HTTP request
+# ends. Set by the assistant around the provider's first read.
+_http_span = threading.local()
+
+
+def set_http_span(span: Any = None, setup_span: Any = None):
+    _http_span.span = span
+    _http_span.setup_span = setup_span
+
+
+def httpx_event_hooks() -> Optional[Dict[str, list]]:
+    """
+    Event hooks for httpx clients used by the providers, which record connection
+    setup, request and response header timings as child spans. None if tracing is
+    disabled.
+    """
+    if not tracer.enabled:
+        return None
+    return {"request": [_on_http_request]}
+
+
+def _on_http_request(request):
+    span = getattr(_http_span, "span", None)
+    if span is None:
+        return
+    setup_span = getattr(_http_span, "setup_span", None)
+    if setup_span is not None:
+        setup_span.end()
+    span.add_event("http.request", method=request.method, url=str(request.url))
+    request.extensions["trace"] = _HttpTrace(span)
+
+
+class _HttpTrace:
+    """
+    httpcore `trace` extension that turns `<step>.started` / `<step>.complete`
+    callbacks into child spans.
+    """
+
+    def __init__(self, parent: Span):
+        self.parent = parent
+        self.started: Dict[str, int] = {}
+
+    def __call__(self, event_name: str, info: dict):
+        step, _, phase = event_name.rpartition(".")
+        if phase == "started":
+            self.started[step] = time.time_ns()
+        elif phase in ("complete", "failed") and step in self.started:
+            span = tracer.start_span(
+                f"http.{step}", parent=self.parent, start_time=self.started.pop(step)
+            )
+            if phase == "failed":
+                span.error = repr(info.get("exception"))
+            span.end()
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[dict]:
+    result = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            otlp_value: dict = {"boolValue": value}
+        elif isinstance(value, int):
+            otlp_value = {"intValue": str(value)}
+        elif isinstance(value, float):
+            otlp_value = {"doubleValue": value}
+        else:
+            otlp_value = {"stringValue": str(value)}
+        result.append({"key": key, "value": otlp_value})
+    return result
@@ -0,0 +1,40 @@
+from rich.console import Console
+
+from gptcli.archive import (
+    ArchiveChatListener,
+    ConversationArchive,
+    highlighted,
+    print_search_results,
+)
+
+
+def test_search(tmp_path):
+    archive = ConversationArchive(str(tmp_path / "archive.db"))
+    listener = ArchiveChatListener(archive, "dev")
+
+    listener.on_chat_message({"role": "user", "content": "Which rsync flags?"})
+    listener.on_chat_message(
+        {"role": "assistant", "content": "Use `rsync -avz --delete` to mirror."}
+    )
+    first = listener.conversation_id
+    listener.on_chat_clear()
+    listener.on_chat_message({"role": "user", "content": "How do I sync clocks?"})
+    assert listener.conversation_id != first
+
+    hits = archive.search("rsync delete")
+    assert [(hit.conversation_id, hit.role) for hit in hits] == [(first, "assistant")]
+    assert highlighted(hits[0].snippet).plain == (
+        "Use `rsync -avz --delete` to mirror."
+    )
+    # Stemmed, and FTS5 syntax in the query is matched literally
+    assert len(archive.search("mirroring")) == 1
+    assert archive.search('"rsync" OR clocks') == []
+
+    assert archive.conversation(first) == [
+        {"role": "user", "content": "Which rsync flags?"},
+        {"role": "assistant", "content": "Use `rsync -avz --delete` to mirror."},
+    ]
+
+    console = Console(record=True, width=80)
+    print_search_results(hits, console)
+    assert f"#{first}" in console.export_text()
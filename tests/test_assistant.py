@@ -1,5 +1,31 @@
+import threading
+import time
+from typing import List
+from unittest import mock
+
+import httpx
 import pytest
-from gptcli.assistant import AssistantGlobalArgs, init_assistant
+from gptcli.assistant import (
+    Assistant,
+    AssistantGlobalArgs,
+    get_completion_provider,
+    init_assistant,
+)
+from gptcli.completion import (
+    CancellationToken,
+    CompletionProvider,
+    CompletionTimeoutError,
+    Message,
+    MessageDeltaEvent,
+    ToolCallEvent,
+    ToolRequestEvent,
+    UsageEvent,
+    http_timeout,
+)
+from gptcli.pricing import estimate_usage
+from gptcli.providers.anthropic import AnthropicCompletionProvider, map_messages
+from gptcli.providers.openai import response_format
+from gptcli.tools import Tool, ToolExecutor
 
 
 @pytest.mark.parametrize(
@@ -71,3 +97,282 @@ def test_init_assistant(args, custom_assistants, expected_config):
     assert assistant.config.get("model") == expected_config.get("model")
     assert assistant.config.get("temperature") == expected_config.get("temperature")
     assert assistant.config.get("top_p") == expected_config.get("top_p")
+
+
+def test_timeouts():
+    assistant = Assistant({"model": "gpt-4o", "timeouts": {"idle": 300}})
+
+    args = assistant._args("gpt-4o", stream=True)
+    assert args["connect_timeout"] == 10.0
+    assert args["read_timeout"] == 300
+
+    # Without watchdog limits, streams keep the SDK's read timeout
+    args = Assistant({"model": "o3"})._args("o3", stream=True)
+    assert args["connect_timeout"] == 10.0
+    assert "read_timeout" not in args
+
+    # Without streaming, the whole response arrives at once, so only the connect
+    # timeout applies
+    args = assistant._args("gpt-4o", stream=False)
+    assert "read_timeout" not in args
+
+    timeout = http_timeout(args, httpx.Timeout(600, connect=5.0))
+    assert timeout is not None
+    assert timeout.connect == 10.0 and timeout.read == 600
+
+
+class FlakyProvider(CompletionProvider):
+    """
+    Fails mid-stream on the first request, and completes the response on the next.
+    """
+
+    def __init__(self):
+        self.requests: List[List[Message]] = []
+
+    def complete(self, messages, args, stream=False, cancel=None):
+        self.requests.append(messages)
+        if len(self.requests) == 1:
+            yield MessageDeltaEvent("Hello, ")
+            raise CompletionTimeoutError("Response stalled", "idle")
+        yield MessageDeltaEvent(" world")
+        yield UsageEvent(
+            prompt_tokens=20, completion_tokens=2, total_tokens=22, cost=0.5
+        )
+
+
+def test_interrupted_response_is_continued():
+    assistant = Assistant({"model": "gpt-4o", "resume_attempts": 2})
+    provider = FlakyProvider()
+    messages: List[Message] = [{"role": "user", "content": "Say hello"}]
+
+    with mock.patch("gptcli.assistant.get_completion_provider", return_value=provider):
+        events = list(assistant.complete_chat(messages))
+
+    text = "".join(e.text for e in events if isinstance(e, MessageDeltaEvent))
+    assert text == "Hello, world"
+
+    continuation = provider.requests[1]
+    assert continuation[:-2] == messages
+    assert continuation[-2] == {"role": "assistant", "content": "Hello, "}
+    assert continuation[-1]["role"] == "user"
+
+    # The usage of the interrupted attempt is estimated and added
+    usage = events[-1]
+    assert isinstance(usage, UsageEvent)
+    assert usage.prompt_tokens > 20
+    assert usage.cost > 0.5
+
+
+def test_cancelled_usage_after_a_resume():
+    assistant = Assistant({"model": "gpt-4o", "resume_attempts": 2})
+    provider = FlakyProvider()
+    messages: List[Message] = [{"role": "user", "content": "Say hello"}]
+    cancel = CancellationToken()
+
+    with mock.patch("gptcli.assistant.get_completion_provider", return_value=provider):
+        for event in assistant.complete_chat(messages, cancel=cancel):
+            if event == MessageDeltaEvent("world"):
+                cancel.cancel()
+                break
+
+    # The interrupted attempt was already estimated, only the continuation is left
+    usage = assistant.cancelled_usage()
+    assert usage is not None
+    assert usage == estimate_usage("gpt-4o", provider.requests[1], " world")
+
+
+class StreamingProvider(CompletionProvider):
+    def __init__(self):
+        self.resume = threading.Event()
+
+    def complete(self, messages, args, stream=False, cancel=None):
+        yield MessageDeltaEvent("a")
+        self.resume.wait()
+        yield MessageDeltaEvent("b")
+        yield MessageDeltaEvent("c")
+
+
+def test_batch_deltas():
+    assistant = Assistant({"model": "gpt-4o"})
+    messages: List[Message] = [{"role": "user", "content": "Hi"}]
+
+    provider = StreamingProvider()
+
+    with mock.patch("gptcli.assistant.get_completion_provider", return_value=provider):
+        completion_iter = iter(assistant.complete_chat(messages, batch_deltas=True))
+        first = next(completion_iter)
+        # Let the reader thread queue up the rest
+        provider.resume.set()
+        time.sleep(0.1)
+        events = [first, *completion_iter]
+
+    assert [e.text for e in events] == ["a", "bc"]
+    stats = assistant.last_pipeline_stats
+    assert stats is not None
+    assert stats.events == 3 and stats.batches == 2
+
+
+def test_streams_are_only_piped_when_needed():
+    messages: List[Message] = [{"role": "user", "content": "Hi"}]
+    provider = StreamingProvider()
+    provider.resume.set()
+
+    with mock.patch("gptcli.assistant.get_completion_provider", return_value=provider):
+        # Read on the caller's thread, without a watchdog
+        assistant = Assistant({"model": "gpt-4o"})
+        assert [e.text for e in assistant.complete_chat(messages)] == ["a", "b", "c"]
+        assert assistant.last_pipeline_stats is None
+
+        assistant = Assistant({"model": "gpt-4o", "timeouts": {"idle": 60}})
+        assert [e.text for e in assistant.complete_chat(messages)] == ["a", "b", "c"]
+        assert assistant.last_pipeline_stats is not None
+
+
+def test_anthropic_continuation_prefills_the_response():
+    messages: List[Message] = [{"role": "user", "content": "Say hello"}]
+    continuation = AnthropicCompletionProvider().continuation_messages(
+        messages, "Hello, \n", {"model": "claude-3-5-sonnet"}
+    )
+    assert continuation == messages + [{"role": "assistant", "content": "Hello,"}]
+
+
+def test_completion_providers_are_shared():
+    with (
+        mock.patch("gptcli.assistant._providers", {}),
+        mock.patch(
+            "gptcli.assistant.create_completion_provider",
+            side_effect=lambda *args: mock.MagicMock(),
+        ),
+    ):
+        provider = get_completion_provider("claude-3-7-sonnet")
+        assert get_completion_provider("claude-3-5-haiku") is provider
+        assert get_completion_provider("gpt-4o") is not provider
+        assert get_completion_provider("gpt-4o", "http://localhost") is not (
+            get_completion_provider("gpt-4o")
+        )
+
+
+def test_prewarm_skips_recently_used_connections():
+    assistant = Assistant(
+        {"model": "gpt-4o", "models": ["gpt-4o-mini", "claude-3-5-haiku"]}
+    )
+    openai_provider = mock.MagicMock()
+    anthropic_provider = mock.MagicMock()
+
+    def provider(model, *args):
+        return anthropic_provider if model.startswith("claude") else openai_provider
+
+    with mock.patch("gptcli.assistant.get_completion_provider", side_effect=provider):
+        thread = assistant.prewarm()
+        assert thread is not None
+        thread.join()
+        # Each endpoint is warmed once, even if several models share it
+        openai_provider.prewarm.assert_called_once_with(10.0)
+        anthropic_provider.prewarm.assert_called_once_with(10.0)
+
+        # Until the connections may have gone idle
+        assert assistant.prewarm() is None
+        with mock.patch("gptcli.assistant.time.monotonic", return_value=1e9):
+            thread = assistant.prewarm()
+        assert thread is not None
+        thread.join()
+        assert openai_provider.prewarm.call_count == 2
+
+
+def test_prewarm_failures_are_ignored():
+    assistant = Assistant({"model": "gpt-4o"})
+    provider = mock.MagicMock()
+    provider.prewarm.side_effect = httpx.ConnectError("unreachable")
+
+    with mock.patch("gptcli.assistant.get_completion_provider", return_value=provider):
+        thread = assistant.prewarm()
+        assert thread is not None
+        thread.join()
+    provider.prewarm.assert_called_once()
+
+
+class ToolCallingProvider(CompletionProvider):
+    """
+    Calls the `echo` tool twice, then answers with the outputs.
+    """
+
+    def __init__(self):
+        self.requests: List[List[Message]] = []
+
+    def complete(self, messages, args, stream=False, cancel=None):
+        self.requests.append(messages)
+        assert args["tools"][0]["name"] == "echo"
+        if messages[-1]["role"] == "user":
+            yield MessageDeltaEvent("Let me check.")
+            for i in range(2):
+                call = {"id": str(i), "name": "echo", "arguments": {"text": f"#{i}"}}
+                yield ToolRequestEvent(call)
+        else:
+            yield MessageDeltaEvent(" ".join(m["content"] for m in messages[-2:]))
+        yield UsageEvent(prompt_tokens=10, completion_tokens=5, total_tokens=15, cost=1)
+
+
+def test_tool_calls_are_run_and_sent_back():
+    assistant = Assistant({"model": "gpt-4o"})
+    assistant.tools = ToolExecutor([Tool("echo", {"command": "printf %s {text}"})])
+    provider = ToolCallingProvider()
+    messages: List[Message] = [{"role": "user", "content": "Echo twice"}]
+
+    with mock.patch("gptcli.assistant.get_completion_provider", return_value=provider):
+        events = list(assistant.complete_chat(messages, stream=False))
+
+    text = "".join(e.text for e in events if isinstance(e, MessageDeltaEvent))
+    assert text == "Let me check.\n\n#0 #1"
+
+    tool_events = [e for e in events if isinstance(e, ToolCallEvent)]
+    assert [e.text for e in tool_events[:2]] == [
+        'Calling echo(text="#0")...',
+        'Calling echo(text="#1")...',
+    ]
+    assert all(e.latency is not None for e in tool_events[2:])
+
+    (_, followup) = provider.requests
+    assert followup[1] == {
+        "role": "assistant",
+        "content": "Let me check.",
+        "tool_calls": [
+            {"id": "0", "name": "echo", "arguments": {"text": "#0"}},
+            {"id": "1", "name": "echo", "arguments": {"text": "#1"}},
+        ],
+    }
+    assert [m["tool_call_id"] for m in followup[2:]] == ["0", "1"]
+
+    # A single usage event for both requests
+    usage = events[-1]
+    assert isinstance(usage, UsageEvent) and usage.total_tokens == 30
+
+
+def test_anthropic_tool_messages():
+    mapped = map_messages(
+        [
+            {"role": "user", "content": "Echo"},
+            {
+                "role": "assistant",
+                "content": "",
+                "tool_calls": [{"id": "a", "name": "echo", "arguments": {}}],
+            },
+            {"role": "tool", "content": "x", "tool_call_id": "a", "name": "echo"},
+            {"role": "tool", "content": "y", "tool_call_id": "b", "name": "echo"},
+        ]
+    )
+    assert mapped[1] == {
+        "role": "assistant",
+        "content": [{"type": "tool_use", "id": "a", "name": "echo", "input": {}}],
+    }
+    # The outputs of consecutive calls are sent in one message
+    assert [block["content"] for block in mapped[2]["content"]] == ["x", "y"]
+    assert len(mapped) == 3
+
+
+def test_openai_empty_schema_uses_a_permissive_json_schema():
+    assert response_format({}) == {
+        "type": "json_schema",
+        "name": "response",
+        "schema": {"type": "object"},
+        "strict": False,
+    }
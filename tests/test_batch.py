@@ -0,0 +1,91 @@
+import os
+from unittest import mock
+
+from gptcli.batch import DONE, FAILED, SKIPPED, FileMapper, mirrored_path
+from gptcli.completion import CompletionError, MessageDeltaEvent
+
+
+def make_assistant():
+    assistant = mock.MagicMock()
+    assistant.init_messages.side_effect = lambda: [
+        {"role": "system", "content": "system"}
+    ]
+    assistant.config = {"model": "gpt-4o"}
+
+    def complete_chat(messages, stream):
+        content = messages[-1]["content"]
+        if "broken" in content:
+            raise CompletionError("overloaded")
+        return [MessageDeltaEvent(content.upper())]
+
+    assistant.complete_chat.side_effect = complete_chat
+    return assistant
+
+
+def test_mirrored_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert mirrored_path("out", "src/a.py", ".md") == os.path.join(
+        "out", "src", "a.py.md"
+    )
+    assert mirrored_path("out", "/etc/hosts") == os.path.join("out", "etc", "hosts")
+
+
+def test_file_mapper(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("src/pkg")
+    with open("src/a.py", "w") as f:
+        f.write("a = 1")
+    with open("src/pkg/b.py", "w") as f:
+        f.write("b = 2")
+    with open("src/pkg/c.py", "w") as f:
+        f.write("broken")
+
+    assistant = make_assistant()
+
+    def run(template="Review {path}:"):
+        mapper = FileMapper(assistant, template, "out", parallelism=2, progress=None)
+        return mapper.run(["src/**/*.py"])
+
+    assert run() == {DONE: 2, SKIPPED: 0, FAILED: 1}
+    with open("out/src/pkg/b.py") as f:
+        assert f.read() == "REVIEW SRC/PKG/B.PY:\n\nB = 2"
+
+    # Only the failed file is retried
+    assistant.complete_chat.reset_mock()
+    assert run() == {DONE: 0, SKIPPED: 2, FAILED: 1}
+    assert assistant.complete_chat.call_count == 1
+
+    # Changed files and prompts are processed again
+    with open("src/a.py", "w") as f:
+        f.write("a = 3")
+    assert run() == {DONE: 1, SKIPPED: 1, FAILED: 1}
+    assert run("Summarize:") == {DONE: 2, SKIPPED: 0, FAILED: 1}
+
+
+def test_file_errors_only_fail_that_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("src")
+    with open("src/a.txt", "w") as f:
+        f.write("a")
+    with open("src/b.txt", "w") as f:
+        f.write("b")
+
+    assistant = make_assistant()
+
+    def complete_chat(messages, stream):
+        if messages[-1]["content"].endswith("b"):
+            # A provider error that isn't mapped to a CompletionError
+            raise RuntimeError("connection reset")
+        return [MessageDeltaEvent("ok")]
+
+    assistant.complete_chat.side_effect = complete_chat
+    mapper = FileMapper(assistant, "Review:", "out", parallelism=2, progress=None)
+    with mock.patch(
+        "gptcli.batch.expand_globs",
+        return_value=iter(["src/a.txt", "src/b.txt", "src/missing.txt"]),
+    ):
+        assert mapper.run(["src/*"]) == {DONE: 1, SKIPPED: 0, FAILED: 2}
+
+    entries = mapper.manifest.entries
+    assert entries[os.path.join("src", "b.txt")]["error"] == "connection reset"
+    assert entries[os.path.join("src", "missing.txt")]["status"] == FAILED
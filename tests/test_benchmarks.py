@@ -0,0 +1,11 @@
+import pytest
+
+from benchmarks.session_loop import run
+
+
+@pytest.mark.parametrize(
+    "pipeline,batch_deltas", [(False, False), (True, False), (True, True)]
+)
+def test_session_loop_benchmark(pipeline, batch_deltas):
+    # Runs the benchmark for a few tokens so it keeps up with ChatSession's API
+    assert run(10, "tok ", pipeline, batch_deltas) >= 0
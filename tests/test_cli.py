@@ -0,0 +1,149 @@
+import threading
+import time
+from io import StringIO
+from unittest import mock
+
+from prompt_toolkit.history import InMemoryHistory
+from prompt_toolkit.keys import Keys
+from rich.console import Console
+
+from gptcli.cli import (
+    LARGE_PASTE_CHARS,
+    CLIUserInputProvider,
+    StreamingMarkdownPrinter,
+)
+
+
+def make_console():
+    return Console(file=StringIO(), force_terminal=False, width=80)
+
+
+def test_printer_coalesces_tokens():
+    console = make_console()
+    printer = StreamingMarkdownPrinter(console, markdown=False, max_fps=10)
+
+    with mock.patch.object(console, "print", wraps=console.print) as print_mock:
+        with printer:
+            for token in ["a", "b", "c", "d"]:
+                printer.print(token)
+
+    # The first token is drawn immediately, the rest are coalesced until exit
+    printed = [c.args[0].plain for c in print_mock.call_args_list if c.args]
+    assert printed == ["a", "bcd"]
+    assert console.file.getvalue() == "abcd\n"
+
+
+def test_printer_without_limit_draws_every_token():
+    console = make_console()
+    printer = StreamingMarkdownPrinter(console, markdown=False, max_fps=None)
+
+    with mock.patch.object(console, "print", wraps=console.print) as print_mock:
+        with printer:
+            for token in ["a", "b", "c"]:
+                printer.print(token)
+
+    printed = [c.args[0].plain for c in print_mock.call_args_list if c.args]
+    assert printed == ["a", "b", "c"]
+
+
+def test_printer_draws_pending_text_after_the_interval():
+    console = make_console()
+    printer = StreamingMarkdownPrinter(console, markdown=False, max_fps=20)
+
+    with printer:
+        printer.print("a")
+        printer.print("b")
+        assert console.file.getvalue() == "a"
+        # The stream pauses, the pending text is drawn anyway
+        time.sleep(0.2)
+        assert console.file.getvalue() == "ab"
+
+
+def test_printer_uses_a_single_refresher_thread():
+    console = make_console()
+    printer = StreamingMarkdownPrinter(console, markdown=False, max_fps=50)
+
+    def refreshers():
+        return [t for t in threading.enumerate() if t.name == "gptcli-refresher"]
+
+    with printer:
+        for token in "abcdef":
+            printer.print(token)
+            printer.print(token)
+            time.sleep(0.03)
+        assert refreshers() == [printer.refresher]
+        time.sleep(0.05)
+        assert console.file.getvalue() == "aabbccddeeff"
+
+    assert printer.refresher is not None
+    assert not printer.refresher.is_alive()
+
+
+def test_printer_flushes_on_interrupt():
+    console = make_console()
+    printer = StreamingMarkdownPrinter(console, markdown=False, max_fps=1)
+
+    try:
+        with printer:
+            printer.print("a")
+            printer.print("b")
+            raise KeyboardInterrupt
+    except KeyboardInterrupt:
+        pass
+
+    assert console.file.getvalue() == "ab\n"
+
+
+def make_input_provider(inputs):
+    provider = CLIUserInputProvider(InMemoryHistory())
+    defaults = []
+
+    def prompt(*args, default="", **kwargs):
+        defaults.append(default)
+        return inputs.pop(0).replace("{default}", default)
+
+    provider.prompt_session = mock.MagicMock()
+    provider.prompt_session.prompt.side_effect = prompt
+    return provider, defaults
+
+
+def test_typing_is_reported():
+    on_typing = mock.MagicMock()
+    provider = CLIUserInputProvider(InMemoryHistory(), on_typing=on_typing)
+    provider.prompt_session.default_buffer.on_text_changed.fire()
+    provider.prompt_session.default_buffer.on_text_changed.fire()
+    assert on_typing.call_count == 2
+
+
+def test_file_is_attached_to_the_next_message(tmp_path):
+    path = tmp_path / "app.log"
+    path.write_text("error: disk full\n")
+    provider, defaults = make_input_provider(
+        [f":file {path}", "{default}what's wrong?"]
+    )
+
+    assert provider.get_user_input() == "error: disk full\n what's wrong?"
+    placeholder = defaults[1]
+    assert placeholder.startswith(f"[file {path}: 2 lines, 17 B, sha256:")
+
+
+def test_large_paste_is_kept_out_of_the_input_line():
+    provider, _ = make_input_provider([])
+    provider.prompt_session = mock.MagicMock()
+    provider.prompt()
+    bindings = provider.prompt_session.prompt.call_args.kwargs["key_bindings"]
+    (paste_binding,) = bindings.get_bindings_for_keys((Keys.BracketedPaste,))
+
+    content = "x" * (LARGE_PASTE_CHARS + 1)
+    event = mock.MagicMock(data=content)
+    paste_binding.handler(event)
+
+    (placeholder,) = event.current_buffer.insert_text.call_args.args
+    assert placeholder.startswith("[paste: 1 lines, 9.8 KB, sha256:")
+    assert provider._expand_attachments(f"{placeholder} summarize") == (
+        content + " summarize"
+    )
+
+    event = mock.MagicMock(data="short\r\npaste")
+    paste_binding.handler(event)
+    event.current_buffer.insert_text.assert_called_once_with("short\npaste")
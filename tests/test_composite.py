@@ -0,0 +1,37 @@
+from unittest import mock
+
+from gptcli.composite import BackgroundChatListener
+
+
+def test_background_listener_delivers_events_in_order():
+    wrapped = mock.MagicMock()
+    listener = BackgroundChatListener(wrapped)
+
+    listener.on_chat_start()
+    with listener.response_streamer() as stream:
+        stream.on_next_token("a")
+        stream.on_next_token("b")
+    listener.on_chat_response([], {"role": "assistant", "content": "ab"}, None)
+
+    # on_chat_response waits for the queue to drain
+    streamer = wrapped.response_streamer.return_value
+    streamer.on_next_token.assert_has_calls([mock.call("a"), mock.call("b")])
+    streamer.__exit__.assert_called_once()
+    wrapped.on_chat_response.assert_called_once()
+
+    listener.on_chat_end()
+    wrapped.on_chat_end.assert_called_once()
+    assert not listener.dispatcher.thread.is_alive()
+
+
+def test_background_listener_isolates_errors():
+    wrapped = mock.MagicMock()
+    wrapped.on_chat_message.side_effect = ValueError("listener error")
+    listener = BackgroundChatListener(wrapped)
+
+    listener.on_chat_message({"role": "user", "content": "a"})
+    listener.on_chat_message({"role": "user", "content": "b"})
+    listener.on_chat_end()
+
+    assert wrapped.on_chat_message.call_count == 2
+    wrapped.on_chat_end.assert_called_once()
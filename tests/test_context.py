@@ -0,0 +1,71 @@
+import os
+
+from gptcli.context import ContextIndex, terms, walk_files
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def test_terms():
+    assert terms("def getUserNames(user_id):") == [
+        "def",
+        "get",
+        "user",
+        "name",
+        "user",
+        "id",
+    ]
+
+
+def test_walk_files_respects_gitignore(tmp_path):
+    root = str(tmp_path)
+    write(f"{root}/.gitignore", "*.log\nbuild/\n/local.py\n")
+    write(f"{root}/app.py", "")
+    write(f"{root}/local.py", "")
+    write(f"{root}/debug.log", "")
+    write(f"{root}/build/out.py", "")
+    write(f"{root}/src/local.py", "")
+    write(f"{root}/src/.gitignore", "*.tmp\n!keep.tmp\n")
+    write(f"{root}/src/scratch.tmp", "")
+    write(f"{root}/src/keep.tmp", "")
+    write(f"{root}/.git/config", "")
+
+    files = [os.path.relpath(path, root) for path in walk_files([root])]
+    assert files == [
+        ".gitignore",
+        "app.py",
+        os.path.join("src", ".gitignore"),
+        os.path.join("src", "keep.tmp"),
+        os.path.join("src", "local.py"),
+    ]
+
+
+def test_context_index(tmp_path):
+    root = str(tmp_path)
+    write(f"{root}/auth.py", "def check_password(user, password):\n    pass\n")
+    write(f"{root}/render.py", "def draw_table(rows):\n    pass\n")
+    write(f"{root}/image.bin", "\0\0\0")
+
+    index = ContextIndex([root], chunk_lines=1)
+    index.refresh()
+    chunks = index.pack("How is the password checked?", max_tokens=1000)
+    assert [(chunk.path, chunk.start_line) for chunk in chunks] == [
+        (f"{root}/auth.py", 1)
+    ]
+
+    prompt = index.apply("How are tables drawn?", max_tokens=1000)
+    assert "draw_table" in prompt
+    assert "check_password" not in prompt
+    assert prompt.endswith("\n\nHow are tables drawn?")
+    # Nothing fits into a tiny budget
+    assert index.apply("How are tables drawn?", max_tokens=5) == "How are tables drawn?"
+
+    # Unchanged files are not read again
+    auth = index.files[f"{root}/auth.py"]
+    write(f"{root}/render.py", "def draw_chart(points):\n    pass\n")
+    index.refresh()
+    assert index.files[f"{root}/auth.py"] is auth
+    assert "draw_chart" in index.apply("How are charts drawn?", max_tokens=1000)
@@ -0,0 +1,193 @@
+import time
+from typing import List
+from unittest import mock
+
+import pytest
+
+from gptcli.assistant import Assistant
+from gptcli.completion import BadRequestError, CompletionError, MessageDeltaEvent
+from gptcli.failover import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_breaker_trips_and_recovers():
+    clock = FakeClock()
+    breaker = CircuitBreaker(
+        "claude-3-7-sonnet",
+        {"min_requests": 3, "error_rate": 0.5, "cooldown": 10, "probe": False},
+        clock=clock,
+    )
+
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+    clock.now = 10
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # Only a single trial request is let through
+    assert not breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+    clock.now = 20
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.error_rate == 0
+
+
+def test_first_failure_after_a_probe_reopens_the_breaker():
+    clock = FakeClock()
+    probe = mock.MagicMock()
+    breaker = CircuitBreaker(
+        "gpt-4o", {"min_requests": 3, "cooldown": 10}, probe=probe, clock=clock
+    )
+    for _ in range(3):
+        breaker.record_failure()
+    assert breaker.state == OPEN
+
+    clock.now = 10
+    breaker._run_probe()
+    probe.assert_called_once()
+    assert breaker.state == CLOSED
+
+    # The probe only showed that the backend is reachable
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+    clock.now = 20
+    breaker._run_probe()
+    # Once a request succeeded, failures count as usual
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+
+def test_slow_responses_count_as_failures():
+    breaker = CircuitBreaker(
+        "gpt-4o", {"min_requests": 3, "slow_ttft": 5.0, "probe": False}
+    )
+    breaker.record_success(ttft=1.0)
+    breaker.record_success(ttft=10.0)
+    assert breaker.state == CLOSED
+    breaker.record_success(ttft=10.0)
+    assert breaker.state == OPEN
+
+
+def test_breaker_probes_in_background():
+    probe = mock.MagicMock()
+    breaker = CircuitBreaker(
+        "gpt-4o", {"min_requests": 1, "cooldown": 0.01, "probe": True}, probe=probe
+    )
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+    for _ in range(100):
+        if breaker.state == CLOSED:
+            break
+        time.sleep(0.01)
+    probe.assert_called_once()
+    assert breaker.state == CLOSED
+
+
+def make_assistant(responses):
+    """
+    `responses` maps model names to lists of events or exceptions to raise.
+    """
+    assistant = Assistant(
+        {
+            "model": "claude-3-7-sonnet",
+            "fallback_models": ["oai-azure:gpt-4o", "gpt-4o"],
+            "circuit_breaker": {"min_requests": 1, "probe": False},
+        }
+    )
+    requested: List[str] = []
+
+    def complete(messages, args, stream, cancel=None):
+        requested.append(args["model"])
+        for event in responses[args["model"]]:
+            if isinstance(event, Exception):
+                raise event
+            yield event
+
+    provider = mock.MagicMock()
+    provider.complete.side_effect = complete
+    patcher = mock.patch(
+        "gptcli.assistant.get_completion_provider", return_value=provider
+    )
+    return assistant, requested, patcher
+
+
+def test_fails_over_before_the_first_event():
+    assistant, requested, patcher = make_assistant(
+        {
+            "claude-3-7-sonnet": [CompletionError("overloaded")],
+            "oai-azure:gpt-4o": [CompletionError("unavailable")],
+            "gpt-4o": [MessageDeltaEvent("hello")],
+        }
+    )
+    with patcher:
+        events = list(assistant.complete_chat([{"role": "user", "content": "hi"}]))
+        assert events == [MessageDeltaEvent("hello")]
+        assert requested == ["claude-3-7-sonnet", "oai-azure:gpt-4o", "gpt-4o"]
+        assert assistant.active_model() == "gpt-4o"
+
+        # The tripped backends are skipped without sending a request
+        requested.clear()
+        list(assistant.complete_chat([{"role": "user", "content": "hi"}]))
+        assert requested == ["gpt-4o"]
+
+
+def test_no_failover_after_the_first_event():
+    assistant, requested, patcher = make_assistant(
+        {
+            "claude-3-7-sonnet": [MessageDeltaEvent("hel"), CompletionError("reset")],
+            "gpt-4o": [MessageDeltaEvent("hello")],
+        }
+    )
+    with patcher, pytest.raises(CompletionError):
+        list(assistant.complete_chat([{"role": "user", "content": "hi"}]))
+    # The partial response is never failed over
+    assert requested == ["claude-3-7-sonnet"]
+
+
+def test_bad_requests_are_not_failed_over():
+    assistant, requested, patcher = make_assistant(
+        {"claude-3-7-sonnet": [BadRequestError("too long")]}
+    )
+    with patcher, pytest.raises(BadRequestError):
+        list(assistant.complete_chat([{"role": "user", "content": "hi"}]))
+    assert requested == ["claude-3-7-sonnet"]
+
+
+def test_all_backends_failing():
+    assistant, requested, patcher = make_assistant(
+        {
+            "claude-3-7-sonnet": [CompletionError("a")],
+            "oai-azure:gpt-4o": [CompletionError("b")],
+            "gpt-4o": [CompletionError("c")],
+        }
+    )
+    with patcher, pytest.raises(CompletionError, match="All models failed"):
+        list(assistant.complete_chat([{"role": "user", "content": "hi"}]))
+
+
+def test_probe_does_not_send_a_completion():
+    assistant, requested, patcher = make_assistant({})
+    with patcher as get_provider:
+        assistant._probe("gpt-4o")
+    provider = get_provider.return_value
+    provider.prewarm.assert_called_once()
+    provider.complete.assert_not_called()
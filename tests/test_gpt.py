@@ -0,0 +1,16 @@
+from gptcli.config import GptCliConfig
+from gptcli.gpt import find_subcommand, run_search, run_usage
+
+
+def test_subcommands():
+    config = GptCliConfig()
+    assert find_subcommand(config, ["usage", "--days", "7"]) is run_usage
+    assert find_subcommand(config, ["dev"]) is None
+    assert find_subcommand(config, []) is None
+
+
+def test_assistants_take_precedence_over_subcommands():
+    config = GptCliConfig(assistants={"search": {"model": "gpt-4o"}})
+    assert find_subcommand(config, ["search", "query"]) is None
+    assert find_subcommand(config, ["usage"]) is run_usage
+    assert find_subcommand(GptCliConfig(), ["search", "query"]) is run_search
@@ -0,0 +1,40 @@
+from unittest import mock
+
+from prompt_toolkit.history import FileHistory
+
+from gptcli.history import SQLiteHistory
+
+
+def test_most_recent_first_without_duplicates(tmp_path):
+    path = str(tmp_path / "history.db")
+    history = SQLiteHistory(path)
+    for entry in ["first", "second", ":q", "third", "first"]:
+        history.store_string(entry)
+
+    # Concurrent sessions write to the same database
+    SQLiteHistory(path).store_string("other session")
+
+    with mock.patch("gptcli.history.PAGE_SIZE", 2):
+        assert list(history.load_history_strings()) == [
+            "other session",
+            "first",
+            "third",
+            "second",
+        ]
+
+
+def test_imports_file_history(tmp_path):
+    file_history = FileHistory(str(tmp_path / "history"))
+    file_history.store_string("old")
+    file_history.store_string("older\nmultiline")
+    file_history.store_string("old")
+
+    history = SQLiteHistory(
+        str(tmp_path / "history.db"), import_from=str(tmp_path / "history")
+    )
+    assert list(history.load_history_strings()) == ["old", "older\nmultiline"]
+
+    # Only into an empty database
+    history.store_string("new")
+    file_history.store_string("not imported")
+    assert list(history.load_history_strings()) == ["new", "old", "older\nmultiline"]
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from gptcli.jsonstream import JsonItemEvent, JsonStreamParser, load_schema
+
+
+def feed_all(parser, chunks):
+    return [[(item.key, item.value) for item in parser.feed(c)] for c in chunks]
+
+
+def test_array_items_are_emitted_as_they_close():
+    parser = JsonStreamParser()
+    chunks = [
+        '```json\n[{"a": "x]\\"}',
+        '"}, 1',
+        "2, ",
+        '"s,',
+        't", [1, [2]]',
+        "]\n```",
+    ]
+    assert feed_all(parser, chunks) == [
+        [],
+        [(0, {"a": 'x]"}'})],
+        [(1, 12)],
+        [],
+        [(2, "s,t"), (3, [1, [2]])],
+        [],
+    ]
+    assert parser.done
+
+
+def test_object_fields_are_emitted_as_they_close():
+    parser = JsonStreamParser()
+    chunks = ['{"name": "Ann \\\\', '", "n": 1', '0, "tags": ["a"', "]", "}"]
+    assert feed_all(parser, chunks) == [
+        [],
+        [("name", "Ann \\")],
+        [("n", 10)],
+        [("tags", ["a"])],
+        [],
+    ]
+    assert parser.done
+
+
+def test_field_emitted_on_comma():
+    parser = JsonStreamParser()
+    assert feed_all(parser, ['{"n": 1', "0", ', "ok": true}']) == [
+        [],
+        [],
+        [("n", 10), ("ok", True)],
+    ]
+
+
+def test_invalid_member():
+    parser = JsonStreamParser()
+    with pytest.raises(json.JSONDecodeError):
+        parser.feed("[1, nope, 2]")
+
+
+def test_item_json_lines():
+    assert JsonItemEvent("name", "Ann").to_json() == '{"name": "Ann"}'
+    assert JsonItemEvent(0, {"a": 1}).to_json() == '{"a": 1}'
+
+
+def test_load_schema(tmp_path):
+    path = tmp_path / "schema.json"
+    path.write_text('{"type": "array"}')
+    assert load_schema(str(path)) == {"type": "array"}
+    assert load_schema(' {"type": "object"}') == {"type": "object"}
@@ -0,0 +1,94 @@
+import datetime
+import threading
+
+import pytest
+
+from gptcli.assistant import Assistant
+from gptcli.completion import UsageEvent
+from gptcli.config import GptCliConfig
+from gptcli.gpt import init_ledger, ledger_path
+from gptcli.ledger import (
+    DEFAULT_LEDGER_PATH,
+    BudgetExceededError,
+    CostLedger,
+    LedgerAssistantListener,
+)
+
+
+def usage(cost: float) -> UsageEvent:
+    return UsageEvent(prompt_tokens=10, completion_tokens=5, total_tokens=15, cost=cost)
+
+
+def test_rollups(tmp_path):
+    ledger = CostLedger(str(tmp_path / "usage.db"))
+    yesterday = datetime.datetime.now() - datetime.timedelta(days=1)
+    ledger.record("gpt-4o", usage(1.0), "dev", timestamp=yesterday.timestamp())
+    ledger.record("gpt-4o", usage(2.0), "dev")
+    ledger.record("claude-3-haiku", usage(0.5), "general")
+
+    today = datetime.date.today()
+    assert ledger.spend_since(today) == pytest.approx(2.5)
+    assert ledger.spend_since(yesterday.date()) == pytest.approx(3.5)
+
+    by_model = {row["key"]: row for row in ledger.model_rollup(yesterday.date())}
+    assert by_model["gpt-4o"]["requests"] == 2
+    assert by_model["gpt-4o"]["cost"] == pytest.approx(3.0)
+    assert by_model["claude-3-haiku"]["prompt_tokens"] == 10
+
+    by_day = ledger.daily_rollup(yesterday.date())
+    assert [row["key"] for row in by_day] == [
+        yesterday.date().isoformat(),
+        today.isoformat(),
+    ]
+
+
+def test_concurrent_writers(tmp_path):
+    path = str(tmp_path / "usage.db")
+    ledgers = [CostLedger(path) for _ in range(4)]
+
+    def write(ledger):
+        for _ in range(25):
+            ledger.record("gpt-4o", usage(0.01))
+
+    threads = [threading.Thread(target=write, args=(ledger,)) for ledger in ledgers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert ledgers[0].model_rollup(datetime.date.today())[0]["requests"] == 100
+
+
+def test_hard_budget(tmp_path):
+    ledger = CostLedger(str(tmp_path / "usage.db"))
+    listener = LedgerAssistantListener(ledger, "dev", {"daily": 1.0, "mode": "hard"})
+
+    listener.on_request("gpt-4o")
+    listener.on_usage("gpt-4o", usage(1.5))
+    with pytest.raises(BudgetExceededError):
+        listener.on_request("gpt-4o")
+
+
+def test_soft_budget(tmp_path):
+    ledger = CostLedger(str(tmp_path / "usage.db"))
+    listener = LedgerAssistantListener(ledger, "dev", {"monthly": 1.0, "mode": "soft"})
+
+    listener.on_usage("gpt-4o", usage(1.5))
+    listener.on_request("gpt-4o")
+    listener.on_request("gpt-4o")
+    assert len(listener.warned) == 1
+
+
+def test_unusable_ledger_is_skipped(tmp_path):
+    # A directory can't be opened as a database
+    assistant = Assistant({"model": "gpt-4o"})
+    init_ledger(assistant, "dev", GptCliConfig(ledger_file=str(tmp_path)))
+    assert assistant.listeners == []
+
+
+def test_ledger_is_opt_in(tmp_path):
+    assert ledger_path(GptCliConfig()) is None
+    assert ledger_path(GptCliConfig(budget={"daily": 5.0})) == DEFAULT_LEDGER_PATH
+
+    path = str(tmp_path / "usage.db")
+    assert ledger_path(GptCliConfig(ledger_file=path)) == path
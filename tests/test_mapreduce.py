@@ -0,0 +1,65 @@
+import io
+from unittest import mock
+
+from gptcli.completion import MessageDeltaEvent, UsageEvent
+from gptcli.mapreduce import MapReduce, pack_texts, read_lines
+
+
+def test_pack_texts():
+    # 2 tokens are 8 characters
+    assert list(pack_texts(["abc\n", "de\n", "fgh\n", "0123456789ab\n"], 2)) == [
+        "abc\nde\n",
+        "fgh\n",
+        "01234567",
+        "89ab\n",
+    ]
+
+
+def test_read_lines(tmp_path):
+    path = tmp_path / "input.log"
+    path.write_text("first\nsecond\nlast")
+    assert list(read_lines(str(path))) == ["first\n", "second\n", "last"]
+
+    empty = tmp_path / "empty.log"
+    empty.write_text("")
+    assert list(read_lines(str(empty))) == []
+
+
+def test_map_reduce():
+    assistant = mock.MagicMock()
+    assistant.init_messages.side_effect = lambda: []
+    requests = []
+
+    def complete_chat(messages, stream):
+        content = messages[-1]["content"]
+        requests.append(content)
+        answer = "combined" if "Combine" in content else content.splitlines()[-1]
+        return [
+            MessageDeltaEvent(answer),
+            UsageEvent(prompt_tokens=3, completion_tokens=1, total_tokens=4, cost=0.5),
+        ]
+
+    assistant.complete_chat.side_effect = complete_chat
+    progress = io.StringIO()
+    map_reduce = MapReduce(
+        assistant, "Count errors", chunk_tokens=40, parallelism=2, progress=progress
+    )
+
+    lines = [f"line {i:03d} " * 5 + "\n" for i in range(10)]
+    assert map_reduce.run(lines) == "combined"
+
+    map_requests = [r for r in requests if "Combine" not in r]
+    # 3 lines of 46 characters fit into a chunk
+    assert len(map_requests) == 4
+    assert all(r.startswith("Count errors") for r in requests)
+    # Two answers fit into a chunk, so they are combined in two rounds
+    reduce_requests = [r for r in requests if "Combine" in r]
+    assert len(reduce_requests) == 3
+    assert any("Answer for part 4:\n" + lines[9].strip() in r for r in reduce_requests)
+    assert "Answer for part 2:\ncombined" in reduce_requests[-1]
+
+    assert map_reduce.usage is not None
+    assert map_reduce.usage.cost == 3.5
+    report = progress.getvalue().splitlines()
+    assert len(report) == 8
+    assert report[-1] == "Total: 28 tokens, $3.5000"
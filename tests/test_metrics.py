@@ -0,0 +1,88 @@
+import json
+from unittest import mock
+
+import pytest
+
+from gptcli.completion import CompletionError, ToolCallEvent, UsageEvent
+from gptcli.ledger import BudgetExceededError, CostLedger, LedgerAssistantListener
+from gptcli.metrics import Histogram, MetricsChatListener
+from gptcli.session import InvalidArgumentError
+
+
+def setup_listener(tmp_path=None):
+    assistant_mock = mock.MagicMock()
+    assistant_mock.active_model.return_value = "gpt-4o"
+    assistant_mock.last_timing = None
+    export_path = str(tmp_path / "metrics.json") if tmp_path else None
+    return MetricsChatListener(assistant_mock, export_path)
+
+
+def stream_response(listener, tokens):
+    with listener.response_streamer() as stream:
+        stream.on_thinking_token("hmm")
+        stream.on_tool_call(ToolCallEvent("Searching the web..."))
+        for token in tokens:
+            stream.on_next_token(token)
+
+
+def test_budget_refusals_are_not_errors(tmp_path):
+    ledger = CostLedger(str(tmp_path / "usage.db"))
+    ledger_listener = LedgerAssistantListener(ledger, "dev", {"daily": 1.0})
+    ledger_listener.on_usage(
+        "gpt-4o",
+        UsageEvent(prompt_tokens=10, completion_tokens=5, total_tokens=15, cost=1.5),
+    )
+    listener = setup_listener()
+
+    with pytest.raises(BudgetExceededError) as refusal:
+        ledger_listener.on_request("gpt-4o")
+    listener.on_error(refusal.value)
+
+    assert ("openai", "gpt-4o") not in listener.metrics
+
+
+def test_histogram_quantile():
+    hist = Histogram((1.0, 2.0, 5.0))
+    for value in [0.5, 0.5, 1.5, 4.0, 10.0]:
+        hist.observe(value)
+
+    assert hist.counts == [2, 1, 1, 1]
+    assert hist.quantile(0.4) == 1.0
+    assert hist.quantile(0.6) == 2.0
+    assert hist.quantile(1.0) == float("inf")
+
+
+def test_metrics_are_recorded_per_model_and_phase(tmp_path):
+    listener = setup_listener(tmp_path)
+    stream_response(listener, ["a", "b", "c"])
+    usage = UsageEvent(prompt_tokens=10, completion_tokens=3, total_tokens=13, cost=0.0)
+    listener.on_chat_response([], {"role": "assistant", "content": "abc"}, usage)
+
+    metrics = listener.metrics[("openai", "gpt-4o")]
+    assert metrics.requests == 1
+    assert metrics.output_tokens == 3
+    assert metrics.ttft.count == 1
+    assert metrics.latency.count == 1
+    assert metrics.inter_token["message"].count == 2
+    assert metrics.inter_token["thinking"].count == 0
+
+    with open(tmp_path / "metrics.json") as f:
+        exported = json.load(f)
+    assert exported["models"][0]["model"] == "gpt-4o"
+    assert exported["models"][0]["requests"] == 1
+
+
+def test_errors_and_prometheus_export():
+    listener = setup_listener()
+    listener.on_error(CompletionError("error"))
+    listener.on_error(InvalidArgumentError("No such file or directory: src"))
+    stream_response(listener, ["a"])
+    listener.on_chat_response([], {"role": "assistant", "content": "a"}, None)
+
+    text = listener.to_prometheus()
+    assert 'gptcli_errors_total{provider="openai",model="gpt-4o"} 1' in text
+    assert 'gptcli_requests_total{provider="openai",model="gpt-4o"} 1' in text
+    assert (
+        'gptcli_inter_token_seconds_count{provider="openai",model="gpt-4o",phase="message"} 0'
+        in text
+    )
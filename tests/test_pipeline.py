@@ -0,0 +1,173 @@
+import threading
+import time
+
+import pytest
+
+from gptcli.completion import (
+    CancellationToken,
+    CompletionError,
+    CompletionTimeoutError,
+    MessageDeltaEvent,
+    ThinkingDeltaEvent,
+    abort_on_cancel,
+)
+from gptcli.pipeline import CompletionPipeline
+
+
+def test_pipeline_yields_events_in_order():
+    events = [MessageDeltaEvent(str(i)) for i in range(100)]
+    pipeline = CompletionPipeline(iter(events), max_queue_size=4)
+
+    assert list(pipeline) == events
+    assert pipeline.stats.events == 100
+    assert pipeline.stats.max_queue_depth <= 4
+
+
+def test_pipeline_propagates_errors():
+    def completion_iter():
+        yield MessageDeltaEvent("a")
+        raise CompletionError("error")
+
+    pipeline = CompletionPipeline(completion_iter())
+    received = []
+    with pytest.raises(CompletionError):
+        for event in pipeline:
+            received.append(event)
+
+    assert received == [MessageDeltaEvent("a")]
+
+
+def test_pipeline_close_stops_reader():
+    closed = threading.Event()
+
+    def completion_iter():
+        try:
+            while True:
+                yield MessageDeltaEvent("a")
+        finally:
+            closed.set()
+
+    pipeline = CompletionPipeline(completion_iter(), max_queue_size=2)
+    for _ in pipeline:
+        break
+
+    pipeline.thread.join(timeout=1)
+    assert not pipeline.thread.is_alive()
+    assert closed.is_set()
+
+
+def test_pipeline_batches_queued_deltas():
+    events = [
+        MessageDeltaEvent("a"),
+        MessageDeltaEvent("b"),
+        ThinkingDeltaEvent("c"),
+        MessageDeltaEvent("d"),
+        MessageDeltaEvent("e"),
+    ]
+    pipeline = CompletionPipeline(iter(events), batch=True)
+    # Let the reader fill the queue before consuming
+    pipeline.start()
+    pipeline.thread.join(timeout=1)
+
+    assert list(pipeline) == [
+        MessageDeltaEvent("ab"),
+        ThinkingDeltaEvent("c"),
+        MessageDeltaEvent("de"),
+    ]
+    assert pipeline.stats.events == 5
+    assert pipeline.stats.batches == 3
+
+
+def test_watchdog_first_event_timeout():
+    release = threading.Event()
+
+    def completion_iter():
+        release.wait()
+        yield MessageDeltaEvent("late")
+
+    pipeline = CompletionPipeline(completion_iter(), first_event_timeout=0.05)
+    with pytest.raises(CompletionTimeoutError) as error:
+        list(pipeline)
+    release.set()
+
+    assert error.value.phase == "first_token"
+    assert error.value.elapsed is not None and error.value.elapsed >= 0.05
+
+
+def test_watchdog_idle_timeout():
+    release = threading.Event()
+
+    def completion_iter():
+        yield MessageDeltaEvent("a")
+        yield MessageDeltaEvent("b")
+        release.wait()
+        yield MessageDeltaEvent("c")
+
+    pipeline = CompletionPipeline(
+        completion_iter(), first_event_timeout=1.0, idle_timeout=0.05
+    )
+    received = []
+    with pytest.raises(CompletionTimeoutError) as error:
+        for event in pipeline:
+            received.append(event)
+    release.set()
+
+    assert error.value.phase == "idle"
+    assert received == [MessageDeltaEvent("a"), MessageDeltaEvent("b")]
+    assert pipeline.stats.first_event_wait is not None
+
+
+def test_watchdog_does_not_fire_on_a_slow_consumer():
+    pipeline = CompletionPipeline(
+        iter([MessageDeltaEvent("a"), MessageDeltaEvent("b")]), idle_timeout=0.05
+    )
+    received = []
+    for event in pipeline:
+        time.sleep(0.1)
+        received.append(event)
+    assert len(received) == 2
+
+
+def test_cancellation_aborts_the_stream():
+    cancel = CancellationToken()
+    aborted = threading.Event()
+
+    def completion_iter():
+        with abort_on_cancel(cancel, aborted.set):
+            yield MessageDeltaEvent("a")
+            # A blocked read that fails once the stream is aborted
+            aborted.wait()
+            raise ConnectionError("stream closed")
+
+    pipeline = CompletionPipeline(completion_iter())
+    received = []
+    for event in pipeline:
+        received.append(event)
+        cancel.cancel()
+
+    # The error caused by aborting the stream is suppressed
+    assert received == [MessageDeltaEvent("a")]
+    assert aborted.is_set()
+
+
+def test_watchdog_timeout_aborts_the_request():
+    parent = CancellationToken()
+    cancel = parent.child()
+    aborted = threading.Event()
+
+    def completion_iter():
+        with abort_on_cancel(cancel, aborted.set):
+            yield MessageDeltaEvent("a")
+            # A stalled read that only ends once the stream is aborted
+            aborted.wait()
+            raise ConnectionError("stream closed")
+
+    pipeline = CompletionPipeline(completion_iter(), idle_timeout=0.05, cancel=cancel)
+    with pytest.raises(CompletionTimeoutError):
+        list(pipeline)
+
+    assert aborted.wait(1)
+    pipeline.thread.join(1)
+    assert not pipeline.thread.is_alive()
+    # Only the request is aborted, not the turn it belongs to
+    assert not parent.cancelled
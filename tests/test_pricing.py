@@ -0,0 +1,68 @@
+import pytest
+
+from gptcli.completion import UsageEvent
+from gptcli.pricing import DEFAULT_PRICES, PricingRegistry
+
+
+def test_longest_prefix():
+    registry = PricingRegistry(DEFAULT_PRICES)
+
+    mini = registry.pricing("gpt-4o-mini-2024-07-18")
+    assert mini is not None
+    assert mini["prompt"] == pytest.approx(0.150 / 1_000_000)
+
+    gpt_4o = registry.pricing("gpt-4o-2024-08-06")
+    assert gpt_4o is not None
+    assert gpt_4o["prompt"] == pytest.approx(2.50 / 1_000_000)
+
+    assert registry.pricing("unknown-model") is None
+
+
+def test_tiers():
+    registry = PricingRegistry(DEFAULT_PRICES)
+
+    short = registry.pricing("gemini-1.5-pro-002", prompt_tokens=1000)
+    long = registry.pricing("gemini-1.5-pro-002", prompt_tokens=200_000)
+    assert short is not None and long is not None
+    assert short["prompt"] == pytest.approx(1.25 / 1_000_000)
+    assert long["prompt"] == pytest.approx(2.50 / 1_000_000)
+    assert long["response"] == pytest.approx(10.0 / 1_000_000)
+
+
+def test_overrides():
+    registry = PricingRegistry(DEFAULT_PRICES)
+    assert registry.pricing("my-model-v2") is None
+
+    registry.update(
+        {
+            "my-model": {"prompt": 1.0, "response": 2.0},
+            "gpt-4o": {"prompt": 1.0, "response": 1.0},
+        }
+    )
+
+    custom = registry.pricing("my-model-v2")
+    assert custom == {"prompt": 1.0 / 1_000_000, "response": 2.0 / 1_000_000}
+
+    gpt_4o = registry.pricing("gpt-4o")
+    assert gpt_4o is not None
+    assert gpt_4o["prompt"] == pytest.approx(1.0 / 1_000_000)
+    mini = registry.pricing("gpt-4o-mini")
+    assert mini is not None
+    assert mini["prompt"] == pytest.approx(0.150 / 1_000_000)
+
+
+def test_cache_cost():
+    registry = PricingRegistry(DEFAULT_PRICES)
+    pricing = registry.pricing("claude-3-5-sonnet-latest")
+    assert pricing is not None
+
+    usage = UsageEvent.with_pricing(
+        prompt_tokens=1_000_000,
+        completion_tokens=0,
+        total_tokens=1_000_000,
+        pricing=pricing,
+        cache_read_tokens=500_000,
+        cache_write_tokens=100_000,
+    )
+    # 400k uncached at $3, 500k read at $0.30, 100k written at $3.75
+    assert usage.cost == pytest.approx(1.2 + 0.15 + 0.375)
@@ -0,0 +1,24 @@
+import pstats
+import threading
+
+from gptcli.profiling import PER_THREAD_PROFILES, SessionProfiler
+
+
+def read_stream():
+    return sum(range(1000))
+
+
+def test_background_threads_are_profiled(tmp_path):
+    prefix = str(tmp_path / "profile")
+    with SessionProfiler(prefix):
+        thread = threading.Thread(target=read_stream, name="gptcli-reader")
+        thread.start()
+        thread.join()
+
+    functions = {name for _, _, name in pstats.Stats(f"{prefix}.pstats").stats}  # type: ignore
+    assert "read_stream" in functions
+    if PER_THREAD_PROFILES:
+        with open(f"{prefix}.txt") as f:
+            assert f.readline().startswith(
+                "Profiled the main thread and 1 other threads"
+            )
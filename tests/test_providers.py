@@ -0,0 +1,114 @@
+import json
+import threading
+from unittest import mock
+
+import httpx
+import pytest
+
+from gptcli.completion import (
+    CancellationToken,
+    CompletionTimeoutError,
+    MessageDeltaEvent,
+)
+from gptcli.pipeline import CompletionPipeline
+from gptcli.providers.cohere import CohereCompletionProvider
+from gptcli.providers.google import GoogleCompletionProvider
+
+
+class StalledStream(httpx.SyncByteStream):
+    """
+    A response body that sends its first chunk, then stalls until it's closed.
+    """
+
+    def __init__(self, chunk: bytes):
+        self.chunk = chunk
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        yield self.chunk
+        self.closed.wait()
+
+    def close(self):
+        self.closed.set()
+
+
+def stalled_transport(chunk: bytes, timeouts: list) -> httpx.MockTransport:
+    def handle(request):
+        timeouts.append(request.extensions["timeout"])
+        return httpx.Response(200, stream=StalledStream(chunk))
+
+    return httpx.MockTransport(handle)
+
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+ARGS = {"model": "model", "connect_timeout": 5.0, "read_timeout": 60.0}
+
+
+def assert_cancel_aborts_the_stream(provider):
+    cancel = CancellationToken()
+    received = []
+    first_event = threading.Event()
+
+    def run():
+        for event in provider.complete(MESSAGES, ARGS, stream=True, cancel=cancel):
+            received.append(event)
+            first_event.set()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    assert first_event.wait(5)
+
+    # The thread is now blocked reading the stalled stream
+    cancel.cancel()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert received == [MessageDeltaEvent("a")]
+
+
+def assert_watchdog_aborts_the_stream(provider):
+    cancel = CancellationToken()
+    pipeline = CompletionPipeline(
+        provider.complete(MESSAGES, ARGS, stream=True, cancel=cancel),
+        idle_timeout=0.1,
+        cancel=cancel,
+    )
+    with pytest.raises(CompletionTimeoutError):
+        list(pipeline)
+
+    pipeline.thread.join(5)
+    assert not pipeline.thread.is_alive()
+
+
+def gemini_provider(timeouts: list) -> GoogleCompletionProvider:
+    with mock.patch("gptcli.providers.google.api_key", "key"):
+        provider = GoogleCompletionProvider()
+        client = provider._client()
+    chunk = {"candidates": [{"content": {"role": "model", "parts": [{"text": "a"}]}}]}
+    client._api_client._httpx_client._transport = stalled_transport(
+        f"data: {json.dumps(chunk)}\n\n".encode(), timeouts
+    )
+    return provider
+
+
+def cohere_provider(timeouts: list) -> CohereCompletionProvider:
+    with mock.patch("gptcli.providers.cohere.api_key", "key"):
+        provider = CohereCompletionProvider()
+    chunk = {"event_type": "text-generation", "text": "a", "is_finished": False}
+    provider.http_client._transport = stalled_transport(
+        f"{json.dumps(chunk)}\n".encode(), timeouts
+    )
+    return provider
+
+
+@pytest.mark.parametrize("make_provider", [gemini_provider, cohere_provider])
+def test_cancel_aborts_a_stalled_stream(make_provider):
+    timeouts: list = []
+    assert_cancel_aborts_the_stream(make_provider(timeouts))
+
+    # The SDKs only take a single timeout, the args set both
+    assert [(t["connect"], t["read"]) for t in timeouts] == [(5.0, 60.0)]
+
+
+@pytest.mark.parametrize("make_provider", [gemini_provider, cohere_provider])
+def test_watchdog_aborts_a_stalled_stream(make_provider):
+    assert_watchdog_aborts_the_stream(make_provider([]))
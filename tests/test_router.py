@@ -0,0 +1,95 @@
+from unittest import mock
+
+from gptcli.assistant import Assistant, AssistantGlobalArgs, init_assistant
+from gptcli.completion import MessageDeltaEvent
+from gptcli.router import ModelRouter, is_simple_prompt
+
+MODELS = ["gpt-4.1-nano", "gpt-4.1-mini", "gpt-4.1"]
+LIMITS = {"gpt-4.1-nano": 100, "gpt-4.1-mini": 1000}
+
+
+def prompt(length: int):
+    return [{"role": "user", "content": "a" * (length * 4)}]
+
+
+def test_length_policy():
+    router = ModelRouter(
+        "gpt-4.1", MODELS, {"policy": "length", "max_prompt_tokens": LIMITS}
+    )
+    assert router.choose(prompt(10)) == "gpt-4.1-nano"
+    assert router.choose(prompt(500)) == "gpt-4.1-mini"
+    assert router.choose(prompt(5000)) == "gpt-4.1"
+
+
+def test_cheapest_policy():
+    router = ModelRouter(
+        "gpt-4.1", list(reversed(MODELS)), {"max_prompt_tokens": LIMITS}
+    )
+    assert router.choose(prompt(10)) == "gpt-4.1-nano"
+    assert router.choose(prompt(500)) == "gpt-4.1-mini"
+
+
+def test_fastest_policy():
+    router = ModelRouter("gpt-4.1", MODELS, {"policy": "fastest"})
+    # Unmeasured models are tried first
+    assert router.choose(prompt(10)) == "gpt-4.1-nano"
+    router.record_ttft("gpt-4.1-nano", 2.0)
+    assert router.choose(prompt(10)) == "gpt-4.1-mini"
+    router.record_ttft("gpt-4.1-mini", 0.5)
+    router.record_ttft("gpt-4.1", 1.0)
+    assert router.choose(prompt(10)) == "gpt-4.1-mini"
+
+    for _ in range(10):
+        router.record_ttft("gpt-4.1-mini", 3.0)
+    assert router.choose(prompt(10)) == "gpt-4.1"
+
+
+def test_classifier_policy():
+    assert is_simple_prompt([{"role": "user", "content": "capital of France?"}])
+    assert not is_simple_prompt(
+        [{"role": "user", "content": "Explain how the GIL works"}]
+    )
+    assert not is_simple_prompt([{"role": "user", "content": "```\nfoo()\n```"}])
+
+    router = ModelRouter("gpt-4.1", MODELS, {"policy": "classifier"})
+    assert router.choose([{"role": "user", "content": "hi"}]) == "gpt-4.1-nano"
+    assert (
+        router.choose([{"role": "user", "content": "Refactor this module"}])
+        == "gpt-4.1"
+    )
+
+
+def test_assistant_routes_each_turn():
+    assistant = Assistant(
+        {
+            "model": "gpt-4.1",
+            "models": MODELS,
+            "routing": {"policy": "length", "max_prompt_tokens": LIMITS},
+        }
+    )
+    provider = mock.MagicMock()
+    provider.complete.return_value = iter([MessageDeltaEvent("ok")])
+
+    with mock.patch(
+        "gptcli.assistant.get_completion_provider", return_value=provider
+    ) as get_provider:
+        list(assistant.complete_chat(prompt(10)))
+        assert get_provider.call_args.args[0] == "gpt-4.1-nano"
+        assert assistant.active_model() == "gpt-4.1-nano"
+
+        provider.complete.return_value = iter([MessageDeltaEvent("ok")])
+        list(assistant.complete_chat(prompt(5000)))
+        assert provider.complete.call_args.args[1]["model"] == "gpt-4.1"
+        assert assistant.active_model() == "gpt-4.1"
+
+    assert assistant.router is not None
+    assert "gpt-4.1" in assistant.router.ttft
+
+
+def test_model_argument_disables_routing():
+    assistant = init_assistant(
+        AssistantGlobalArgs("custom", model="gpt-4o"),
+        {"custom": {"model": "gpt-4.1", "models": MODELS}},
+    )
+    assert assistant.router is None
+    assert assistant.choose_model(prompt(10)) == "gpt-4o"
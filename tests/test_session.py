@@ -1,5 +1,13 @@
+import threading
 from unittest import mock
-from gptcli.completion import CompletionError, BadRequestError, MessageDeltaEvent
+
+import pytest
+from gptcli.completion import (
+    CompletionError,
+    BadRequestError,
+    MessageDeltaEvent,
+    UsageEvent,
+)
 from gptcli.session import ChatSession
 
 system_message = {"role": "system", "content": "system message"}
@@ -42,6 +50,8 @@ def test_simple_input():
     assistant_mock.complete_chat.assert_called_once_with(
         [system_message, user_message],
         stream=True,
+        cancel=mock.ANY,
+        batch_deltas=False,
     )
     listener_mock.on_chat_message.assert_has_calls(
         [mock.call(user_message), mock.call(assistant_message)]
@@ -68,6 +78,8 @@ def test_clear():
     assistant_mock.complete_chat.assert_called_once_with(
         [system_message, {"role": "user", "content": "user_message"}],
         stream=True,
+        cancel=mock.ANY,
+        batch_deltas=False,
     )
     listener_mock.on_chat_message.assert_has_calls(
         [
@@ -95,6 +107,8 @@ def test_clear():
     assistant_mock.complete_chat.assert_called_once_with(
         [system_message, {"role": "user", "content": "user_message_1"}],
         stream=True,
+        cancel=mock.ANY,
+        batch_deltas=False,
     )
     listener_mock.on_chat_message.assert_has_calls(
         [
@@ -130,6 +144,8 @@ def test_rerun():
     assistant_mock.complete_chat.assert_called_once_with(
         [system_message, {"role": "user", "content": "user_message"}],
         stream=True,
+        cancel=mock.ANY,
+        batch_deltas=False,
     )
     listener_mock.on_chat_message.assert_has_calls(
         [
@@ -152,6 +168,8 @@ def test_rerun():
     assistant_mock.complete_chat.assert_called_once_with(
         [system_message, {"role": "user", "content": "user_message"}],
         stream=True,
+        cancel=mock.ANY,
+        batch_deltas=False,
     )
     listener_mock.on_chat_message.assert_has_calls(
         [
@@ -216,6 +234,8 @@ def test_openai_error():
     assistant_mock.complete_chat.assert_called_once_with(
         [system_message, user_message],
         stream=True,
+        cancel=mock.ANY,
+        batch_deltas=False,
     )
     listener_mock.on_chat_message.assert_has_calls(
         [
@@ -238,3 +258,214 @@ def test_stream():
     response_streamer_mock.assert_has_calls(
         [mock.call.on_next_token(token) for token in assistant_message]
     )
+
+
+def test_pipeline():
+    assistant_mock = setup_assistant_mock()
+    listener_mock, response_streamer_mock = setup_listener_mock()
+    session = ChatSession(
+        assistant_mock, listener_mock, pipeline=True, batch_deltas=True
+    )
+
+    assistant_message = "assistant message"
+    assistant_mock.complete_chat.return_value = (
+        MessageDeltaEvent(tok) for tok in list(assistant_message)
+    )
+
+    session.process_input("user message")
+
+    # The assistant reads the stream on its own thread, the session only asks it to
+    # batch the deltas
+    assert assistant_mock.complete_chat.call_args.kwargs["batch_deltas"]
+    response_streamer_mock.assert_has_calls(
+        [mock.call.on_next_token(token) for token in assistant_message]
+    )
+    listener_mock.on_chat_message.assert_has_calls(
+        [mock.call({"role": "assistant", "content": assistant_message})]
+    )
+    assert session.pipeline_stats is assistant_mock.last_pipeline_stats
+
+
+def test_interrupt_cancels_the_request():
+    assistant_mock, listener_mock, session = setup_session()
+
+    def completion_iter():
+        yield MessageDeltaEvent("partial")
+        raise KeyboardInterrupt()
+
+    usage = UsageEvent(prompt_tokens=10, completion_tokens=2, total_tokens=12, cost=1)
+    assistant_mock.complete_chat.return_value = completion_iter()
+    assistant_mock.cancelled_usage.return_value = usage
+
+    session.process_input("user message")
+
+    cancel = assistant_mock.complete_chat.call_args.kwargs["cancel"]
+    assert cancel.cancelled
+    assistant_mock.cancelled_usage.assert_called_once_with()
+    listener_mock.on_chat_response.assert_called_once_with(
+        mock.ANY, {"role": "assistant", "content": "partial"}, usage
+    )
+
+
+class ListInputProvider:
+    def __init__(self, inputs):
+        self.inputs = list(inputs)
+
+    def get_user_input(self):
+        return self.inputs.pop(0)
+
+
+def test_queued_input():
+    assistant_mock, listener_mock, _ = setup_session()
+    session = ChatSession(assistant_mock, listener_mock, queue_input=True)
+    assistant_mock.complete_chat.side_effect = lambda messages, **kwargs: [
+        MessageDeltaEvent(f"answer {len(messages) // 2}")
+    ]
+    side_assistant = assistant_mock.fork.return_value
+    side_assistant.complete_chat.side_effect = assistant_mock.complete_chat.side_effect
+
+    session.loop(ListInputProvider(["first", "&aside", "second", ":q"]))
+
+    assert session.messages == [
+        system_message,
+        {"role": "user", "content": "first"},
+        {"role": "assistant", "content": "answer 1"},
+        {"role": "user", "content": "second"},
+        {"role": "assistant", "content": "answer 2"},
+    ]
+    # The aside is answered on top of the conversation so far, but not added to it,
+    # by a fork of the assistant so that the state of the turn's request is kept
+    assert all(
+        call.args[0][-1]["content"] != "aside"
+        for call in assistant_mock.complete_chat.call_args_list
+    )
+    aside_messages = [
+        call.args[0] for call in side_assistant.complete_chat.call_args_list
+    ]
+    assert len(aside_messages) == 1
+    assert aside_messages[0][-1]["content"] == "aside"
+    listener_mock.on_chat_response.assert_any_call(
+        aside_messages[0], {"role": "assistant", "content": mock.ANY}, None
+    )
+    listener_mock.on_chat_end.assert_called_once()
+
+
+def queued_session(*inputs):
+    """
+    A session with queued input, reading `inputs`, which are strings or callables
+    returning strings.
+    """
+    assistant_mock, listener_mock, _ = setup_session()
+    session = ChatSession(assistant_mock, listener_mock, queue_input=True)
+    remaining = list(inputs)
+
+    def get_user_input():
+        next_input = remaining.pop(0)
+        return next_input() if callable(next_input) else next_input
+
+    input_provider = mock.Mock()
+    input_provider.get_user_input.side_effect = get_user_input
+    return assistant_mock, listener_mock, session, input_provider
+
+
+def test_interrupt_stops_side_turns():
+    started = threading.Event()
+
+    def interrupt():
+        assert started.wait(5)
+        assert session.interrupt()
+        return ":q"
+
+    assistant_mock, listener_mock, session, input_provider = queued_session(
+        "&aside", interrupt
+    )
+
+    def side_turn(messages, stream, cancel):
+        yield MessageDeltaEvent("partial")
+        aborted = threading.Event()
+        cancel.register(aborted.set)
+        started.set()
+        # Stalled until the request is aborted
+        assert aborted.wait(5)
+
+    side_assistant = assistant_mock.fork.return_value
+    side_assistant.complete_chat.side_effect = side_turn
+    session.loop(input_provider)
+
+    side_assistant.cancelled_usage.assert_called_once_with()
+    listener_mock.on_chat_response.assert_called_once_with(
+        mock.ANY,
+        {"role": "assistant", "content": "partial"},
+        side_assistant.cancelled_usage.return_value,
+    )
+
+
+def test_side_turn_errors_are_raised():
+    assistant_mock, _, session, input_provider = queued_session("&aside", ":q")
+    assistant_mock.fork.return_value.complete_chat.side_effect = RuntimeError("bug")
+
+    with pytest.raises(RuntimeError):
+        session.loop(input_provider)
+
+
+def test_interrupt_aborts_the_current_response():
+    assistant_mock, listener_mock, session = setup_session()
+    assert not session.interrupt()
+
+    def completion_iter(messages, stream, cancel, batch_deltas):
+        yield MessageDeltaEvent("partial")
+        # Ctrl-C pressed in the input prompt while the response streams
+        assert session.interrupt()
+        if not cancel.cancelled:
+            yield MessageDeltaEvent(" never shown")
+
+    assistant_mock.complete_chat.side_effect = completion_iter
+    session.process_input("user message")
+
+    assistant_mock.cancelled_usage.assert_called_once_with()
+    assert session.messages[-1] == {"role": "assistant", "content": "partial"}
+    assert not session.interrupt()
+
+
+def test_context(tmp_path):
+    assistant_mock, listener_mock, session = setup_session()
+    with open(tmp_path / "auth.py", "w") as f:
+        f.write("def check_password(user, password):\n    pass\n")
+
+    session.process_input(f":context {tmp_path}")
+    listener_mock.on_context_change.assert_called_once_with([str(tmp_path)], 1)
+
+    assistant_mock.complete_chat.return_value = [MessageDeltaEvent("answer")]
+    session.process_input("Where is the password checked?")
+
+    sent = assistant_mock.complete_chat.call_args.args[0]
+    assert "def check_password" in sent[-1]["content"]
+    assert sent[-1]["content"].endswith("Where is the password checked?")
+    # The context is not kept in the conversation
+    assert session.messages[-2] == {
+        "role": "user",
+        "content": "Where is the password checked?",
+    }
+
+    session.process_input(":context missing-dir")
+    listener_mock.on_error.assert_called_once()
+    session.process_input(":context")
+    assert session.context is None
+
+
+def test_seed():
+    assistant_mock, _, session = setup_session()
+    previous = [
+        {"role": "user", "content": "question"},
+        {"role": "assistant", "content": "answer"},
+    ]
+    session.seed(previous)
+
+    assistant_mock.complete_chat.return_value = [MessageDeltaEvent("new answer")]
+    session.process_input(":r")
+    assistant_mock.complete_chat.assert_called_once_with(
+        [system_message, previous[0]],
+        stream=True,
+        cancel=mock.ANY,
+        batch_deltas=False,
+    )
@@ -0,0 +1,56 @@
+import io
+import json
+from unittest import mock
+
+from gptcli.completion import MessageDeltaEvent, ThinkingDeltaEvent, UsageEvent
+from gptcli.shell import JsonlEventWriter, simple_response
+
+
+def test_jsonl_writer():
+    clock = mock.MagicMock(side_effect=[100.0, 100.5])
+    stream = io.StringIO()
+    writer = JsonlEventWriter(stream, clock=clock)
+    writer.write(MessageDeltaEvent("hi"))
+
+    assert stream.getvalue() == (
+        '{"text":"hi","type":"message_delta","ts":100.5,"elapsed":0.5}\n'
+    )
+
+
+def test_simple_response_jsonl(capsys):
+    assistant = mock.MagicMock()
+    assistant.init_messages.return_value = []
+    usage = UsageEvent(prompt_tokens=1, completion_tokens=2, total_tokens=3, cost=0.5)
+    assistant.complete_chat.return_value = [
+        ThinkingDeltaEvent("hmm"),
+        MessageDeltaEvent("hello"),
+        usage,
+    ]
+
+    simple_response(assistant, "prompt", stream=True, output_format="jsonl")
+
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [line["type"] for line in lines] == [
+        "thinking_delta",
+        "message_delta",
+        "usage",
+    ]
+    assert lines[1]["text"] == "hello"
+    assert lines[2]["cost"] == 0.5
+    assert all("ts" in line and "elapsed" in line for line in lines)
+
+
+def test_simple_response_json_items(capsys):
+    assistant = mock.MagicMock()
+    assistant.init_messages.return_value = []
+    assistant.complete_chat.return_value = [
+        MessageDeltaEvent('{"name": "Ada", "ro'),
+        MessageDeltaEvent('les": ["math"]}'),
+    ]
+
+    simple_response(assistant, "prompt", stream=True, json_output=True)
+
+    assert capsys.readouterr().out.splitlines() == [
+        '{"name": "Ada"}',
+        '{"roles": ["math"]}',
+    ]
@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+from gptcli.tools import Tool, ToolExecutor, load_tools
+
+
+def slow_echo(text: str, delay: float = 0.2) -> str:
+    time.sleep(delay)
+    return text
+
+
+def test_command_arguments_are_quoted():
+    tool = Tool("echo", {"command": "printf '%s|' {text}; cat"})
+    assert tool({"text": "a b; rm -rf /"}) == 'a b; rm -rf /|{"text": "a b; rm -rf /"}'
+
+
+def test_command_failure():
+    executor = ToolExecutor([Tool("fail", {"command": "echo oops >&2; exit 3"})])
+    (result,) = executor.run([{"id": "1", "name": "fail", "arguments": {}}])
+    assert result.error == "Exited with status 3: oops"
+    assert result.message() == {
+        "role": "tool",
+        "content": "Error: Exited with status 3: oops",
+        "tool_call_id": "1",
+        "name": "fail",
+    }
+
+
+def test_function_tool():
+    tool = Tool("echo", {"function": "tests.test_tools:slow_echo", "timeout": 0.05})
+    assert tool.definition()["parameters"] == {"type": "object", "properties": {}}
+    executor = ToolExecutor([tool])
+
+    (result,) = executor.run(
+        [{"id": "1", "name": "echo", "arguments": {"text": "hi", "delay": 1}}]
+    )
+    assert result.error == "Timed out after 0.05s"
+
+    (result,) = executor.run(
+        [{"id": "1", "name": "echo", "arguments": {"text": "hi", "delay": 0}}]
+    )
+    assert result.output == "hi"
+
+
+def test_calls_run_concurrently():
+    tool = Tool("echo", {"function": "tests.test_tools:slow_echo"})
+    executor = ToolExecutor([tool])
+    calls = [
+        {"id": str(i), "name": "echo", "arguments": {"text": str(i)}} for i in range(4)
+    ]
+    calls.append({"id": "x", "name": "missing", "arguments": {}})
+
+    started_at = time.perf_counter()
+    results = list(executor.run(calls))
+    assert time.perf_counter() - started_at < 0.6
+
+    # Results come as they complete
+    assert results[0].error == "Unknown tool `missing`"
+    assert sorted(r.output for r in results[1:]) == ["0", "1", "2", "3"]
+    assert all(r.latency >= 0.2 for r in results[1:])
+
+
+def test_load_tools():
+    configs = {"echo": {"command": "echo"}, "both": {"command": "a", "function": "b"}}
+    assert [tool.name for tool in load_tools(["echo"], configs)] == ["echo"]
+    with pytest.raises(ValueError, match="Unknown tool `grep`"):
+        load_tools(["grep"], configs)
+    with pytest.raises(ValueError, match="either a `command` or a `function`"):
+        load_tools(["both"], configs)
@@ -0,0 +1,65 @@
+import json
+from unittest import mock
+
+from gptcli import tracing
+from gptcli.assistant import Assistant
+from gptcli.completion import MessageDeltaEvent
+from gptcli.session import ChatListener, ChatSession
+
+
+def read_spans(path):
+    spans = []
+    with open(path) as f:
+        for line in f:
+            document = json.loads(line)
+            for resource_spans in document["resourceSpans"]:
+                for scope_spans in resource_spans["scopeSpans"]:
+                    spans.extend(scope_spans["spans"])
+    # The first span with every name, i.e. the one from the first turn
+    by_name = {}
+    for span in spans:
+        by_name.setdefault(span["name"], span)
+    return by_name
+
+
+def test_noop_tracer_by_default():
+    tracer = tracing.get_tracer()
+    assert not tracer.enabled
+    with tracer.span("span") as span:
+        span.set_attribute("key", "value")
+    assert tracer.current_span() is None
+
+
+def test_session_turn_is_traced(tmp_path, monkeypatch):
+    path = tmp_path / "trace.jsonl"
+    monkeypatch.setattr(tracing, "tracer", tracing.Tracer(str(path)))
+
+    provider_mock = mock.MagicMock()
+    provider_mock.complete.return_value = iter(
+        [MessageDeltaEvent("a"), MessageDeltaEvent("b")]
+    )
+    monkeypatch.setattr(
+        "gptcli.assistant.get_completion_provider", lambda *args: provider_mock
+    )
+
+    session = ChatSession(Assistant({"model": "gpt-4o"}), ChatListener())
+    input_provider = mock.MagicMock()
+    input_provider.get_user_input.side_effect = ["hello", ":q"]
+    session.loop(input_provider)
+
+    spans = read_spans(path)
+    turn = spans["chat_session.turn"]
+    respond = spans["chat_session.respond"]
+    complete_chat = spans["assistant.complete_chat"]
+
+    assert turn["parentSpanId"] == ""
+    assert respond["parentSpanId"] == turn["spanId"]
+    assert complete_chat["parentSpanId"] == respond["spanId"]
+    assert spans["provider.setup"]["parentSpanId"] == complete_chat["spanId"]
+    assert spans["provider.stream"]["parentSpanId"] == complete_chat["spanId"]
+    assert spans["listeners.exit"]["parentSpanId"] == respond["spanId"]
+    assert spans["listeners.on_chat_response"]["parentSpanId"] == respond["spanId"]
+    assert {
+        attribute["key"]: attribute["value"] for attribute in respond["attributes"]
+    }["listeners.dispatch_calls"] == {"intValue": "2"}
+    assert all(span["traceId"] == turn["traceId"] for span in spans.values())